@@ -1,18 +1,49 @@
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 import asyncio
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 import json
 import os
 import httpx
-import paramiko
-import pandas as pd
+import employee_index
+import export_files
+import exports
+import keka_http
+import profiling
+import row_cache
+import run_report
+import snapshot
+import sync_runs
+import time
+import webhooks
 from datetime import datetime
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Syncs and employee lookups start from the last directory snapshot, refreshed in the background
+    await asyncio.to_thread(employee_index.load_latest)
+    scheduler = asyncio.create_task(refresh_directory_periodically())
+    yield
+    scheduler.cancel()
+    if _directory_refresh is not None:
+        _directory_refresh.task.cancel()
+    if _snapshot_writer is not None:
+        _snapshot_writer.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 load_dotenv()
 
+KEKA_API_BASE = os.getenv("KEKA_API_BASE", "https://company.keka.com/api/v1")
+# Background directory pulls: how old the snapshot may get before one starts (0 disables them)
+DIRECTORY_REFRESH_SECONDS = int(os.getenv("DIRECTORY_REFRESH_SECONDS", "3600"))
+# How long webhook changes are batched before the directory snapshot is rewritten
+WEBHOOK_SNAPSHOT_SECONDS = float(os.getenv("WEBHOOK_SNAPSHOT_SECONDS", "30"))
+
 
 async def fetch_access_token():
     """ Fetch access token with yield-based streaming """
@@ -38,7 +69,7 @@ async def fetch_access_token():
 
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, data=payload)
+            response = await keka_http.post_async(client, url, headers, payload)
 
         if response.status_code == 200:
             token_data = response.json()
@@ -57,19 +88,40 @@ async def fetch_access_token():
         # yield None
 
 
+class Progress:
+    """A progress message from a pipeline stage, formatted for the SSE stream."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class DirectoryResult:
+    """The employees a directory pull fetched, and the error that cut it short, if any."""
+
+    def __init__(self, employees, error=None):
+        self.employees = employees
+        self.error = error
+
+
 async def call_second_api(access_token):
-    """ Fetch employee data page by page """
+    """ Fetch employee data page by page
+
+    Yields Progress messages while paging, then one DirectoryResult. The
+    directory is handed over as the list itself, never serialised in process.
+    """
     headers = {"Authorization": f"Bearer {access_token}",
                "Accept": "application/json"}
     all_employees = []
+    error = None
     page = 1
 
     async with httpx.AsyncClient() as client:
         while True:
-            emp_url = f"https://company.keka.com/api/v1/hris/employees?pageNumber={page}&pageSize=200"
+            emp_url = f"{KEKA_API_BASE}/hris/employees?pageNumber={page}&pageSize=200"
 
             try:
-                response = await client.get(emp_url, headers=headers)
+                # Paced by the host-wide rate limit shared with the cron and bridge runs
+                response = await keka_http.get_async(client, emp_url, headers, os.getenv('API_KEY'))
 
                 if response.status_code == 200:
                     data = response.json()
@@ -86,240 +138,280 @@ async def call_second_api(access_token):
                     all_employees.extend(employees)
                     print(
                         f"page={page}, total pages={total_pages}")
-                    # yield json.dumps({"message": f"Fetched page {page} of {total_pages}"})
                     if page == 1:
-                        yield f"data: Total Pages {total_pages}\n\n"
+                        yield Progress(f"data: Total Pages {total_pages}\n\n")
                     if page % 5 == 0:
-                        yield f"data: || page: {page:03d} ||\n"
+                        yield Progress(f"data: || page: {page:03d} ||\n")
                     else:
-                        yield f"data: || page: {page:03d} || "
+                        yield Progress(f"data: || page: {page:03d} || ")
 
                     if page >= total_pages:
                         break
 
                     page += 1
-                    await asyncio.sleep(1)
                 else:
-                    yield json.dumps({"error": f"Failed to fetch employee data. Status code: {response.status_code}"})
+                    error = f"Failed to fetch employee data. Status code: {response.status_code}"
+                    yield Progress(json.dumps({"error": error}))
                     break
 
             except httpx.RequestError as e:
-                yield json.dumps({"error": f"Request failed: {str(e)}"})
+                error = f"Request failed: {str(e)}"
+                yield Progress(json.dumps({"error": error}))
                 break
 
-    # Ensure final data is properly formatted
-    yield json.dumps({"employees": all_employees})
+    yield DirectoryResult(all_employees, error)
+
+
+class DirectoryRefresh:
+    """One directory pull running as a task; any number of syncs can follow its progress messages."""
+
+    def __init__(self):
+        self.messages = []
+        self.employees = None
+        self.done = False
+        # Syncs following the pull; when the last one is cancelled, so is the pull,
+        # unless the background schedule also wants its result
+        self.followers = 0
+        self.background = False
+        self.started_at = time.time()
+        self._changed = asyncio.Condition()
+        self.task = asyncio.create_task(self._run())
+
+    async def _publish(self, message):
+        async with self._changed:
+            self.messages.append(message)
+            self._changed.notify_all()
+
+    async def _run(self):
+        profiler = profiling.Profiler("directory", os.getenv('TARTGET_FILE_PATH'))
+        # Every pull is its own run, whichever sync or schedule started it
+        report = run_report.RunReport("directory", profiler.folder, profiler.run_id)
+        with report.activate():
+            try:
+                await self._publish("data: Connecting to KEKA...... \n\n")
+                with profiler.stage("token_fetch"):
+                    access_token = await fetch_access_token()
+                if not access_token:
+                    await self._publish("data: Failed to retrieve access token\n\n")
+                    report.finish(1)
+                    return
+                await self._publish("data: Connected to KEKA \n\n")
+
+                result = DirectoryResult([], "The directory fetch ended without a result")
+                with profiler.stage("directory_fetch"):
+                    async for item in call_second_api(access_token):
+                        if isinstance(item, DirectoryResult):
+                            result = item
+                        else:
+                            await self._publish(item.message)  # Stream messages as they arrive
+
+                employee_data = result.employees
+                run_report.add_records("directory", len(employee_data))
+                if result.error:
+                    # A partial directory would read as mass deletions in the next export
+                    report.error = result.error
+                elif not employee_data:
+                    report.finish(1)
+                else:
+                    await asyncio.to_thread(snapshot.save_snapshot, employee_data)
+                    await asyncio.to_thread(employee_index.refresh, employee_data)
+                    # The pull may have read pages from before webhook changes that arrived meanwhile
+                    if await asyncio.to_thread(webhooks.replay_since, self.started_at):
+                        schedule_snapshot_save()
+                    self.employees = employee_data
+            except Exception as e:
+                report.error = f"{type(e).__name__}: {e}"
+                print(f"❌ Directory refresh failed: {e}")
+                await self._publish(f"data: Directory refresh failed: {e}\n\n")
+            finally:
+                async with self._changed:
+                    self.done = True
+                    self._changed.notify_all()
+
+    async def follow(self):
+        """Every progress message so far, then each new one until the pull finishes."""
+        sent = 0
+        self.followers += 1
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.done or len(self.messages) > sent)
+                    pending, done = self.messages[sent:], self.done
+                sent += len(pending)
+                for message in pending:
+                    yield message
+                if done:
+                    return
+        except asyncio.CancelledError:
+            if self.followers == 1 and not self.background:
+                print("🔌 Nobody is waiting for the directory pull any more, cancelling it")
+                self.task.cancel()
+            raise
+        finally:
+            self.followers -= 1
+
+
+_directory_refresh = None
+
+
+def start_directory_refresh(background=False):
+    """The in-flight directory pull, starting one if none is running (single flight)."""
+    global _directory_refresh
+    if _directory_refresh is None or _directory_refresh.done:
+        _directory_refresh = DirectoryRefresh()
+    _directory_refresh.background = _directory_refresh.background or background
+    return _directory_refresh
+
+
+def directory_is_stale(index):
+    return index is None or (DIRECTORY_REFRESH_SECONDS > 0 and index.age_seconds() >= DIRECTORY_REFRESH_SECONDS)
+
+
+async def refresh_directory_periodically():
+    if DIRECTORY_REFRESH_SECONDS <= 0:
+        return
+    while True:
+        index = employee_index.current()
+        if directory_is_stale(index):
+            refresh = start_directory_refresh(background=True)
+            await asyncio.wait({refresh.task})
+            index = employee_index.current()
+        # Retry a failed pull after a minute rather than a whole interval
+        wait_seconds = DIRECTORY_REFRESH_SECONDS - index.age_seconds() if index else 60
+        await asyncio.sleep(max(wait_seconds, 60))
+
+
+_snapshot_writer = None
+_webhook_snapshot_path = None
+
+
+async def write_snapshot_later():
+    """Save the live index's directory once the current burst of webhook changes has settled."""
+    global _snapshot_writer, _webhook_snapshot_path
+    try:
+        await asyncio.sleep(WEBHOOK_SNAPSHOT_SECONDS)
+    finally:
+        _snapshot_writer = None
+    index = employee_index.current()
+    path = await asyncio.to_thread(snapshot.save_snapshot, index.employees, None, index.fetched_at)
+    # Keep only the newest webhook-written snapshot next to the pulled ones
+    previous, _webhook_snapshot_path = _webhook_snapshot_path, path
+    if previous and previous != path and os.path.exists(previous):
+        os.remove(previous)
+    print(f"🪝 Directory snapshot with webhook changes saved at {path}")
 
 
-def extract_band_value(band_info):
-    # Split the band_info string by space and return the second part (the value after "band")
-    parts = band_info.split()
-    if len(parts) > 1:
-        return parts[1]  # Return the second part (value after "band")
-    return None  # Return None if the string doesn't contain a valid value after "band"
+def schedule_snapshot_save():
+    global _snapshot_writer
+    if _snapshot_writer is None:
+        _snapshot_writer = asyncio.create_task(write_snapshot_later())
 
 
-async def upload_to_ftp(all_employees):
-    """ Upload data to FTP and stream progress """
-    yield "\n\n"
-    yield "data: Preparing data for FTP upload...\n\n"
+def sftp_put(local_path, remote_path, hostname, port, username, password=None, key_path=None):
+    """ Upload one file over SFTP with password auth, or with the RSA key at key_path """
+    import paramiko
 
-    hostname = os.getenv('FTP_HOST_NAME')
-    port = int(os.getenv('FTP_PORT'))
-    username = os.getenv('FTP_USER_NAME')
-    password = os.getenv('FTP_PASSWORD')
-    data_to_write = []
-    row_index = 0
-
-    all_employees = sorted(
-        all_employees, key=lambda x: x.get("employeeNumber", ""))
-
-    employee_data = all_employees
-
-    employee_data = [
-        record for record in employee_data
-        if record.get('email') and "nephroplus.com" in record['email'].lower()
-        if any(group.get("title") in ["Support Office", "Support Zones"] for group in record.get("groups", []))
-
-        # and record.get("employeeNumber") == "NP35549"
-    ]
-    yield f"data: Total employee_data {len(employee_data)}\n\n"
-    for employee in employee_data:
-        # print("========row_index", row_index)
-        # if employee.get("employmentStatus") == 0 and employee.get("employeeNumber") not in {'TEST001', 'TEST002', 'TEST003', 'TEST004', 'TEST005'} and employee.get('bandInfo'):
-        if employee.get("employmentStatus") == 0 and employee.get("employeeNumber") not in {'TEST001', 'TEST002', 'TEST003', 'TEST004', 'TEST005'} and employee.get('bandInfo'):
-            approver_employee_email = employee.get(
-                'reportsTo', {}).get('email', '')
-            approver_employee_info = next(
-                (emp for emp in all_employees if emp.get(
-                    'email') == approver_employee_email),
-                None
-            )
-
-            group_title = next(
-                (group['title'] for group in employee['groups'] if group['groupType'] == 3), None)
-
-            l2Manager_email = employee.get(
-                'l2Manager', {}).get('email', '')
-
-            l2Manager_info = next(
-                (emp for emp in all_employees if emp.get(
-                    'email') == l2Manager_email),
-                None
-            )
-            gender = None  # Default value
-            prefix = None
-            band_value = None
-            if employee.get('bandInfo'):
-                band_info = employee.get('bandInfo', {}).get(
-                    'title', 'NP Band')  # Default value is 'NP Band'
-                band_value = extract_band_value(band_info)
-
-            if employee.get('gender') == 1:
-                gender = 'M'
-            elif employee.get('gender') == 2:
-                gender = 'F'
-
-            if gender == "M":
-                prefix = "Mr"
-            elif gender == "F":
-                prefix = "Ms"
-
-            data_to_write.append([
-                '',
-                employee.get('email', ''),                     # Email
-                employee.get('employeeNumber', ''),            # EmployeeID
-                # Prefix (No info in given data)
-                prefix,
-                employee.get('firstName', ''),                  # FirstName
-                employee.get('middleName', ''),                 # MiddleName
-                employee.get('lastName', ''),                   # LastName
-                # Suffix (No info in given data)
-                '',
-                # Gender (No info in given data)
-                gender,
-                employee.get('jobTitle', {}).get(
-                    'title', ''),  # Title (Job Title)
-                employee.get(
-                    'reportsTo', {}).get('email', ''),
-                approver_employee_info.get(
-                    'employeeNumber', '') if approver_employee_info else '',  # ApproverEmail
-                # employee.get('reportsTo', {}).get('email', ''),  # ApproverEmail
-                # employee.get('reportsTo', {}).get(
-                #     'id', ''),    # ApproverEmployeeID
-                # Reporting1Data (No info in given data)
-                employee.get('employeeNumber', ''),
-                # Reporting2Data (No info in given data)
-                employee.get('jobTitle', {}).get('title', ''),
-                # Reporting3Data (No info in given data)
-                'Ops',
-                # Reporting4Data (No info in given data)
-                group_title,
-                # Reporting5Data (No info in given data)
-                '',
-                # Reporting6Data (No info in given data)
-                # employee.get('bandInfo', {}).get(
-                #     'title', 'NP Band') if employee.get('bandInfo') else None,
-                band_value,
-                # GroupIdentifier (No info in given data)
-                '8A5FA38D-592E-4EE5-9DC2-1A984EFF6E68',
-                # Email2Type (No info in given data)
-                'P',
-                # Email2 (No info in given data)
-                employee.get('email', 'Test@nephroplus.com'),
-                approver_employee_info.get(
-                    'displayName', '') if approver_employee_info else 'Test ',  # ApproverEmail
-                # employee.get('reportsTo', {}).get('email', ''),  # ApproverEmail
-                # DefaultApprover1Email
-                l2Manager_info.get(
-                    'email', '') if l2Manager_info else approver_employee_info.get('email', '') if approver_employee_info else 'Test@nephroplus.com',
-                # DefaultApprover1Name
-                l2Manager_info.get('displayName', '') if l2Manager_info else approver_employee_info.get(
-                    'displayName', '') if approver_employee_info else 'Test',
-                # DefaultApprover1Name
-                l2Manager_info.get(
-                    'employeeNumber', '') if l2Manager_info else approver_employee_info.get('displayName', '') if approver_employee_info else '',
-                # employee.get('l2Manager', {}).get(
-                #     'email', ''),     # DefaultApprover1EmployeeID
-                employee.get('mobilePhone', ''),                 # CellPhone
-                # OnlineEnabled (No info in given data)
-                'TRUE'
-            ])
-        row_index += 1
+    transport = paramiko.Transport((hostname, port))
+    sftp = None
+    try:
+        if key_path:
+            transport.connect(username=username, pkey=paramiko.RSAKey.from_private_key_file(key_path))
+        else:
+            transport.connect(username=username, password=password)
+        sftp = paramiko.SFTPClient.from_transport(transport)
+        sftp.put(local_path, remote_path)
+    finally:
+        # Close the SFTP session and transport
+        if sftp is not None:
+            sftp.close()
+        transport.close()
+
+
+def build_export(all_employees, profiler):
+    """ Filter, build rows, diff against the last upload, fill the template and write the CSV
+
+    CPU-bound, so upload_to_ftp runs it on a worker thread. Returns the progress
+    messages, the CSV path (None when nothing changed since the last upload) and
+    the full rows to record once the upload succeeds.
+    """
+    messages = []
+    with profiler.stage("filter"):
+        # Only the exported employees are sorted; manager lookups work over the unsorted directory
+        employee_data = exports.sort_employees(exports.filter_support_employees(all_employees))
+    messages.append(f"data: Total employee_data {len(employee_data)}\n\n")
+    run_report.add_records("support_employees", len(all_employees), len(employee_data))
+
+    cache = row_cache.get("nephrocare")
+    with profiler.stage("row_build"):
+        data_to_write = exports.build_rows(exports.build_nephrocare_rows, employee_data, all_employees, cache=cache)
+    if cache is not None:
+        messages.append(f"data: Rebuilt {cache.last_stats['rebuilt']} of {cache.last_stats['rows']} rows \n\n")
+    run_report.add_records("nephrocare_rows", len(employee_data), len(data_to_write))
+    current_rows = data_to_write
+
+    previous_rows = snapshot.load_export_rows("nephrocare")
+    if previous_rows is not None:
+        data_to_write, changes = exports.apply_import_actions(
+            data_to_write, previous_rows, delta_only=exports.nephrocare_export_mode() == "delta")
+        if not any(changes.values()):
+            messages.append("data: No changes since the last upload, skipping SFTP upload \n\n")
+            return messages, None, current_rows
+        messages.append(f"data: Changes since the last upload: {changes['add']} added, {changes['update']} updated, {changes['delete']} deleted \n\n")
     template_csv_path = os.getenv('TEMPLATE_FILE_PATH')
+    with profiler.stage("template_fill"):
+        df_template = exports.fill_template(template_csv_path, data_to_write, exports.NEPHROCARE_COLUMNS)
 
-    df_template = pd.read_csv(template_csv_path)
-
-    rows_needed = len(data_to_write)
-    start_row = 0
-    start_column = 0
-    # if len(df_template) < start_row + rows_needed:
-    #     additional_rows = start_row + rows_needed - len(df_template)
-    #     df_template = pd.concat([df_template, pd.DataFrame(
-    #         [[''] * df_template.shape[1]] * additional_rows)], ignore_index=True)
-
-    if len(df_template) < start_row + rows_needed:
-        additional_rows = start_row + rows_needed - len(df_template)
-
-        # Ensure the DataFrame has exactly 27 columns
-        if df_template.shape[1] < 27:
-            # Create a list of new column names to match 27 columns
-            required_columns = [f"Column_{i+1}" for i in range(27)]
-            current_columns = list(df_template.columns)
-            new_columns = [
-                col for col in required_columns if col not in current_columns]
-
-            for col in new_columns[:27 - df_template.shape[1]]:
-                df_template[col] = ''
-        elif df_template.shape[1] > 27:
-            # Truncate extra columns
-            df_template = df_template.iloc[:, :27]
-
-        # Add additional rows
-        df_template = pd.concat(
-            [df_template, pd.DataFrame(
-                [[''] * 27] * additional_rows, columns=df_template.columns)],
-            ignore_index=True)
-
-    # Insert the data into the template starting from the 4th row and 2nd column (index 1)
-    for i, row_data in enumerate(data_to_write):
-        row_index = start_row + i
-        for j, value in enumerate(row_data):
-            col_index = start_column + j
-            df_template.iloc[row_index, col_index] = value
-
-    yield "data: Generating to CSV \n\n"
+    messages.append("data: Generating to CSV \n\n")
 
     # Save the modified DataFrame back to CSV
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file_path = os.getenv('TARTGET_FILE_PATH')
     output_file_path = f"{output_file_path}/{timestamp}.csv"
     print("trying to save file in given path", output_file_path)
-    df_template.to_csv(output_file_path, index=False)
+    with profiler.stage("csv_write"):
+        df_template.to_csv(output_file_path, index=False)
     print("file saved at ", output_file_path)
-    yield f"data: Saved filet at {output_file_path} \n\n"
+    run_report.add_file_bytes("written", output_file_path)
+    messages.append(f"data: Saved filet at {output_file_path} \n\n")
+    return messages, output_file_path, current_rows
+
+
+async def upload_to_ftp(all_employees, profiler=None):
+    """ Upload data to FTP and stream progress """
+    profiler = profiler or profiling.Profiler("nephrocare", os.getenv('TARTGET_FILE_PATH'))
+    yield "\n\n"
+    yield "data: Preparing data for FTP upload...\n\n"
+
+    hostname = os.getenv('FTP_HOST_NAME')
+    port = int(os.getenv('FTP_PORT'))
+    username = os.getenv('FTP_USER_NAME')
+    password = os.getenv('FTP_PASSWORD')
+
+    # Off the event loop, so SSE clients and the homepage keep being served during the build
+    messages, output_file_path, current_rows = await asyncio.to_thread(build_export, all_employees, profiler)
+    for message in messages:
+        yield message
+    if output_file_path is None:
+        return
 
     ftp_folder_pathe = os.getenv('FTP_FOLDER')
-    remote_file_path = f"{ftp_folder_pathe}/{timestamp}.csv"
+    remote_file_path = f"{ftp_folder_pathe}/{os.path.basename(output_file_path)}"
 
     print("trying to save file at FTP", remote_file_path)
     yield f"data: Trying to save file at SFTP  at {remote_file_path} \n\n"
 
-    transport = paramiko.Transport((hostname, port))
+    def upload_and_record():
+        with profiler.stage("upload"):
+            sftp_put(output_file_path, remote_file_path, hostname, port, username, password)
+        run_report.add_file_bytes("uploaded", output_file_path)
+        snapshot.save_export_rows("nephrocare", current_rows)
 
-    try:
-        transport.connect(username=username, password=password)
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        sftp.put(output_file_path, remote_file_path)
-        yield f"data: File successfully upload to SFTP  at {remote_file_path} \n\n"
+    # Once started, the upload and its row snapshot finish even if the sync is cancelled
+    await asyncio.shield(asyncio.to_thread(upload_and_record))
+    yield f"data: File successfully upload to SFTP  at {remote_file_path} \n\n"
 
-        print(
-            f"Successfully uploaded {output_file_path} to {remote_file_path}")
-
-    finally:
-        # Close the SFTP session and transport
-        sftp.close()
-        transport.close()
+    print(
+        f"Successfully uploaded {output_file_path} to {remote_file_path}")
 
 
 @app.get("/")
@@ -328,47 +420,161 @@ async def serve_homepage():
 # uvicorn app:app --host 0.0.0.0 --port 8000 --reload
 
 
-@app.get("/keka_sync")
-async def stream_data():
-    """ Stream process step by step """
-    async def event_stream():
-        yield f"data: Connecting to KEKA...... \n\n"
-        access_token = await fetch_access_token()  # Await the async function
-        if not access_token:
-            yield "data: Failed to retrieve access token\n\n"
-            return
-
-        yield f"data: Connected to KEKA \n\n"
-
-        employee_data = []
-        async for message in call_second_api(access_token):
-            # data = json.loads(message)
-            # if "employees" in data:  # Final employee list
-            #     employee_data = data["employees"]
-            # yield message  # Stream messages
-            try:
-                data = json.loads(message)  # Attempt to parse message as JSON
+@app.get("/exports")
+def list_exports(kind: str = None):
+    if kind is not None and kind not in export_files.EXPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown export kind {kind}")
+    return {"exports": export_files.list_exports(kind)}
+
+
+@app.get("/exports/{kind}/latest")
+def download_latest_export(kind: str, request: Request):
+    if kind not in export_files.EXPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown export kind {kind}")
+    path = export_files.latest_export(kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No {kind} export has been generated yet")
+    return export_files.file_response(request, path)
+
+
+@app.get("/exports/files/{name}")
+def download_export(name: str, request: Request):
+    # Plain def: hashing and compressing run in the threadpool, not on the event loop
+    path = export_files.resolve_export(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No export named {name}")
+    # Export names are timestamped and never rewritten
+    return export_files.file_response(request, path, cache_control="public, max-age=86400, immutable")
+
+
+def employee_index_or_503():
+    index = employee_index.current()
+    if index is None:
+        raise HTTPException(status_code=503, detail="No employee directory loaded yet; run /keka_sync first")
+    return index
+
+
+@app.get("/employees")
+async def list_employees(center: str = None, job_title: str = None, manager: str = None,
+                         status: int = None, q: str = None, offset: int = 0,
+                         limit: int = employee_index.DEFAULT_PAGE_SIZE):
+    """Filtered, paginated employee listing; `manager` is the L1 manager's NPID or email."""
+    index = employee_index_or_503()
+    total, employees = index.search(center, job_title, manager, status, q, offset, limit)
+    # Index records are plain JSON already; JSONResponse skips FastAPI's per-field encoding
+    return JSONResponse({"total": total, "offset": offset, "count": len(employees), "employees": employees,
+                         "snapshot": index.source, "loaded_at": index.loaded_at})
+
+
+@app.get("/employees/by-email/{email}")
+async def employee_by_email(email: str):
+    employee = employee_index_or_503().by_mail(email)
+    if employee is None:
+        raise HTTPException(status_code=404, detail=f"No employee with email {email}")
+    return JSONResponse(employee)
+
+
+@app.get("/employees/{employee_number}")
+async def employee_by_npid(employee_number: str):
+    employee = employee_index_or_503().by_npid(employee_number)
+    if employee is None:
+        raise HTTPException(status_code=404, detail=f"No employee with NPID {employee_number}")
+    return JSONResponse(employee)
+
+
+@app.get("/centers")
+async def list_centers():
+    return {"centers": employee_index_or_503().centers()}
+
+
+@app.post("/employees/reload")
+async def reload_employees():
+    """Pick up a snapshot written outside the app, e.g. by `python cli.py directory`."""
+    index = await asyncio.to_thread(employee_index.load_latest)
+    if index is None:
+        raise HTTPException(status_code=404, detail="No directory snapshot on disk")
+    return {"employees": len(index), "snapshot": index.source, "loaded_at": index.loaded_at}
+
+
+@app.post("/webhooks/keka")
+async def keka_webhook(request: Request):
+    """Employee change events from Keka; see webhooks.py for the format and signing."""
+    if not webhooks.secret():
+        raise HTTPException(status_code=503, detail="KEKA_WEBHOOK_SECRET is not set")
+    body = await request.body()
+    try:
+        webhooks.verify(body, request.headers.get(webhooks.TIMESTAMP_HEADER),
+                        request.headers.get(webhooks.SIGNATURE_HEADER))
+        events = webhooks.parse_events(body)
+    except PermissionError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        result = await asyncio.to_thread(webhooks.apply_events, events)
+    except LookupError as e:
+        # Keka redelivers on errors; by then the first pull may have finished
+        raise HTTPException(status_code=503, detail=str(e))
+    if result["applied"]:
+        schedule_snapshot_save()
+    return result
 
-                if isinstance(data, dict) and "employees" in data:  # Ensure it's a dictionary
-                    employee_data = data["employees"]
-                else:
-                    yield message  # Stream messages as they arrive
 
-            except json.JSONDecodeError:
-                yield message
+@app.get("/keka_sync/runs")
+async def list_sync_runs():
+    return {"runs": sync_runs.recent_runs()}
 
-        if not employee_data:
-            yield "data: No employees found\n\n"
-            return
-        yield f"data: Total Pages {len(employee_data)}\n\n"
-        print("================", len(employee_data))
-        # yield f"data: Total Records {len(employee_data)}\n"
 
-        # employees_gen = call_second_api(access_token)
-        # async for message in employees_gen:
-        #     yield message
+@app.get("/keka_sync/runs/{run_id}")
+async def get_sync_run(run_id: int):
+    run = sync_runs.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"No sync run {run_id}")
+    return run.to_dict()
 
-        async for upload_msg in upload_to_ftp(employee_data):
-            yield upload_msg
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+@app.get("/keka_sync")
+async def stream_data(request: Request, wait: bool = False, on_disconnect: str = None):
+    """ Stream process step by step
+
+    Exports straight away from the freshest directory snapshot, starting a
+    background refresh when it is stale. With ?wait=true, or when there is no
+    snapshot yet, it follows the in-flight (or a new) directory pull instead
+    and exports its result. `on_disconnect` (cancel or detach, default
+    SYNC_ON_DISCONNECT) says what happens if the client goes away mid-sync.
+    """
+    async def event_stream():
+        # Stages spanning an await also profile whatever else the event loop runs meanwhile
+        profiler = profiling.Profiler("nephrocare", os.getenv('TARTGET_FILE_PATH'))
+        report = run_report.RunReport("nephrocare", profiler.folder, profiler.run_id)
+        with report.activate():
+            index = employee_index.current()
+            if wait or index is None:
+                refresh = start_directory_refresh()
+                async for message in refresh.follow():
+                    yield message
+                index = employee_index.current()
+                if refresh.employees is None and index is not None:
+                    yield "data: Directory pull failed, exporting from the previous snapshot \n\n"
+            else:
+                yield f"data: Using the directory snapshot from {int(index.age_seconds() // 60)} minutes ago \n\n"
+                if directory_is_stale(index):
+                    start_directory_refresh(background=True)
+                    yield "data: Refreshing the directory snapshot in the background \n\n"
+
+            employee_data = index.employees if index else []
+            if not employee_data:
+                yield "data: No employees found\n\n"
+                report.finish(1)
+                return
+            yield f"data: Total Pages {len(employee_data)}\n\n"
+            print("================", len(employee_data))
+
+            async for upload_msg in upload_to_ftp(employee_data, profiler):
+                yield upload_msg
+
+    if (on_disconnect or sync_runs.default_policy()) not in sync_runs.POLICIES:
+        raise HTTPException(status_code=400, detail=f"on_disconnect must be one of {sync_runs.POLICIES}")
+    run = sync_runs.SyncRun(event_stream(), on_disconnect)
+    return StreamingResponse(run.stream(request), media_type="text/event-stream",
+                             headers={"X-Sync-Run": str(run.id)})
@@ -1,12 +1,14 @@
-import json
+import asyncio
 import os
 import requests
 from datetime import datetime, timedelta
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import pandas as pd
-import time
+import attendance_store
+import drive_uploader
+import exports
+import keka_http
+import profiling
+import run_report
+import tenants
 
 # === File paths ===
 TEMPLATE_FILE_PATH_DICE = os.getenv("TEMPLATE_FILE_PATH_DICE", "Dice_SFTP_Template.csv")
@@ -16,20 +18,35 @@ TARGET_FILE_PATH = os.getenv("TARGET_FILE_PATH", "output")  # output folder insi
 FTP_FOLDER = os.getenv("FTP_FOLDER", "Nephrocare")
 FTP_FOLDER_DICE = os.getenv("FTP_FOLDER_DICE", "nephroplus_hrms")
 
-# === Google Drive variables ===
-GDRIVE_FOLDER_ID = os.getenv("GDRIVE_FOLDER_ID")  # Folder ID from Google Drive
-SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE", "gcp_key.json")  # Path to service account file
+# === Keka API ===
+KEKA_API_BASE = os.getenv("KEKA_API_BASE", "https://company.keka.com/api/v1")
+KEKA_ATTENDANCE_API_BASE = os.getenv("KEKA_ATTENDANCE_API_BASE", "https://nephroplus.keka.com/api/v1")
+# Requests are paced by the host-wide limit in rate_limit.py (KEKA_RATE_LIMIT / KEKA_RATE_LIMITS)
 
 # Ensure output folder exists
 os.makedirs(TARGET_FILE_PATH, exist_ok=True)
 
 
+def target_folder():
+    return tenants.getenv("TARGET_FILE_PATH", TARGET_FILE_PATH)
+
+
+def attendance_workers():
+    """Concurrent attendance fetchers in the pipelined run; they share the API key's budget."""
+    return int(tenants.getenv("KEKA_ATTENDANCE_WORKERS", "1"))
+
+
+def attendance_mode():
+    """KEKA_ATTENDANCE_MODE: "pipelined" overlaps directory paging with attendance fetches, "sequential" is the old two-phase run."""
+    return tenants.getenv("KEKA_ATTENDANCE_MODE", "pipelined").lower()
+
+
 def fetch_access_token(api_key_attendance):
-    url = os.getenv('KEKA_URL')
-    client_id = os.getenv('CLIENT_ID')
-    client_secret = os.getenv('CLIENT_SECRET')
-    grant_type = os.getenv('GRANT_TYPE')
-    scope = os.getenv('SCOPE')
+    url = tenants.getenv('KEKA_URL')
+    client_id = tenants.getenv('CLIENT_ID')
+    client_secret = tenants.getenv('CLIENT_SECRET')
+    grant_type = tenants.getenv('GRANT_TYPE')
+    scope = tenants.getenv('SCOPE')
 
     payload = (
         f"grant_type={grant_type}&"
@@ -46,7 +63,7 @@ def fetch_access_token(api_key_attendance):
     }
 
     try:
-        response = requests.post(url, headers=headers, data=payload)
+        response = keka_http.post(url, headers, payload)
         if response.status_code == 200:
             token_data = response.json()
             return token_data.get("access_token")
@@ -58,27 +75,31 @@ def fetch_access_token(api_key_attendance):
         return None
 
 
-def call_second_api(access_token):
+def call_second_api(access_token, page_filter=None):
+    """The employee directory, page by page; `page_filter` (see exports.page_filter) reduces each page as it arrives."""
+    api_base = tenants.getenv("KEKA_API_BASE", KEKA_API_BASE)
     all_employees = []
+    directory_count = 0
     page = 1
     page_size = 200
 
     while True:
-        emp_url = f"https://company.keka.com/api/v1/hris/employees?pageNumber={page}&pageSize={page_size}"
+        emp_url = f"{api_base}/hris/employees?pageNumber={page}&pageSize={page_size}"
         headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
 
-        response = requests.get(emp_url, headers=headers)
+        response = keka_http.get(emp_url, headers, tenants.getenv('API_KEY'))
 
         if response.status_code == 200:
             data = response.json()
             employees = data.get("data", [])
             total_pages = data.get("totalPages", 0)
-            all_employees.extend(employees)
+            directory_count += len(employees)
+            all_employees.extend(page_filter(employees) if page_filter else employees)
             print(f"page={page}, total pages={total_pages}, time={datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
             if total_pages <= page:
+                run_report.add_records("directory_pull", directory_count, len(all_employees))
                 return all_employees
             page += 1
-            time.sleep(2)
         else:
             print(f"❌ Failed to fetch employee data. Status code: {response.status_code}, Response: {response.text}")
             break
@@ -93,60 +114,84 @@ def convert_timestamp(timestamp):
     return ""
 
 
-def upload_to_drive(file_path, file_name):
-    """Uploads the file to Google Drive (Shared Drive)."""
-    try:
-        creds = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE,
-            scopes=["https://www.googleapis.com/auth/drive"]
-        )
-        service = build("drive", "v3", credentials=creds)
+def convert_timestamps(values):
+    """Vectorized convert_timestamp over a column of punch dicts; malformed or missing -> ''."""
+    import pandas as pd
 
-        file_metadata = {"name": file_name}
-        if GDRIVE_FOLDER_ID:
-            file_metadata["parents"] = [GDRIVE_FOLDER_ID]
+    timestamps = values.map(lambda punch: punch.get("timestamp") if isinstance(punch, dict) else None)
+    timestamps = timestamps.where(timestamps.map(lambda ts: isinstance(ts, str)))
+    parsed = pd.to_datetime(timestamps, format="%Y-%m-%dT%H:%M:%SZ", errors="coerce")
+    return parsed.dt.strftime("%Y-%m-%d %H:%M:%S").fillna("").astype(object)
 
-        media = MediaFileUpload(file_path, mimetype="text/csv")
 
-        uploaded_file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields="id",
-            supportsAllDrives=True  # 🔹 Required for Shared Drives
-        ).execute()
+# Attendance payload fields in template order; Center and jobTitle come from the employee join
+ATTENDANCE_COLUMNS = attendance_store.COLUMNS
 
-        print(f"✅ File uploaded to Shared Drive with ID: {uploaded_file.get('id')}")
 
-    except Exception as e:
-        print(f"❌ Google Drive upload failed: {e}")
+def build_attendance_frame(employee_data, employee_attendance_data):
+    """Columnar transform of raw attendance records into template-ordered rows.
 
+    `employee_data` must already be filtered and sorted; the first employee with a
+    given employeeNumber wins, as the old per-record `next()` lookup did.
+    """
+    import pandas as pd
 
-def get_employee_attendance(employee_data, access_token, start_date=None, end_date=None):
-    if not start_date or not end_date:
-        twenty_one_days_ago =  (datetime.today() - timedelta(days=4)).strftime("%Y-%m-%d")
-        start_date = twenty_one_days_ago
-        end_date = twenty_one_days_ago
-    data_to_write = []
+    payload_columns = [col for col in ATTENDANCE_COLUMNS if col not in ("Center", "jobTitle")]
+    df_att = pd.DataFrame(employee_attendance_data, columns=payload_columns, dtype=object)
+    df_att["employeeNumber"] = df_att["employeeNumber"].fillna("")
 
-    # Filter employees
-    employee_data = sorted(
-        [
-            employee for employee in employee_data
-            if employee.get("employmentStatus") == 0
-            and employee.get("employeeNumber") not in {"TEST001", "TEST002", "TEST003", "TEST004", "TEST005"}
+    df_emp = pd.DataFrame({
+        "employeeNumber": [emp.get("employeeNumber") for emp in employee_data],
+        "Center": [
+            next((g['title'] for g in emp.get('groups', []) if g.get('groupType') == 3), None)
+            for emp in employee_data
         ],
+        "jobTitle": [emp.get('jobTitle', {}).get('title', '') for emp in employee_data],
+    }, dtype=object).drop_duplicates("employeeNumber")
+
+    df_rows = df_att.merge(df_emp, on="employeeNumber", how="left", sort=False)
+    df_rows["jobTitle"] = df_rows["jobTitle"].fillna("")
+    df_rows["firstInOfTheDay"] = convert_timestamps(df_rows["firstInOfTheDay"])
+    df_rows["lastOutOfTheDay"] = convert_timestamps(df_rows["lastOutOfTheDay"])
+    return df_rows[ATTENDANCE_COLUMNS]
+
+
+def upload_to_drive(file_path, file_name):
+    """Uploads the file to Google Drive (Shared Drive), skipping it if an identical copy is already there.
+
+    Raises drive_uploader.DriveUploadError so a failed upload fails the run instead of passing silently.
+    """
+    return drive_uploader.upload_file(file_path, file_name)
+
+
+def is_active_employee(employee):
+    return (employee.get("employmentStatus") == 0
+            and employee.get("employeeNumber") not in exports.TEST_EMPLOYEE_NUMBERS)
+
+
+# Attendance needs nothing from the other employees, so the pull drops them page by page
+ACTIVE_PAGE_FILTER = exports.page_filter(is_active_employee)
+
+
+def filter_active_employees(employee_data):
+    return sorted(
+        [employee for employee in employee_data if is_active_employee(employee)],
         key=lambda e: e.get("employeeNumber", "")
     )
 
+
+def fetch_attendance_records(employee_data, access_token, start_date, end_date):
     headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
+    api_key = tenants.getenv('API_KEY_ATTENDANCE')
+    api_base = tenants.getenv("KEKA_ATTENDANCE_API_BASE", KEKA_ATTENDANCE_API_BASE)
     employee_attendance_data = []
 
     for row_index, employee in enumerate(employee_data):
         emp_id = employee.get("id")
-        emp_url = f"https://nephroplus.keka.com/api/v1/time/attendance?employeeIds={emp_id}&from={start_date}&to={end_date}"
+        emp_url = f"{api_base}/time/attendance?employeeIds={emp_id}&from={start_date}&to={end_date}"
 
         try:
-            response = requests.get(emp_url, headers=headers)
+            response = keka_http.get(emp_url, headers, api_key)
             if response.status_code == 200:
                 result = response.json()
                 employee_attendance_data.extend(result.get("data", []))
@@ -154,84 +199,239 @@ def get_employee_attendance(employee_data, access_token, start_date=None, end_da
                 print(f"❌ Failed to fetch attendance for {employee.get('employeeNumber')}")
         except Exception as e:
             print(f"❌ Error fetching attendance: {e}")
-        time.sleep(1.5)
-
-    for att in employee_attendance_data:
-        employeeNumber = att.get("employeeNumber", "")
-        employee_info = next((rec for rec in employee_data if rec.get("employeeNumber") == employeeNumber), None)
-        group_title = None
-        if employee_info:
-            groups = employee_info.get('groups', [])
-            group_title = next((g['title'] for g in groups if g.get('groupType') == 3), None)
-
-        #first_name = employee_info.get("firstName", "") if employee_info else ""
-        #last_name = employee_info.get("lastName", "") if employee_info else ""
-        
-        first_in = att.get("firstInOfTheDay")
-        last_out = att.get("lastOutOfTheDay")
-        data_to_write.append([
-            att.get("id"),
-            employeeNumber,
-            #first_name,
-            #last_name,
-            group_title,
-            employee_info.get('jobTitle', {}).get('title', '') if employee_info else "",
-            att.get("attendanceDate"),
-            att.get("shiftStartTime"),
-            att.get("shiftEndTime"),
-            convert_timestamp(first_in.get("timestamp")) if isinstance(first_in, dict) else "",
-            convert_timestamp(last_out.get("timestamp")) if isinstance(last_out, dict) else "",
-            att.get("dayType"),
-            att.get("shiftDuration"),
-            att.get("shiftEffectiveDuration"),
-            att.get("totalGrossHours"),
-            att.get("totalEffectiveHours"),
-            att.get("totalBreakDuration"),
-            att.get("totalEffectiveOvertimeDuration"),
-            att.get("totalGrossOvertimeDuration")
-        ])
-
-    df_template = pd.read_csv(ATT_TEMPLATE_FILE_PATH)
-    rows_needed = len(data_to_write)
-    columns_count = 17
-
-    if len(df_template) < rows_needed:
-        additional_rows = rows_needed - len(df_template)
-        df_template = pd.concat([df_template, pd.DataFrame([['']*columns_count]*additional_rows, columns=df_template.columns)], ignore_index=True)
-
-    for i, row_data in enumerate(data_to_write):
-        for j, value in enumerate(row_data):
-            df_template.iloc[i, j] = value
+    return employee_attendance_data
+
+
+def default_attendance_dates(start_date=None, end_date=None):
+    if not start_date or not end_date:
+        twenty_one_days_ago =  (datetime.today() - timedelta(days=4)).strftime("%Y-%m-%d")
+        start_date = twenty_one_days_ago
+        end_date = twenty_one_days_ago
+    return start_date, end_date
+
+
+def fill_attendance_template(df_rows):
+    import pandas as pd
+
+    df_template = pd.read_csv(tenants.getenv("ATT_TEMPLATE_FILE_PATH", ATT_TEMPLATE_FILE_PATH))
+    df_rows.columns = df_template.columns
+    return pd.concat([df_rows, df_template.iloc[len(df_rows):]], ignore_index=True)
+
 
+def attendance_file_path(start_date, end_date):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file_name = f"att_{start_date}_{end_date}_{timestamp}.csv"
-    output_file_path = os.path.join(TARGET_FILE_PATH, output_file_name)
-    df_template.to_csv(output_file_path, index=False)
+    return os.path.join(target_folder(), output_file_name)
+
+
+def write_attendance_file(employee_data, employee_attendance_data, start_date, end_date, profiler):
+    """Build the attendance CSV from filtered, sorted employees and their records, then upload it."""
+    with profiler.stage("row_build"):
+        df_rows = build_attendance_frame(employee_data, employee_attendance_data)
+    run_report.add_records("attendance_rows", len(employee_attendance_data), len(df_rows))
+    if tenants.getenv("ATTENDANCE_STORE", "1") != "0":
+        with profiler.stage("store_upsert"):
+            try:
+                stored = attendance_store.upsert_frame(df_rows)
+                print(f"🗄️ Stored {stored} attendance rows in {attendance_store.db_path()}")
+            except Exception as e:
+                print(f"❌ Failed to update the attendance store: {e}")
+    with profiler.stage("template_fill"):
+        df_template = fill_attendance_template(df_rows)
+
+    output_file_path = attendance_file_path(start_date, end_date)
+    output_file_name = os.path.basename(output_file_path)
+    with profiler.stage("csv_write"):
+        df_template.to_csv(output_file_path, index=False)
     print(f"📂 Attendance file saved at: {output_file_path}")
+    run_report.add_file_bytes("written", output_file_path)
 
     # Upload to Google Drive
-    upload_to_drive(output_file_path, output_file_name)
+    with profiler.stage("upload"):
+        upload_to_drive(output_file_path, output_file_name)
+    run_report.add_file_bytes("uploaded", output_file_path)
+    return output_file_path
 
 
-def main():
-    api_key = os.getenv('API_KEY')
-    api_key_attendance = os.getenv('API_KEY_ATTENDANCE')
+def export_attendance_window(start_date, end_date, employee_number=None, center=None, output_file_path=None):
+    """Re-export stored attendance for a date window to the CSV template, without calling Keka."""
+    df_rows = attendance_store.query_frame(start_date, end_date, employee_number, center)
+    df_template = fill_attendance_template(df_rows)
+    output_file_path = output_file_path or attendance_file_path(start_date, end_date)
+    df_template.to_csv(output_file_path, index=False)
+    print(f"📂 Exported {len(df_rows)} stored attendance rows to {output_file_path}")
+    return output_file_path
 
-    list_access_token = fetch_access_token(api_key)
-    att_access_token = fetch_access_token(api_key_attendance)
 
-    if list_access_token and att_access_token:
-        api_response = call_second_api(list_access_token)
-        if api_response:
-            print(f"✅ Fetched employee data: {len(api_response)}")
-            get_employee_attendance(api_response, att_access_token)
-    else:
-        print("❌ Failed to obtain access tokens.")
+def get_employee_attendance(employee_data, access_token, start_date=None, end_date=None, profiler=None):
+    profiler = profiler or profiling.Profiler("attendance", target_folder())
+    start_date, end_date = default_attendance_dates(start_date, end_date)
 
+    # Filter employees
+    with profiler.stage("filter"):
+        directory_count = len(employee_data)
+        employee_data = filter_active_employees(employee_data)
+    run_report.add_records("active_employees", directory_count, len(employee_data))
+    with profiler.stage("attendance_fetch"):
+        employee_attendance_data = fetch_attendance_records(employee_data, access_token, start_date, end_date)
+    run_report.add_records("attendance_records", len(employee_data), len(employee_attendance_data))
 
-if __name__ == "__main__":
-    main()
+    write_attendance_file(employee_data, employee_attendance_data, start_date, end_date, profiler)
 
 
+async def _produce_directory(access_token, employee_queue, workers):
+    """Page through the directory, queueing each page's active employees as soon as it arrives.
 
+    Returns False if a page failed. Always ends the queue with one None per worker.
+    """
+    page = 1
+    page_size = 200
+    headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
+    api_base = tenants.getenv("KEKA_API_BASE", KEKA_API_BASE)
+    position = 0
+    directory_count = 0
+    try:
+        while True:
+            emp_url = f"{api_base}/hris/employees?pageNumber={page}&pageSize={page_size}"
+            response = await asyncio.to_thread(keka_http.get, emp_url, headers, tenants.getenv('API_KEY'))
+            if response.status_code != 200:
+                print(f"❌ Failed to fetch employee data. Status code: {response.status_code}, Response: {response.text}")
+                return False
 
+            data = response.json()
+            total_pages = data.get("totalPages", 0)
+            print(f"page={page}, total pages={total_pages}, time={datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            directory_count += len(data.get("data", []))
+            for employee in filter_active_employees(data.get("data", [])):
+                # Position keeps the final sort stable in directory order, like the two-phase run
+                await employee_queue.put((position, employee))
+                position += 1
+            if total_pages <= page:
+                run_report.add_records("active_employees", directory_count, position)
+                return True
+            page += 1
+    except Exception as e:
+        print(f"❌ Error fetching employee data: {e}")
+        return False
+    finally:
+        for _ in range(workers):
+            await employee_queue.put(None)
+
+
+async def _fetch_attendance_worker(access_token, start_date, end_date, employee_queue, results_queue):
+    headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
+    api_key = tenants.getenv('API_KEY_ATTENDANCE')
+    api_base = tenants.getenv("KEKA_ATTENDANCE_API_BASE", KEKA_ATTENDANCE_API_BASE)
+    while True:
+        item = await employee_queue.get()
+        if item is None:
+            await results_queue.put(None)
+            return
+        position, employee = item
+        emp_id = employee.get("id")
+        emp_url = f"{api_base}/time/attendance?employeeIds={emp_id}&from={start_date}&to={end_date}"
+        records = []
+        try:
+            response = await asyncio.to_thread(keka_http.get, emp_url, headers, api_key)
+            if response.status_code == 200:
+                records = response.json().get("data", [])
+            else:
+                print(f"❌ Failed to fetch attendance for {employee.get('employeeNumber')}")
+        except Exception as e:
+            print(f"❌ Error fetching attendance: {e}")
+        await results_queue.put((position, employee, records))
+
+
+async def _collect_results(results_queue, workers):
+    """Writer side: gather (position, employee, records) until every worker has finished.
+
+    Rows are buffered rather than written as they arrive: the CSV is sorted by
+    employeeNumber and the directory is not, so no row can be written before the
+    last page is in. What overlaps is the fetching, not the write.
+    """
+    results = []
+    finished = 0
+    while finished < workers:
+        item = await results_queue.get()
+        if item is None:
+            finished += 1
+        else:
+            results.append(item)
+    return results
+
+
+async def fetch_directory_and_attendance(list_access_token, att_access_token, start_date, end_date, workers=None):
+    """Directory paging and attendance fetches as one producer/consumer pipeline.
+
+    Returns (employee_data, employee_attendance_data) in the same filtered,
+    employeeNumber-sorted order get_employee_attendance produces, or None if a
+    directory page failed. Requests go through keka_http's shared connection
+    pool on worker threads, so tenant runs and the sequential path share it.
+    """
+    workers = workers or attendance_workers()
+    employee_queue = asyncio.Queue(maxsize=workers * 200)
+    results_queue = asyncio.Queue()
+    consumers = [
+        asyncio.create_task(_fetch_attendance_worker(
+            att_access_token, start_date, end_date, employee_queue, results_queue))
+        for _ in range(workers)
+    ]
+    writer = asyncio.create_task(_collect_results(results_queue, workers))
+    directory_ok = await _produce_directory(list_access_token, employee_queue, workers)
+    if not directory_ok:
+        for task in consumers + [writer]:
+            task.cancel()
+        await asyncio.gather(*consumers, writer, return_exceptions=True)
+        return None
+    results = await writer
+
+    results.sort(key=lambda item: (item[1].get("employeeNumber", ""), item[0]))
+    employee_data = [employee for _, employee, _ in results]
+    employee_attendance_data = [record for _, _, records in results for record in records]
+    return employee_data, employee_attendance_data
+
+
+def main(start_date=None, end_date=None):
+    """Run the attendance sync; returns the exit code and writes a run report next to the CSV."""
+    profiler = profiling.Profiler("attendance", target_folder())
+    report = run_report.RunReport("attendance", target_folder(), profiler.run_id)
+    with report.activate():
+        return report.finish(run_attendance_sync(start_date, end_date, profiler))
+
+
+def run_attendance_sync(start_date, end_date, profiler):
+    api_key = tenants.getenv('API_KEY')
+    api_key_attendance = tenants.getenv('API_KEY_ATTENDANCE')
+
+    with profiler.stage("token_fetch"):
+        list_access_token = fetch_access_token(api_key)
+        att_access_token = fetch_access_token(api_key_attendance)
+
+    if not (list_access_token and att_access_token):
+        print("❌ Failed to obtain access tokens.")
+        return 1
+
+    if attendance_mode() == "sequential":
+        with profiler.stage("directory_fetch"):
+            api_response = call_second_api(list_access_token, ACTIVE_PAGE_FILTER)
+        if api_response:
+            print(f"✅ Fetched employee data: {len(api_response)}")
+            get_employee_attendance(api_response, att_access_token, start_date, end_date, profiler)
+            return 0
+        return 1
+
+    start_date, end_date = default_attendance_dates(start_date, end_date)
+    with profiler.stage("directory_attendance_fetch"):
+        fetched = asyncio.run(fetch_directory_and_attendance(
+            list_access_token, att_access_token, start_date, end_date))
+    if not fetched:
+        return 1
+    employee_data, employee_attendance_data = fetched
+    print(f"✅ Fetched attendance for {len(employee_data)} active employees")
+    run_report.add_records("attendance_records", len(employee_data), len(employee_attendance_data))
+    write_attendance_file(employee_data, employee_attendance_data, start_date, end_date, profiler)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
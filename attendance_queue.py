@@ -0,0 +1,425 @@
+"""Durable work queue for splitting a large attendance pull across worker processes.
+
+An attendance job (start, end) is split into (employee batch, date window)
+tasks in a SQLite file (ATTENDANCE_QUEUE_DB, default
+<TARGET_FILE_PATH>/attendance_queue.sqlite3). Any number of workers, in
+any number of processes, claim tasks from the same file:
+
+    python cli.py attendance-queue enqueue --start 2025-08-01 --end 2025-08-31 [--batch-size 50] [--window-days 7]
+    python cli.py attendance-queue work [--job JOB]      # run as many of these as you like
+    python cli.py attendance-queue status [--job JOB]
+    python cli.py attendance-queue merge --job JOB       # normally done by the worker that finishes last
+
+A claim is a lease (ATTENDANCE_QUEUE_LEASE_SECONDS, default 300) that the
+worker renews between employees. If a worker crashes, its lease expires and
+the next idle worker takes the task over, so the work drains to whoever is
+free. A task that keeps failing is retried up to ATTENDANCE_QUEUE_MAX_ATTEMPTS
+times and then marked failed, which blocks the merge until it is requeued.
+When the last task completes, one worker wins the merge: it joins every
+task's records in directory order, then date order, and writes the usual CSV,
+store rows and Drive upload through attendance.write_attendance_file. A merge
+that fails (say, the Drive upload) leaves the job open, and the next `work` run
+retries it once it runs out of tasks.
+
+Batch size (ATTENDANCE_QUEUE_BATCH_SIZE, default 50), window
+(ATTENDANCE_QUEUE_WINDOW_DAYS, default 7), lease and attempts are read per
+call through tenants.getenv.
+
+Workers on other hosts can share the queue only if the file sits on a
+filesystem with working POSIX locks. SQLite is not safe on most NFS mounts.
+Every request still goes through keka_http, so all workers on a host share
+its rate limit.
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import tenants
+
+# Employee fields build_attendance_frame and the attendance request need
+EMPLOYEE_FIELDS = ("id", "employeeNumber", "groups", "jobTitle")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    status TEXT NOT NULL,          -- open, merging, merged
+    created_at TEXT NOT NULL,
+    merged_at TEXT,
+    output_file TEXT
+);
+CREATE TABLE IF NOT EXISTS job_employees (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    employee TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT NOT NULL,
+    task_id INTEGER NOT NULL,
+    first_position INTEGER NOT NULL,
+    last_position INTEGER NOT NULL,
+    window_start TEXT NOT NULL,
+    window_end TEXT NOT NULL,
+    status TEXT NOT NULL,          -- pending, leased, done, failed
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    records TEXT,
+    PRIMARY KEY (job_id, task_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_claimable ON tasks (status, lease_expires);
+"""
+
+
+class QueueError(Exception):
+    pass
+
+
+def db_path():
+    return tenants.getenv("ATTENDANCE_QUEUE_DB", os.path.join(tenants.getenv("TARGET_FILE_PATH", "output"),
+                                                              "attendance_queue.sqlite3"))
+
+
+def default_batch_size():
+    return int(tenants.getenv("ATTENDANCE_QUEUE_BATCH_SIZE", "50"))
+
+
+def default_window_days():
+    return int(tenants.getenv("ATTENDANCE_QUEUE_WINDOW_DAYS", "7"))
+
+
+def lease_seconds_setting():
+    return float(tenants.getenv("ATTENDANCE_QUEUE_LEASE_SECONDS", "300"))
+
+
+def max_attempts():
+    return int(tenants.getenv("ATTENDANCE_QUEUE_MAX_ATTEMPTS", "5"))
+
+
+def connect(path=None):
+    path = path or db_path()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _transaction(conn, work):
+    """Run `work(conn)` in one write transaction, so claims from different processes never interleave."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = work(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return result
+
+
+def date_windows(start_date, end_date, window_days):
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=window_days - 1), end)
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def enqueue(employee_data, start_date, end_date, batch_size=None, window_days=None, path=None):
+    """Queue (batch, window) tasks for filtered, sorted `employee_data`; returns the job id."""
+    batch_size = batch_size or default_batch_size()
+    window_days = window_days or default_window_days()
+    job_id = f"{start_date}_{end_date}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:4]}"
+    employees = [{key: employee.get(key) for key in EMPLOYEE_FIELDS} for employee in employee_data]
+    windows = date_windows(start_date, end_date, window_days)
+    tasks = []
+    for first in range(0, len(employees), batch_size):
+        last = min(first + batch_size, len(employees)) - 1
+        for window_start, window_end in windows:
+            tasks.append((job_id, len(tasks), first, last, window_start, window_end, "pending"))
+
+    def insert(conn):
+        conn.execute("INSERT INTO jobs (job_id, start_date, end_date, status, created_at) VALUES (?, ?, ?, 'open', ?)",
+                     (job_id, start_date, end_date, datetime.now().isoformat(timespec="seconds")))
+        conn.executemany("INSERT INTO job_employees (job_id, position, employee) VALUES (?, ?, ?)",
+                         ((job_id, position, json.dumps(employee)) for position, employee in enumerate(employees)))
+        conn.executemany(
+            "INSERT INTO tasks (job_id, task_id, first_position, last_position, window_start, window_end, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", tasks)
+
+    conn = connect(path)
+    try:
+        _transaction(conn, insert)
+    finally:
+        conn.close()
+    print(f"📋 Queued job {job_id}: {len(employees)} employees x {len(windows)} windows = {len(tasks)} tasks")
+    return job_id
+
+
+def claim(conn, worker, job_id=None, lease_seconds=None):
+    """Lease the next pending task, or one whose lease has expired; returns the task row as a dict or None."""
+    lease_seconds = lease_seconds or lease_seconds_setting()
+
+    def take(conn):
+        now = time.time()
+        sql = ("SELECT job_id, task_id, first_position, last_position, window_start, window_end, attempts, "
+               "lease_owner FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))")
+        params = [now]
+        if job_id:
+            sql += " AND job_id = ?"
+            params.append(job_id)
+        row = conn.execute(sql + " ORDER BY job_id, task_id LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        task = dict(zip(("job_id", "task_id", "first_position", "last_position", "window_start", "window_end",
+                         "attempts", "previous_owner"), row))
+        conn.execute("UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                     "WHERE job_id = ? AND task_id = ?",
+                     (worker, now + lease_seconds, task["job_id"], task["task_id"]))
+        return task
+
+    return _transaction(conn, take)
+
+
+def renew(conn, worker, task, lease_seconds=None):
+    """Extend our lease; False when another worker has taken the task over."""
+    lease_seconds = lease_seconds or lease_seconds_setting()
+    cursor = conn.execute(
+        "UPDATE tasks SET lease_expires = ? WHERE job_id = ? AND task_id = ? AND lease_owner = ? AND status = 'leased'",
+        (time.time() + lease_seconds, task["job_id"], task["task_id"], worker))
+    return cursor.rowcount == 1
+
+
+def complete(conn, worker, task, records):
+    cursor = conn.execute(
+        "UPDATE tasks SET status = 'done', records = ?, error = NULL, lease_expires = NULL "
+        "WHERE job_id = ? AND task_id = ? AND lease_owner = ? AND status = 'leased'",
+        (json.dumps(records), task["job_id"], task["task_id"], worker))
+    return cursor.rowcount == 1
+
+
+def release(conn, worker, task, error):
+    """Give a failed task back for a retry, or mark it failed after ATTENDANCE_QUEUE_MAX_ATTEMPTS."""
+    status = "failed" if task["attempts"] + 1 >= max_attempts() else "pending"
+    conn.execute(
+        "UPDATE tasks SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL "
+        "WHERE job_id = ? AND task_id = ? AND lease_owner = ?",
+        (status, str(error)[:500], task["job_id"], task["task_id"], worker))
+    return status
+
+
+def requeue_failed(job_id, path=None):
+    conn = connect(path)
+    try:
+        cursor = conn.execute("UPDATE tasks SET status = 'pending', attempts = 0 WHERE job_id = ? AND status = 'failed'",
+                              (job_id,))
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def task_employees(conn, task):
+    rows = conn.execute(
+        "SELECT employee FROM job_employees WHERE job_id = ? AND position BETWEEN ? AND ? ORDER BY position",
+        (task["job_id"], task["first_position"], task["last_position"])).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+
+def job_status(conn, job_id):
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY status",
+                               (job_id,)).fetchall())
+    job = conn.execute("SELECT start_date, end_date, status, output_file FROM jobs WHERE job_id = ?",
+                       (job_id,)).fetchone()
+    if job is None:
+        raise QueueError(f"No attendance job {job_id} in {db_path()}")
+    return {"job_id": job_id, "start_date": job[0], "end_date": job[1], "status": job[2], "output_file": job[3],
+            "tasks": {status: counts.get(status, 0) for status in ("pending", "leased", "done", "failed")}}
+
+
+def list_jobs(path=None):
+    conn = connect(path)
+    try:
+        job_ids = [row[0] for row in conn.execute("SELECT job_id FROM jobs ORDER BY created_at")]
+        return [job_status(conn, job_id) for job_id in job_ids]
+    finally:
+        conn.close()
+
+
+def _claim_merge(conn, job_id):
+    """Move a fully done job to 'merging'; True for the one worker that gets to merge it."""
+    def take(conn):
+        remaining = conn.execute("SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status != 'done'",
+                                 (job_id,)).fetchone()[0]
+        if remaining:
+            return False
+        cursor = conn.execute("UPDATE jobs SET status = 'merging' WHERE job_id = ? AND status = 'open'", (job_id,))
+        return cursor.rowcount == 1
+
+    return _transaction(conn, take)
+
+
+def unmerged_jobs(conn, job_id=None):
+    """Open jobs whose tasks are all done, e.g. because their merge failed."""
+    sql = ("SELECT job_id FROM jobs WHERE status = 'open' AND NOT EXISTS "
+           "(SELECT 1 FROM tasks WHERE tasks.job_id = jobs.job_id AND tasks.status != 'done')")
+    params = []
+    if job_id:
+        sql += " AND job_id = ?"
+        params.append(job_id)
+    return [row[0] for row in conn.execute(sql + " ORDER BY created_at", params)]
+
+
+def merged_records(conn, job_id):
+    """(employee_data, records) for a finished job, ordered like one full-range request per employee."""
+    employees = [json.loads(row[0]) for row in conn.execute(
+        "SELECT employee FROM job_employees WHERE job_id = ? ORDER BY position", (job_id,))]
+    by_position = {}
+    for (results,) in conn.execute(
+            "SELECT records FROM tasks WHERE job_id = ? ORDER BY first_position, window_start", (job_id,)):
+        for position, records in json.loads(results):
+            by_position.setdefault(position, []).extend(records)
+    records = [record for position in range(len(employees)) for record in by_position.get(position, [])]
+    return employees, records
+
+
+def fetch_task(conn, worker, task, token, lease_seconds=None):
+    """Attendance for every employee in the task's batch and window, as [[position, records], ...].
+
+    Raises QueueError on a failed request (so the task is retried) or when the lease was lost.
+    `token` is a one-item list so a 401 can refresh it for the worker's later tasks.
+    """
+    import attendance
+    import keka_http
+
+    lease_seconds = lease_seconds or lease_seconds_setting()
+    api_key = tenants.getenv("API_KEY_ATTENDANCE")
+    api_base = tenants.getenv("KEKA_ATTENDANCE_API_BASE", attendance.KEKA_ATTENDANCE_API_BASE)
+    results = []
+    renew_at = time.time() + lease_seconds / 3
+    for offset, employee in enumerate(task_employees(conn, task)):
+        url = (f"{api_base}/time/attendance?employeeIds={employee.get('id')}"
+               f"&from={task['window_start']}&to={task['window_end']}")
+        headers = {"Authorization": f"Bearer {token[0]}", "Accept": "application/json"}
+        response = keka_http.get(url, headers, api_key)
+        if response.status_code == 401:
+            token[0] = attendance.fetch_access_token(api_key)
+            headers["Authorization"] = f"Bearer {token[0]}"
+            response = keka_http.get(url, headers, api_key)
+        if response.status_code != 200:
+            raise QueueError(f"attendance for {employee.get('employeeNumber')}: HTTP {response.status_code}")
+        results.append([task["first_position"] + offset, response.json().get("data", [])])
+        if time.time() >= renew_at:
+            if not renew(conn, worker, task, lease_seconds):
+                raise QueueError("lease lost to another worker")
+            renew_at = time.time() + lease_seconds / 3
+    return results
+
+
+def next_lease_expiry(conn, job_id=None):
+    """Earliest expiry among other workers' live leases, or None when nothing is leased."""
+    sql = "SELECT MIN(lease_expires) FROM tasks WHERE status = 'leased'"
+    params = []
+    if job_id:
+        sql += " AND job_id = ?"
+        params.append(job_id)
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def run_worker(job_id=None, worker=None, lease_seconds=None, wait=True, path=None):
+    """Claim and fetch tasks until none are left, merging any job this worker finishes; returns tasks done.
+
+    With `wait`, an idle worker stays around while other workers hold leases,
+    so it can take over any task whose worker dies. Before it exits, it retries
+    the merge of any finished job that is still open.
+    """
+    import attendance
+
+    lease_seconds = lease_seconds or lease_seconds_setting()
+    worker = worker or worker_name()
+    token = [attendance.fetch_access_token(tenants.getenv("API_KEY_ATTENDANCE"))]
+    if not token[0]:
+        raise QueueError("Failed to obtain an attendance access token")
+    conn = connect(path)
+    done = 0
+    try:
+        while True:
+            task = claim(conn, worker, job_id, lease_seconds)
+            if task is None:
+                expiry = next_lease_expiry(conn, job_id) if wait else None
+                if expiry is None:
+                    break
+                time.sleep(min(max(expiry - time.time(), 0.1), 5))
+                continue
+            if task["previous_owner"]:
+                print(f"🪝 {worker} took over task {task['task_id']} of {task['job_id']} "
+                      f"from {task['previous_owner']} (lease expired)")
+            try:
+                records = fetch_task(conn, worker, task, token, lease_seconds)
+            except Exception as e:
+                status = release(conn, worker, task, e)
+                print(f"❌ Task {task['task_id']} of {task['job_id']}: {e} ({status})")
+                continue
+            if complete(conn, worker, task, records):
+                done += 1
+                if _claim_merge(conn, task["job_id"]):
+                    _try_merge(conn, task["job_id"])
+        for unmerged in unmerged_jobs(conn, job_id):
+            if _claim_merge(conn, unmerged):
+                print(f"🔁 Retrying the merge of job {unmerged}")
+                _try_merge(conn, unmerged)
+        print(f"✅ {worker}: no more tasks, completed {done}")
+        return done
+    finally:
+        conn.close()
+
+
+def _try_merge(conn, job_id):
+    """merge, leaving the job open for the next `work` run if it fails."""
+    try:
+        merge(job_id, conn=conn)
+    except Exception as e:
+        print(f"❌ Merge of job {job_id} failed, the next `attendance-queue work` retries it: {e}")
+
+
+def merge(job_id, conn=None, path=None):
+    """Write the job's template CSV (plus store rows and Drive upload) from its finished tasks."""
+    import attendance
+    import profiling
+
+    own_conn = conn is None
+    conn = conn or connect(path)
+    try:
+        status = job_status(conn, job_id)
+        if status["tasks"]["done"] != sum(status["tasks"].values()):
+            raise QueueError(f"Job {job_id} is not finished: {status['tasks']}")
+        if status["status"] == "open":
+            conn.execute("UPDATE jobs SET status = 'merging' WHERE job_id = ?", (job_id,))
+        employee_data, records = merged_records(conn, job_id)
+        print(f"🧩 Merging job {job_id}: {len(records)} attendance records for {len(employee_data)} employees")
+        profiler = profiling.Profiler("attendance", attendance.target_folder())
+        output_file = attendance.write_attendance_file(
+            employee_data, records, status["start_date"], status["end_date"], profiler)
+        conn.execute("UPDATE jobs SET status = 'merged', merged_at = ?, output_file = ? WHERE job_id = ?",
+                     (datetime.now().isoformat(timespec="seconds"), output_file, job_id))
+        return output_file
+    except BaseException:
+        conn.execute("UPDATE jobs SET status = 'open' WHERE job_id = ? AND status = 'merging'", (job_id,))
+        raise
+    finally:
+        if own_conn:
+            conn.close()
@@ -0,0 +1,127 @@
+"""Embedded attendance history, one row per (employee, date).
+
+The attendance job upserts every row it writes to the CSV into a SQLite
+file (ATTENDANCE_DB, default <TARGET_FILE_PATH>/attendance.sqlite3). Any window
+can then be queried or re-exported to the attendance template without calling
+Keka again:
+
+    python cli.py attendance-export --start 2025-09-01 --end 2025-09-30 [--employee NP12345] [--center X]
+    python cli.py attendance-import output/att_*.csv      # backfill from earlier CSV exports
+
+Rows are stored exactly as they went into the CSV, the 17 ATTENDANCE_COLUMNS
+after the Center/jobTitle join and timestamp formatting. Value columns carry no
+type affinity, so numbers and text come back as they went in. Indexes cover
+date, employee (the primary key) and center.
+"""
+import os
+import sqlite3
+
+import tenants
+
+# Attendance payload fields in template order (attendance.ATTENDANCE_COLUMNS)
+COLUMNS = [
+    "id", "employeeNumber", "Center", "jobTitle", "attendanceDate", "shiftStartTime", "shiftEndTime",
+    "firstInOfTheDay", "lastOutOfTheDay", "dayType", "shiftDuration", "shiftEffectiveDuration",
+    "totalGrossHours", "totalEffectiveHours", "totalBreakDuration",
+    "totalEffectiveOvertimeDuration", "totalGrossOvertimeDuration",
+]
+
+_QUOTED_COLUMNS = ", ".join(f'"{column}"' for column in COLUMNS)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS attendance (
+    employee_number TEXT NOT NULL,
+    day TEXT NOT NULL,
+    {_QUOTED_COLUMNS},
+    PRIMARY KEY (employee_number, day)
+);
+CREATE INDEX IF NOT EXISTS attendance_day ON attendance (day);
+CREATE INDEX IF NOT EXISTS attendance_center_day ON attendance ("Center", day);
+"""
+
+
+def db_path():
+    return tenants.getenv("ATTENDANCE_DB", os.path.join(tenants.getenv("TARGET_FILE_PATH", "output"),
+                                                        "attendance.sqlite3"))
+
+
+def connect(path=None):
+    path = path or db_path()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _day(attendance_date):
+    return str(attendance_date or "")[:10]
+
+
+def upsert_rows(rows, path=None):
+    """Insert or update (employee, date) rows; `rows` is a list of sequences in COLUMNS order. Returns the count."""
+    employee_index = COLUMNS.index("employeeNumber")
+    date_index = COLUMNS.index("attendanceDate")
+    placeholders = ", ".join("?" for _ in range(len(COLUMNS) + 2))
+    updates = ", ".join(f'"{column}" = excluded."{column}"' for column in COLUMNS)
+    sql = (f"INSERT INTO attendance (employee_number, day, {_QUOTED_COLUMNS}) VALUES ({placeholders}) "
+           f"ON CONFLICT (employee_number, day) DO UPDATE SET {updates}")
+
+    conn = connect(path)
+    try:
+        with conn:
+            conn.executemany(sql, (
+                (row[employee_index] or "", _day(row[date_index]), *row) for row in rows
+            ))
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def upsert_frame(df_rows, path=None):
+    """Upsert a build_attendance_frame result (columns in COLUMNS order)."""
+    import pandas as pd
+
+    df = df_rows[COLUMNS].astype(object)
+    df = df.where(pd.notna(df), None)
+    return upsert_rows(list(df.itertuples(index=False, name=None)), path)
+
+
+def query(start_date, end_date, employee_number=None, center=None, path=None):
+    """Rows with start_date <= day <= end_date, optionally for one employee or center, in export order."""
+    sql = f"SELECT {_QUOTED_COLUMNS} FROM attendance WHERE day BETWEEN ? AND ?"
+    params = [start_date, end_date]
+    if employee_number:
+        sql += " AND employee_number = ?"
+        params.append(employee_number)
+    if center:
+        sql += ' AND "Center" = ?'
+        params.append(center)
+    sql += " ORDER BY employee_number, day"
+
+    conn = connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def query_frame(start_date, end_date, employee_number=None, center=None, path=None):
+    import pandas as pd
+
+    rows = query(start_date, end_date, employee_number, center, path)
+    return pd.DataFrame(rows, columns=COLUMNS, dtype=object)
+
+
+def import_csv(csv_path, path=None):
+    """Backfill from an attendance CSV written by an earlier run. Returns the number of rows stored."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype=object, keep_default_na=False)
+    if list(df.columns[:len(COLUMNS)]) != COLUMNS:
+        raise ValueError(f"{csv_path} does not have the attendance template columns")
+    df = df[COLUMNS]
+    df = df.where(df != "", None)
+    return upsert_rows(list(df.itertuples(index=False, name=None)), path)
@@ -0,0 +1,85 @@
+"""Latency of the web app's employee lookups against an in-memory index.
+
+Builds an employee_index.EmployeeSnapshot from the Keka stand-in's synthetic
+directory and times each lookup kind over random keys. It reports
+p50/p99/max in microseconds, for the index calls alone and, with --http,
+through the FastAPI routes via TestClient (which adds the ASGI and JSON cost
+but makes no network calls):
+
+    python benchmarks/employee_lookup.py [--employees 20000] [--requests 20000] [--http]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))]
+    return pick(0.50) * 1e6, pick(0.99) * 1e6, samples[-1] * 1e6
+
+
+def time_calls(calls):
+    samples = []
+    for call in calls:
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--http", action="store_true", help="Also time the FastAPI routes through TestClient")
+    args = parser.parse_args()
+
+    import employee_index
+    from standins.fake_keka import generate_employees
+
+    employees = generate_employees(args.employees)
+    started = time.perf_counter()
+    index = employee_index.EmployeeSnapshot(employees, "synthetic")
+    print(f"{len(index)} employees indexed in {time.perf_counter() - started:.3f}s")
+
+    rng = random.Random(7)
+    numbers = [rng.choice(index.records)["employeeNumber"] for _ in range(args.requests)]
+    emails = [rng.choice(index.records)["email"] for _ in range(args.requests)]
+    centers = [center["center"] for center in index.centers()]
+    center_picks = [rng.choice(centers) for _ in range(args.requests)]
+
+    cases = {
+        "by_npid": [lambda n=n: index.by_npid(n) for n in numbers],
+        "by_email": [lambda e=e: index.by_mail(e) for e in emails],
+        "center_page": [lambda c=c: index.search(center=c) for c in center_picks],
+        "search_q_page": [lambda: index.search(q="np1", limit=50)] * max(args.requests // 20, 1),
+    }
+    print(f"{'lookup':16s} {'p50 us':>9s} {'p99 us':>9s} {'max us':>9s}")
+    for name, calls in cases.items():
+        p50, p99, worst = time_calls(calls)
+        print(f"{name:16s} {p50:9.1f} {p99:9.1f} {worst:9.1f}")
+
+    if args.http:
+        import app
+        from fastapi.testclient import TestClient
+
+        employee_index.swap(index)
+        client = TestClient(app.app)
+        http_cases = {
+            "GET npid": [lambda n=n: client.get(f"/employees/{n}") for n in numbers[:2000]],
+            "GET email": [lambda e=e: client.get(f"/employees/by-email/{e}") for e in emails[:2000]],
+            "GET center": [lambda c=c: client.get("/employees", params={"center": c}) for c in center_picks[:2000]],
+        }
+        for name, calls in http_cases.items():
+            p50, p99, worst = time_calls(calls)
+            print(f"{name:16s} {p50:9.1f} {p99:9.1f} {worst:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Tail latency of Keka GETs with and without hedging.
+
+Starts the Keka stand-in with a slow tail (a share of requests take
+--tail-latency-ms instead of --latency-ms), then sends the same attendance
+GETs through keka_http with KEKA_HEDGE off and on, from a thread pool (like
+the bridge and the attendance runs) and from asyncio tasks (like the app's
+directory pull). Prints p50/p95/p99/max per mode and the hedge
+rate (each hedge is one extra request to the stand-in):
+
+    python benchmarks/hedged_requests.py [--requests 2000] [--concurrency 8] [--tail-ratio 0.03] [--json out.json]
+
+The shared rate limit is set to --rate requests per second (0 = off), so
+hedges only go out when the budget has a free slot.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.run_benchmarks import free_port, git_commit, start_standin  # noqa: E402
+
+ATTENDANCE_DAY = "2025-09-22"
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def at(fraction):
+        return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(latencies[-1] * 1000, 1)}
+
+
+def attendance_urls(base, employee_ids, count):
+    return [f"{base}/api/v1/time/attendance?employeeIds={employee_ids[i % len(employee_ids)]}"
+            f"&from={ATTENDANCE_DAY}&to={ATTENDANCE_DAY}" for i in range(count)]
+
+
+def run_threads(urls, headers, concurrency):
+    import keka_http
+
+    def timed(url):
+        started = time.perf_counter()
+        response = keka_http.get(url, headers, os.environ["API_KEY_ATTENDANCE"])
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+        return time.perf_counter() - started
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(timed, urls))
+
+
+def run_async(urls, headers, concurrency):
+    import httpx
+    import keka_http
+
+    async def main():
+        limits = httpx.Limits(max_connections=concurrency * 2)
+        async with httpx.AsyncClient(limits=limits) as client:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def timed(url):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await keka_http.get_async(client, url, headers, os.environ["API_KEY_ATTENDANCE"])
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{url} answered {response.status_code}")
+                    return time.perf_counter() - started
+
+            return await asyncio.gather(*(timed(url) for url in urls))
+
+    return asyncio.run(main())
+
+
+def measure(client, hedge, urls, headers, concurrency):
+    import keka_http
+
+    os.environ["KEKA_HEDGE"] = "1" if hedge else "0"
+    # A fresh window per mode, filled by a warm-up that is not measured
+    keka_http._hedger = keka_http.Hedger()
+    runner = run_threads if client == "threads" else run_async
+    runner(urls[:keka_http.HEDGE_MIN_SAMPLES * 5], headers, concurrency)
+    before = keka_http.hedge_stats()
+    started = time.perf_counter()
+    latencies = runner(urls, headers, concurrency)
+    wall = time.perf_counter() - started
+    after = keka_http.hedge_stats()
+    hedges = after["hedges"] - before["hedges"]
+    result = {
+        "client": client,
+        "hedge": hedge,
+        "requests": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "latency_ms": percentiles(latencies),
+        "hedges": hedges,
+        "hedge_wins": after["hedge_wins"] - before["hedge_wins"],
+        "hedges_over_budget": after["denied"] - before["denied"],
+        "hedge_rate": round(hedges / len(latencies), 4),
+    }
+    latency = result["latency_ms"]
+    print(f"  {client:8s} hedge={'on ' if hedge else 'off'} p50 {latency['p50']:7.1f}  p95 {latency['p95']:7.1f}  "
+          f"p99 {latency['p99']:7.1f}  max {latency['max']:7.1f} ms  wall {wall:6.2f}s  "
+          f"hedges {hedges} ({result['hedge_rate']:.1%}), {result['hedge_wins']} won")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--tail-ratio", type=float, default=0.03)
+    parser.add_argument("--tail-latency-ms", type=float, default=400.0)
+    parser.add_argument("--rate", type=float, default=0.0, help="KEKA_RATE_LIMIT for the run (0 = off)")
+    parser.add_argument("--max-ratio", default="0.05", help="KEKA_HEDGE_MAX_RATIO")
+    parser.add_argument("--percentile", default="95", help="KEKA_HEDGE_PERCENTILE")
+    parser.add_argument("--clients", default="threads,async")
+    parser.add_argument("--json", help="Write the measurements to this file")
+    args = parser.parse_args()
+
+    from standins.fake_keka import env_for, generate_employees
+
+    workdir = tempfile.mkdtemp(prefix="hedge_bench_")
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update(env_for(base))
+    os.environ.update({
+        "KEKA_RATE_LIMIT": str(args.rate),
+        "KEKA_RATE_BURST": str(max(args.concurrency, 1)),
+        "KEKA_RATE_LIMIT_DB": os.path.join(workdir, "rate_limit.sqlite3"),
+        "KEKA_HEDGE_MAX_RATIO": args.max_ratio,
+        "KEKA_HEDGE_PERCENTILE": args.percentile,
+        "KEKA_HTTP_POOL_SIZE": str(args.concurrency * 2),
+    })
+    standin = start_standin(
+        "fake_keka", "--employees", str(args.employees), "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--tail-ratio", str(args.tail_ratio), "--tail-latency-ms", str(args.tail_latency_ms), ready_port=port)
+    try:
+        import keka_http
+
+        response = keka_http.post(os.environ["KEKA_URL"], {"Content-Type": "application/x-www-form-urlencoded"},
+                                  "grant_type=kekaapi&scope=kekaapi&client_id=bench&client_secret=bench&api_key=bench")
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}", "Accept": "application/json"}
+        employee_ids = [employee["id"] for employee in generate_employees(args.employees)]
+        urls = attendance_urls(base, employee_ids, args.requests)
+
+        print(f"{args.requests} attendance GETs, {args.concurrency} at a time; stand-in "
+              f"{args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, {args.tail_ratio:.1%} take {args.tail_latency_ms:.0f} ms")
+        results = []
+        for client in args.clients.split(","):
+            for hedge in (False, True):
+                results.append(measure(client, hedge, urls, headers, args.concurrency))
+    finally:
+        standin.terminate()
+        standin.wait()
+
+    for client in args.clients.split(","):
+        off, on = [r["latency_ms"]["p99"] for r in results if r["client"] == client]
+        print(f"  {client}: p99 {off:.1f} -> {on:.1f} ms ({on / off:.2f}x)")
+    if args.json:
+        commit, dirty = git_commit()
+        with open(args.json, "w") as f:
+            json.dump({"commit": commit, "dirty": dirty, "options": vars(args), "results": results}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
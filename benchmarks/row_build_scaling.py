@@ -0,0 +1,83 @@
+"""Scaling curve for process-pool sharded row building.
+
+Generates a synthetic directory with the Keka stand-in's generator, then builds
+Nephrocare and Dice rows for every employee in it (not just the support or
+manager subsets, so there is enough CPU work to shard). It runs once per
+worker count, checks that each result matches the in-process rows, and prints
+throughput and speedup:
+
+    python benchmarks/row_build_scaling.py [--employees 200000] [--workers 1,2,4,8] [--repeat 3] [--json out.json]
+
+Speedup tops out at the number of cores; above that the extra workers only
+add start-up and pickling cost.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+BUILDERS = ["build_nephrocare_rows", "build_dice_rows"]
+
+
+def measure(builder, employee_data, all_employees, graph, workers, repeat):
+    import exports
+
+    best, rows = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = exports.build_rows(builder, employee_data, all_employees, graph, workers=workers, min_rows=0)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=200000)
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8)))
+    parser.add_argument("--repeat", type=int, default=3, help="Keep the best of this many runs per point")
+    parser.add_argument("--json", help="Write the measurements to this file")
+    args = parser.parse_args()
+
+    import exports
+    import org_graph
+    from standins.fake_keka import generate_employees
+
+    all_employees = exports.sort_employees(generate_employees(args.employees))
+    graph = org_graph.OrgGraph(all_employees)
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    print(f"{len(all_employees)} employees, {os.cpu_count()} CPUs")
+
+    report = []
+    for name in BUILDERS:
+        builder = getattr(exports, name)
+        baseline_seconds, baseline_rows = None, None
+        for workers in worker_counts:
+            seconds, rows = measure(builder, all_employees, all_employees, graph, workers, args.repeat)
+            if baseline_rows is None:
+                baseline_seconds, baseline_rows = seconds, rows
+            elif rows != baseline_rows:
+                raise SystemExit(f"{name} with {workers} workers produced different rows")
+            result = {
+                "builder": name,
+                "workers": workers,
+                "rows": len(rows),
+                "seconds": round(seconds, 4),
+                "rows_per_second": round(len(rows) / seconds),
+                "speedup": round(baseline_seconds / seconds, 2),
+            }
+            report.append(result)
+            print(f"{name:24s} workers={workers:<3d} {seconds:8.3f}s  "
+                  f"{result['rows_per_second']:>9d} rows/s  x{result['speedup']:.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "employees": len(all_employees), "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
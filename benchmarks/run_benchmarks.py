@@ -0,0 +1,334 @@
+"""Scaling benchmarks for the app, bridge and attendance pipelines.
+
+Runs each pipeline stage by stage against the local stand-ins (fake Keka, fake
+SFTP, fake Drive). The stand-ins run as subprocesses, so their own allocations
+stay out of the numbers. Each stage records wall time and peak Python
+allocations (tracemalloc). Results go to a JSON report that can be compared
+across commits:
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --output bench.json
+    python benchmarks/run_benchmarks.py compare base.json head.json [--threshold 1.15]
+
+The shared Keka rate limit is switched off, so the fetch stages measure the
+client, not the pacing.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PATHS = ["app", "bridge", "attendance", "attendance_pipelined"]
+ATTENDANCE_DAY = "2025-09-22"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_standin(module, *args, ready_url=None, ready_port=None, timeout=120):
+    process = subprocess.Popen([sys.executable, "-m", f"standins.{module}", *args], cwd=BASE_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if ready_url:
+                urllib.request.urlopen(ready_url, timeout=1)
+            else:
+                socket.create_connection(("127.0.0.1", ready_port), timeout=1).close()
+            return process
+        except urllib.error.HTTPError:
+            return process  # Any HTTP answer means it is listening
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"standins.{module} exited with {process.returncode}")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"standins.{module} did not start within {timeout}s")
+
+
+class StageTimer:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, stage, fn, *args):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        peak = 0
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.stages[stage] = {"seconds": round(elapsed, 4), "peak_alloc_mb": round(peak / 2 ** 20, 2)}
+        if isinstance(result, list) or hasattr(result, "shape"):
+            self.stages[stage]["records"] = len(result)
+        print(f"    {stage:22s} {elapsed:9.3f}s {peak / 2 ** 20:9.1f} MB")
+        return result
+
+
+def write_csv(df, path):
+    df.to_csv(path, index=False)
+    return df
+
+
+def bench_app(timer, workdir):
+    import app
+    import exports
+
+    async def collect_directory(token):
+        employees = []
+        async for item in app.call_second_api(token):
+            if isinstance(item, app.DirectoryResult):
+                employees = item.employees
+        return employees
+
+    token = timer.run("token", lambda: asyncio.run(app.fetch_access_token()))
+    all_employees = timer.run("directory_fetch", lambda: asyncio.run(collect_directory(token)))
+    all_employees = exports.sort_employees(all_employees)
+    employee_data = timer.run("filter", exports.filter_support_employees, all_employees)
+    rows = timer.run("row_build", exports.build_nephrocare_rows, employee_data, all_employees)
+    df = timer.run("template_fill", exports.fill_template, os.environ["TEMPLATE_FILE_PATH"], rows,
+                   exports.NEPHROCARE_COLUMNS)
+    path = os.path.join(workdir, "app_nephrocare.csv")
+    timer.run("csv_write", write_csv, df, path)
+    timer.run("upload", app.sftp_put, path, f"{os.environ['FTP_FOLDER']}/app_nephrocare.csv",
+              os.environ["FTP_HOST_NAME"], int(os.environ["FTP_PORT"]),
+              os.environ["FTP_USER_NAME"], os.environ["FTP_PASSWORD"])
+
+
+def bench_bridge(timer, workdir):
+    import cli
+    import exports
+    import org_graph
+
+    bridge = cli.load_bridge()
+    token = timer.run("token", bridge.fetch_access_token)
+    all_employees = timer.run("directory_fetch", bridge.call_second_api, token)
+    all_employees = exports.sort_employees(all_employees)
+
+    employee_data = timer.run("nephrocare_filter", exports.filter_support_employees, all_employees)
+    rows = timer.run("nephrocare_row_build", exports.build_nephrocare_rows, employee_data, all_employees)
+    df = timer.run("nephrocare_template", exports.fill_template, os.environ["TEMPLATE_FILE_PATH"], rows,
+                   exports.NEPHROCARE_COLUMNS)
+    path = os.path.join(workdir, "bridge_nephrocare.csv")
+    timer.run("nephrocare_csv_write", write_csv, df, path)
+
+    graph = timer.run("org_graph", org_graph.OrgGraph, all_employees)
+    dice_data = timer.run("dice_filter", exports.select_dice_employees, all_employees, graph)
+    dice_rows = timer.run("dice_row_build", exports.build_dice_rows, dice_data, all_employees, graph)
+    df = timer.run("dice_template", exports.fill_template, os.environ["TEMPLATE_FILE_PATH_DICE"], dice_rows,
+                   exports.DICE_COLUMNS)
+    timer.run("dice_csv_write", write_csv, df, os.path.join(workdir, "bridge_dice.csv"))
+    timer.run("upload", bridge.sftp_put, path, f"{os.environ['FTP_FOLDER']}/bridge_nephrocare.csv",
+              os.environ["FTP_HOST_NAME"], os.environ["FTP_USER_NAME"], password=os.environ["FTP_PASSWORD"])
+
+
+def bench_attendance(timer, workdir):
+    import attendance
+    import drive_uploader
+    import pandas as pd
+
+    list_token = timer.run("token", attendance.fetch_access_token, os.environ["API_KEY"])
+    att_token = attendance.fetch_access_token(os.environ["API_KEY_ATTENDANCE"])
+    all_employees = timer.run("directory_fetch", attendance.call_second_api, list_token)
+    employee_data = timer.run("filter", attendance.filter_active_employees, all_employees)
+    records = timer.run("attendance_fetch", attendance.fetch_attendance_records, employee_data, att_token,
+                        ATTENDANCE_DAY, ATTENDANCE_DAY)
+    df_rows = timer.run("transform", attendance.build_attendance_frame, employee_data, records)
+
+    def fill_and_write(df_rows, path):
+        df_template = pd.read_csv(attendance.ATT_TEMPLATE_FILE_PATH)
+        df_rows.columns = df_template.columns
+        return write_csv(pd.concat([df_rows, df_template.iloc[len(df_rows):]], ignore_index=True), path)
+
+    path = os.path.join(workdir, f"att_{ATTENDANCE_DAY}_{len(all_employees)}.csv")
+    timer.run("csv_write", fill_and_write, df_rows, path)
+    timer.run("upload", drive_uploader.upload_file, path, os.path.basename(path), "bench-folder")
+
+
+def bench_attendance_pipelined(timer, workdir):
+    import attendance
+    import pandas as pd
+
+    list_token = timer.run("token", attendance.fetch_access_token, os.environ["API_KEY"])
+    att_token = attendance.fetch_access_token(os.environ["API_KEY_ATTENDANCE"])
+    employee_data, records = timer.run(
+        "directory_attendance_fetch",
+        lambda: asyncio.run(attendance.fetch_directory_and_attendance(list_token, att_token,
+                                                                      ATTENDANCE_DAY, ATTENDANCE_DAY)))
+    df_rows = timer.run("transform", attendance.build_attendance_frame, employee_data, records)
+
+    def fill_and_write(df_rows, path):
+        df_template = pd.read_csv(attendance.ATT_TEMPLATE_FILE_PATH)
+        df_rows.columns = df_template.columns
+        return write_csv(pd.concat([df_rows, df_template.iloc[len(df_rows):]], ignore_index=True), path)
+
+    path = os.path.join(workdir, f"att_pipelined_{ATTENDANCE_DAY}_{len(employee_data)}.csv")
+    timer.run("csv_write", fill_and_write, df_rows, path)
+
+
+BENCHES = {"app": bench_app, "bridge": bench_bridge, "attendance": bench_attendance,
+           "attendance_pipelined": bench_attendance_pipelined}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except OSError:
+        return None, None
+
+
+def configure_env(workdir, keka_port, sftp_port, drive_port):
+    from standins.fake_keka import env_for
+
+    os.environ.update(env_for(f"http://127.0.0.1:{keka_port}"))
+    os.environ.update({
+        "KEKA_RATE_LIMIT": "0",
+        "KEKA_RATE_LIMIT_DB": os.path.join(workdir, "rate_limit.sqlite3"),
+        "TARGET_FILE_PATH": workdir,
+        "TARTGET_FILE_PATH": workdir,
+        "TEMPLATE_FILE_PATH": os.path.join(BASE_DIR, "SFTP_File-Nephrocare-27dec.csv"),
+        "TEMPLATE_FILE_PATH_DICE": os.path.join(BASE_DIR, "Dice_SFTP_Template.csv"),
+        "ATT_TEMPLATE_FILE_PATH": os.path.join(BASE_DIR, "Attendance.csv"),
+        "FTP_HOST_NAME": "127.0.0.1",
+        "FTP_PORT": str(sftp_port),
+        "FTP_USER_NAME": "bench",
+        "FTP_PASSWORD": "bench",
+        "FTP_FOLDER": "Nephrocare",
+        "DRIVE_ROOT_URL": f"http://127.0.0.1:{drive_port}/",
+        "SERVICE_ACCOUNT_FILE": os.path.join(workdir, "no-service-account.json"),
+    })
+
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    paths = args.paths.split(",")
+    workdir = tempfile.mkdtemp(prefix="keka-bench-")
+    keka_port, sftp_port, drive_port = free_port(), free_port(), free_port()
+    configure_env(workdir, keka_port, sftp_port, drive_port)
+    os.chdir(BASE_DIR)
+
+    standins = [
+        start_standin("fake_sftp", "--port", str(sftp_port), "--root", os.path.join(workdir, "sftp"),
+                      ready_port=sftp_port),
+        start_standin("fake_drive", "--port", str(drive_port), ready_port=drive_port),
+    ]
+    commit, dirty = git_commit()
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "trace_memory": not args.no_tracemalloc,
+        "results": [],
+    }
+    try:
+        for size in sizes:
+            keka = start_standin("fake_keka", "--employees", str(size), "--port", str(keka_port),
+                                 "--latency-ms", str(args.latency_ms),
+                                 ready_url=f"http://127.0.0.1:{keka_port}/api/v1/hris/employees")
+            try:
+                for path in paths:
+                    print(f"{path} @ {size} employees")
+                    timer = StageTimer(trace_memory=not args.no_tracemalloc)
+                    started = time.perf_counter()
+                    BENCHES[path](timer, workdir)
+                    report["results"].append({
+                        "size": size,
+                        "path": path,
+                        "total_seconds": round(time.perf_counter() - started, 4),
+                        "stages": timer.stages,
+                    })
+            finally:
+                keka.terminate()
+                keka.wait()
+    finally:
+        for process in standins:
+            process.terminate()
+            process.wait()
+
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    output = args.output or os.path.join(BASE_DIR, "benchmarks", "results",
+                                         f"bench_{commit or 'nocommit'}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+def compare(args):
+    """Print per-stage time and memory ratios of head vs base; exit 1 on regressions over the threshold."""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    base_stages = {(r["size"], r["path"], stage): values
+                   for r in base["results"] for stage, values in r["stages"].items()}
+
+    print(f"base {base.get('commit')}  ->  head {head.get('commit')}")
+    print(f"{'size':>7} {'path':10} {'stage':22} {'base s':>9} {'head s':>9} {'ratio':>6} {'mem ratio':>9}")
+    regressions = 0
+    for result in head["results"]:
+        for stage, values in result["stages"].items():
+            before = base_stages.get((result["size"], result["path"], stage))
+            if not before or "seconds" not in values or "seconds" not in before:
+                continue
+            ratio = values["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+            mem_ratio = (values["peak_alloc_mb"] / before["peak_alloc_mb"]) if before.get("peak_alloc_mb") else 1.0
+            slower = ratio > args.threshold and values["seconds"] - before["seconds"] > args.min_seconds
+            regressions += slower
+            flag = "  <-- slower" if slower else ""
+            print(f"{result['size']:>7} {result['path']:10} {stage:22} {before['seconds']:9.3f} "
+                  f"{values['seconds']:9.3f} {ratio:6.2f} {mem_ratio:9.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--paths", default=",".join(PATHS))
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency the fake Keka adds per request")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Time only; tracemalloc slows stages down")
+    parser.add_argument("--output", help="Report path (default: benchmarks/results/bench_<commit>_<time>.json)")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two benchmark reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=1.15)
+    compare_parser.add_argument("--min-seconds", type=float, default=0.05,
+                                help="Ignore slowdowns smaller than this many seconds")
+
+    args = parser.parse_args()
+    return compare(args) if args.command == "compare" else run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""Concurrent-client load test for the app's SSE sync endpoint.
+
+Starts the fake Keka and fake SFTP stand-ins and serves the app with
+uvicorn, then opens --clients concurrent GET /keka_sync streams while
+--homepage-clients keep requesting / until the streams end:
+
+    python benchmarks/sse_load.py --clients 20 --homepage-clients 4 --employees 5000 [--workers 1] [--cold]
+        [--max-loop-lag-ms 250] [--output report.json]
+
+The app is served through `monitored_app`, an ASGI wrapper that samples the
+event loop's lag (how late a 10 ms sleep wakes up) in each worker. It also
+notes when each SSE chunk is handed to the server, so the harness can tell
+event latency (server send to client read) apart from time to first event.
+A sampler reads the server processes' CPU and RSS from /proc.
+
+By default the directory snapshot is pre-written, so every sync exports
+straight away. With --cold there is none, and the first syncs follow one
+directory pull. The report goes to benchmarks/results/ like
+run_benchmarks.py. The harness exits 1 when any worker's loop stalled longer
+than --max-loop-lag-ms (default 250, 0 turns the check off), which flags work
+that blocks the event loop. With the export built on a worker thread, the
+defaults stay around 150 ms even on one CPU. An export run on the loop itself
+went over 500 ms, and that grows with the directory.
+"""
+import argparse
+import asyncio
+import bisect
+import glob
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PROBE_DIR_ENV = "SSE_LOAD_PROBE_DIR"
+LAG_INTERVAL = 0.01
+
+
+# ---- server side: runs inside each uvicorn worker ----
+
+class LoadProbe:
+    """ASGI wrapper: event-loop lag samples and SSE send times, flushed to PROBE_DIR_ENV every second."""
+
+    def __init__(self, app, probe_dir):
+        self.app = app
+        self.path = os.path.join(probe_dir, f"probe_{os.getpid()}.jsonl")
+        self.lags = []
+        self.sends = []
+        self._ids = itertools.count(1)
+        self._task = None
+
+    async def __call__(self, scope, receive, send):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample())
+        if scope["type"] != "http" or scope["path"] != "/keka_sync":
+            return await self.app(scope, receive, send)
+
+        conn = f"{os.getpid()}-{next(self._ids)}"
+        sent = 0
+
+        async def probe_send(message):
+            nonlocal sent
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-load-conn", conn.encode())]
+            elif message["type"] == "http.response.body" and message.get("body"):
+                sent += len(message["body"])
+                self.sends.append((conn, sent, time.time()))
+            await send(message)
+
+        await self.app(scope, receive, probe_send)
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        flushed_at = loop.time()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            now = loop.time()
+            self.lags.append(now - started - LAG_INTERVAL)
+            if now - flushed_at >= 1:
+                self.flush()
+                flushed_at = now
+
+    def flush(self):
+        lags, self.lags = self.lags, []
+        sends, self.sends = self.sends, []
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"pid": os.getpid(), "lags": lags, "sends": sends}) + "\n")
+
+
+def monitored_app():
+    """uvicorn factory: the app behind a LoadProbe."""
+    import app
+
+    return LoadProbe(app.app, os.environ[PROBE_DIR_ENV])
+
+
+# ---- harness side ----
+
+def summarize(values, scale=1000.0):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {"count": len(values), "p50": round(pick(0.50) * scale, 2), "p95": round(pick(0.95) * scale, 2),
+            "p99": round(pick(0.99) * scale, 2), "max": round(values[-1] * scale, 2)}
+
+
+def process_tree(root_pid):
+    """root_pid and its descendants, from /proc."""
+    parents = {}
+    for stat_path in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat_path) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents.setdefault(int(fields[1]), []).append(int(stat_path.split("/")[2]))
+    pids, queue = [], [root_pid]
+    while queue:
+        pid = queue.pop()
+        pids.append(pid)
+        queue.extend(parents.get(pid, []))
+    return pids
+
+
+def cpu_seconds_and_rss(pids):
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                resident_pages = int(f.read().split()[1])
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        rss += resident_pages * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+class ResourceSampler(threading.Thread):
+    """Server CPU percent and RSS every `interval` seconds while the load runs."""
+
+    def __init__(self, root_pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_mb = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not os.path.exists("/proc"):
+            return
+        last_cpu, last_time = cpu_seconds_and_rss(process_tree(self.root_pid))[0], time.time()
+        while not self.stopped.wait(self.interval):
+            cpu, rss = cpu_seconds_and_rss(process_tree(self.root_pid))
+            now = time.time()
+            self.cpu_percent.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss_mb.append(rss / 2 ** 20)
+            last_cpu, last_time = cpu, now
+
+
+async def sse_client(client, url, params):
+    result = {"conn": None, "ttfe": None, "seconds": None, "events": 0, "reads": [], "error": None}
+    started = time.time()
+    received = 0
+    try:
+        async with client.stream("GET", url, params=params) as response:
+            result["conn"] = response.headers.get("x-load-conn")
+            async for chunk in response.aiter_raw():
+                now = time.time()
+                received += len(chunk)
+                result["reads"].append((received, now))
+                result["events"] += chunk.count(b"data:")
+                if result["ttfe"] is None and b"data:" in chunk:
+                    result["ttfe"] = now - started
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.time() - started
+    return result
+
+
+async def homepage_client(client, url, stop):
+    latencies, errors = [], 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+            errors += response.status_code != 200
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+async def run_load(base_url, args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.clients + args.homepage_clients + 4)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        stop = asyncio.Event()
+        homepage = [asyncio.create_task(homepage_client(client, f"{base_url}/", stop))
+                    for _ in range(args.homepage_clients)]
+        params = {"wait": "true"} if args.wait else {}
+        streams = await asyncio.gather(*(sse_client(client, f"{base_url}/keka_sync", params)
+                                         for _ in range(args.clients)))
+        stop.set()
+        pages = await asyncio.gather(*homepage)
+    return streams, pages
+
+
+def event_latencies(streams, sends):
+    """Server send to client read, per chunk: the first read that covers the chunk's last byte."""
+    reads = {stream["conn"]: ([received for received, _ in stream["reads"]], [at for _, at in stream["reads"]])
+             for stream in streams if stream["conn"]}
+    latencies = []
+    for conn, sent, sent_at in sends:
+        received, read_at = reads.get(conn, ([], []))
+        position = bisect.bisect_left(received, sent)
+        if position < len(received):
+            latencies.append(max(read_at[position] - sent_at, 0.0))
+    return latencies
+
+
+def read_probes(probe_dir):
+    lags, sends, workers = [], [], set()
+    for path in glob.glob(os.path.join(probe_dir, "probe_*.jsonl")):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                workers.add(entry["pid"])
+                lags.extend(entry["lags"])
+                sends.extend(entry["sends"])
+    return lags, sends, len(workers)
+
+
+def write_snapshot(employees_count, folder):
+    import snapshot
+    from standins.fake_keka import generate_employees
+
+    snapshot.save_snapshot(generate_employees(employees_count), folder)
+
+
+def wait_for_server(process, ready_url, timeout=60):
+    import urllib.error
+    import urllib.request
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(ready_url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {process.returncode}")
+            time.sleep(0.2)
+    raise RuntimeError(f"uvicorn did not start within {timeout}s")
+
+
+def main():
+    from benchmarks.run_benchmarks import configure_env, free_port, git_commit, start_standin
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent /keka_sync streams")
+    parser.add_argument("--homepage-clients", type=int, default=2, help="Clients requesting / meanwhile")
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency the fake Keka adds per request")
+    parser.add_argument("--cold", action="store_true", help="Start without a directory snapshot")
+    parser.add_argument("--wait", action="store_true", help="Every sync follows a directory pull (?wait=true)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-stream timeout in seconds")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=250.0,
+                        help="Exit 1 when the worst loop lag exceeds this (0 = no check)")
+    parser.add_argument("--output", help="Report path (default: benchmarks/results/sse_load_<commit>_<time>.json)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="keka-sse-load-")
+    probe_dir = os.path.join(workdir, "probes")
+    os.makedirs(probe_dir)
+    keka_port, sftp_port, drive_port, app_port = free_port(), free_port(), free_port(), free_port()
+    configure_env(workdir, keka_port, sftp_port, drive_port)
+    os.environ.update({
+        PROBE_DIR_ENV: probe_dir,
+        "SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        # Only the load decides when directory pulls happen
+        "DIRECTORY_REFRESH_SECONDS": "0",
+    })
+    os.makedirs(os.path.join(workdir, "sftp", "Nephrocare"), exist_ok=True)
+    os.chdir(BASE_DIR)
+    if not args.cold:
+        write_snapshot(args.employees, os.environ["SNAPSHOT_DIR"])
+
+    processes = [
+        start_standin("fake_sftp", "--port", str(sftp_port), "--root", os.path.join(workdir, "sftp"),
+                      ready_port=sftp_port),
+        start_standin("fake_keka", "--employees", str(args.employees), "--port", str(keka_port),
+                      "--latency-ms", str(args.latency_ms),
+                      ready_url=f"http://127.0.0.1:{keka_port}/api/v1/hris/employees"),
+    ]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.sse_load:monitored_app", "--factory",
+         "--port", str(app_port), "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    processes.append(server)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        wait_for_server(server, f"{base_url}/keka_sync/runs")
+        sampler = ResourceSampler(server.pid)
+        sampler.start()
+        started = time.perf_counter()
+        streams, pages = asyncio.run(run_load(base_url, args))
+        wall_seconds = time.perf_counter() - started
+        sampler.stopped.set()
+        sampler.join()
+        # Let every worker flush its last second of probe samples
+        time.sleep(1.5)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    lags, sends, workers = read_probes(probe_dir)
+    homepage_latencies = [latency for latencies, _ in pages for latency in latencies]
+    commit, dirty = git_commit()
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "wall_seconds": round(wall_seconds, 3),
+        "sse": {
+            "clients": len(streams),
+            "completed": sum(1 for stream in streams if stream["error"] is None),
+            "errors": sorted({stream["error"] for stream in streams if stream["error"]}),
+            "events": sum(stream["events"] for stream in streams),
+            "time_to_first_event_ms": summarize([stream["ttfe"] for stream in streams if stream["ttfe"] is not None]),
+            "event_latency_ms": summarize(event_latencies(streams, sends)),
+            "stream_seconds": summarize([stream["seconds"] for stream in streams], scale=1.0),
+        },
+        "homepage": {
+            "requests": len(homepage_latencies),
+            "errors": sum(errors for _, errors in pages),
+            "latency_ms": summarize(homepage_latencies),
+        },
+        "server": {
+            "workers": workers,
+            "cpu_percent_mean": round(sum(sampler.cpu_percent) / len(sampler.cpu_percent), 1)
+            if sampler.cpu_percent else None,
+            "cpu_percent_max": round(max(sampler.cpu_percent), 1) if sampler.cpu_percent else None,
+            "rss_mb_peak": round(max(sampler.rss_mb), 1) if sampler.rss_mb else None,
+            "loop_lag_ms": summarize(lags),
+        },
+    }
+
+    sse, server_stats = report["sse"], report["server"]
+    print(f"{sse['completed']}/{sse['clients']} streams completed in {wall_seconds:.2f}s, {sse['events']} events")
+    for name, stats in (("time to first event", sse["time_to_first_event_ms"]),
+                        ("event latency", sse["event_latency_ms"]),
+                        ("homepage", report["homepage"]["latency_ms"]),
+                        ("event-loop lag", server_stats["loop_lag_ms"])):
+        if stats:
+            print(f"  {name:20s} p50 {stats['p50']:9.1f} ms  p95 {stats['p95']:9.1f} ms  max {stats['max']:9.1f} ms")
+    print(f"  server CPU mean {server_stats['cpu_percent_mean']}%, max {server_stats['cpu_percent_max']}%, "
+          f"peak RSS {server_stats['rss_mb_peak']} MB over {workers} workers")
+    for error in sse["errors"]:
+        print(f"  ❌ {error}")
+
+    output = args.output or os.path.join(BASE_DIR, "benchmarks", "results",
+                                         f"sse_load_{commit or 'nocommit'}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    worst_lag = server_stats["loop_lag_ms"]["max"] if server_stats["loop_lag_ms"] else 0
+    if args.max_loop_lag_ms and worst_lag > args.max_loop_lag_ms:
+        print(f"⚠️ Event loop stalled for {worst_lag:.1f} ms, over the {args.max_loop_lag_ms} ms budget")
+        return 1
+    return 1 if sse["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Startup budget check for the CLI and the web app.
+
+Runs each entry point under `python -X importtime`, sums the cumulative import
+time of the top-level imports, and fails if any entry point goes over its budget
+or pulls in a heavy module it does not need.
+
+    python benchmarks/startup_budget.py [--budget-ms 150] [--runtime-budget-ms 800] [--runs 5] [--json report.json]
+
+Argument parsing gets the tight budget. Importing the app, and the modules a
+subcommand needs before its first request, get a larger runtime budget because
+FastAPI or requests have to load there anyway. What matters on those paths is
+that pandas, paramiko and the Google client stay out.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "numpy", "paramiko", "googleapiclient", "google.auth", "google.oauth2", "httplib2"]
+
+# (name, python args, budget, heavy modules allowed on this path)
+ENTRY_POINTS = [
+    ("cli --help", ["cli.py", "--help"], "cli", []),
+    ("cli directory --help", ["cli.py", "directory", "--help"], "cli", []),
+    ("cli nephrocare --help", ["cli.py", "nephrocare", "--help"], "cli", []),
+    ("cli dice --help", ["cli.py", "dice", "--help"], "cli", []),
+    ("cli attendance --help", ["cli.py", "attendance", "--help"], "cli", []),
+    # What the directory subcommand imports before it makes its first request
+    ("directory subcommand modules", ["-c", "import cli, snapshot; cli.load_bridge()"], "runtime", []),
+    ("app import", ["-c", "import app"], "runtime", []),
+]
+
+
+def parse_importtime(stderr):
+    """Return ({module: cumulative_us}, top_level_total_us) from -X importtime output."""
+    modules, total = {}, 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative = int(cumulative_us)
+        modules[name.strip()] = cumulative
+        # Nested imports are indented under their parent; only count top-level ones
+        if not name[1:].startswith(" "):
+            total += cumulative
+    return modules, total
+
+
+def measure(args, runs):
+    totals, modules = [], {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            cwd=BASE_DIR, capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)} exited with {result.returncode}: {result.stderr[-500:]}")
+        modules, total = parse_importtime(result.stderr)
+        totals.append(total)
+    return statistics.median(totals) / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "150")))
+    parser.add_argument("--runtime-budget-ms", type=float,
+                        default=float(os.getenv("RUNTIME_STARTUP_BUDGET_MS", "800")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Write the measurements to this file")
+    args = parser.parse_args()
+
+    budgets = {"cli": args.budget_ms, "runtime": args.runtime_budget_ms}
+    report, failed = [], False
+    for name, entry_args, budget, allowed in ENTRY_POINTS:
+        import_ms, modules = measure(entry_args, args.runs)
+        heavy = sorted(m for m in HEAVY_MODULES if m in modules and m not in allowed)
+        ok = import_ms <= budgets[budget] and not heavy
+        failed |= not ok
+        report.append({"entry_point": name, "import_ms": round(import_ms, 1), "budget_ms": budgets[budget],
+                       "heavy_modules": heavy, "ok": ok})
+        status = "ok" if ok else "OVER BUDGET" if not heavy else f"loads {', '.join(heavy)}"
+        print(f"{name:32s} {import_ms:8.1f} ms  {status}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": report}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Command-line entry point for the Keka sync jobs.
+
+    python cli.py directory                   # pull the employee directory into a local snapshot
+    python cli.py nephrocare [--snapshot PATH | --latest-snapshot]
+    python cli.py dice [--snapshot PATH | --latest-snapshot]
+    python cli.py attendance [--start YYYY-MM-DD --end YYYY-MM-DD]
+    python cli.py attendance-export --start YYYY-MM-DD --end YYYY-MM-DD [--employee NO] [--center NAME]
+    python cli.py attendance-import output/att_*.csv   # backfill the attendance store from old CSVs
+    python cli.py attendance-queue enqueue --start YYYY-MM-DD --end YYYY-MM-DD   # then `work` on any number of hosts
+    python cli.py tenants [--config tenants.json] [--only a,b] [--workers N]   # every tenant's jobs (see tenants.py)
+    python cli.py --profile nephrocare        # per-stage cProfile/tracemalloc reports (see profiling.py)
+    python cli.py --record run.json.gz attendance   # save every Keka response to a cassette
+    python cli.py --replay run.json.gz attendance   # re-run from the cassette, no network (see keka_http.py)
+
+Only the standard library is imported at startup. pandas, paramiko, requests and
+the Google client are imported by the subcommand that needs them, so `--help`
+and light subcommands stay fast. benchmarks/startup_budget.py keeps it that way.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_bridge_lock = threading.Lock()
+
+
+def load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def load_bridge():
+    """Import keka-fcm-bridge.py, whose hyphenated name rules out a plain import."""
+    # Tenant jobs call this from several threads; none may see a half-executed module
+    with _bridge_lock:
+        module = sys.modules.get("keka_fcm_bridge")
+        if module is None:
+            spec = importlib.util.spec_from_file_location(
+                "keka_fcm_bridge", os.path.join(BASE_DIR, "keka-fcm-bridge.py"))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules["keka_fcm_bridge"] = module
+            spec.loader.exec_module(module)
+        return module
+
+
+def make_profiler(pipeline):
+    import profiling
+    import tenants
+    return profiling.Profiler(pipeline, tenants.getenv('TARTGET_FILE_PATH'))
+
+
+def make_report(profiler):
+    import run_report
+    return run_report.RunReport(profiler.pipeline, profiler.folder, profiler.run_id)
+
+
+def fetch_directory(profiler=None, page_filter=None):
+    """A live directory pull; `page_filter` keeps only what one export needs (see exports.page_filter)."""
+    bridge = load_bridge()
+    profiler = profiler or make_profiler("directory")
+    with profiler.stage("token_fetch"):
+        access_token = bridge.fetch_access_token()
+    if not access_token:
+        print("Failed to obtain access token.")
+        return None
+    with profiler.stage("directory_fetch"):
+        return bridge.call_second_api(access_token, page_filter)
+
+
+def employees_for_export(args, profiler=None, page_filter=None):
+    """Directory for an export: a saved snapshot when asked for, otherwise a live pull reduced by `page_filter`."""
+    import snapshot
+
+    if args.snapshot or args.latest_snapshot:
+        employees = snapshot.load_snapshot(args.snapshot)
+        if employees is None:
+            print(f"No directory snapshot found in {snapshot.snapshot_dir()}")
+        return employees
+    return fetch_directory(profiler, page_filter)
+
+
+def cmd_directory(args):
+    import run_report
+    import snapshot
+
+    profiler = make_profiler("directory")
+    with make_report(profiler).activate() as report:
+        employees = fetch_directory(profiler)
+        if not employees:
+            return report.finish(1)
+        run_report.add_records("directory", len(employees))
+        path = snapshot.save_snapshot(employees, args.output)
+        run_report.add_file_bytes("written", path)
+        print(f"Saved {len(employees)} employees to {path}")
+        return 0
+
+
+def cmd_nephrocare(args):
+    import exports
+
+    profiler = make_profiler("nephrocare")
+    with make_report(profiler).activate() as report:
+        employees = employees_for_export(args, profiler, exports.NEPHROCARE_PAGE_FILTER)
+        if not employees:
+            return report.finish(1)
+        load_bridge().upload_to_ftp(employees, profiler)
+        return 0
+
+
+def cmd_dice(args):
+    import exports
+
+    profiler = make_profiler("dice")
+    with make_report(profiler).activate() as report:
+        employees = employees_for_export(args, profiler, exports.DICE_PAGE_FILTER)
+        if not employees:
+            return report.finish(1)
+        load_bridge().upload_to_ftp_dice(employees, profiler)
+        return 0
+
+
+def cmd_attendance(args):
+    import attendance
+
+    return attendance.main(args.start, args.end)
+
+
+def cmd_attendance_export(args):
+    import attendance
+
+    attendance.export_attendance_window(args.start, args.end, args.employee, args.center, args.output)
+    return 0
+
+
+def cmd_attendance_import(args):
+    import attendance_store
+
+    for path in args.files:
+        print(f"{path}: {attendance_store.import_csv(path)} rows")
+    return 0
+
+
+def cmd_attendance_queue(args):
+    import attendance
+    import attendance_queue
+    import tenants
+
+    if args.action == "enqueue":
+        if not (args.start and args.end):
+            print("enqueue needs --start and --end")
+            return 2
+        access_token = attendance.fetch_access_token(tenants.getenv('API_KEY'))
+        employees = attendance.call_second_api(access_token, attendance.ACTIVE_PAGE_FILTER) if access_token else None
+        if not employees:
+            print("❌ Failed to fetch the employee directory.")
+            return 1
+        employee_data = attendance.filter_active_employees(employees)
+        print(attendance_queue.enqueue(employee_data, args.start, args.end, args.batch_size, args.window_days))
+        return 0
+    if args.action == "work":
+        if args.processes > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(args.processes) as pool:
+                futures = [pool.submit(attendance_queue.run_worker, args.job) for _ in range(args.processes)]
+                print(f"Completed {sum(future.result() for future in futures)} tasks")
+            return 0
+        attendance_queue.run_worker(args.job)
+        return 0
+    if args.action in ("merge", "requeue") and not args.job:
+        print(f"{args.action} needs --job")
+        return 2
+    if args.action == "merge":
+        attendance_queue.merge(args.job)
+        return 0
+    if args.action == "requeue":
+        print(f"Requeued {attendance_queue.requeue_failed(args.job)} failed tasks")
+        return 0
+    jobs = attendance_queue.list_jobs()
+    for job in jobs:
+        if not args.job or job["job_id"] == args.job:
+            print(f"{job['job_id']}  {job['status']:8s} {job['tasks']}  {job['output_file'] or ''}")
+    return 0
+
+
+def cmd_tenants(args):
+    import tenants
+
+    selected = tenants.load_tenants(args.config)
+    if args.only:
+        names = set(args.only.split(","))
+        selected = [tenant for tenant in selected if tenant["name"] in names]
+    job_args = argparse.Namespace(output=None, snapshot=None, latest_snapshot=False,
+                                  start=args.start, end=args.end)
+    results = tenants.run_tenants(selected, job_args, args.workers)
+    return 1 if any(results.values()) else 0
+
+
+COMMANDS = {
+    "directory": cmd_directory,
+    "nephrocare": cmd_nephrocare,
+    "dice": cmd_dice,
+    "attendance": cmd_attendance,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Keka directory, export and attendance jobs")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write per-stage cProfile and allocation reports next to the output files")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="Record every Keka response to this cassette")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="Serve Keka responses from this cassette")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    directory = subparsers.add_parser("directory", help="Fetch the employee directory into a local snapshot")
+    directory.add_argument("--output", help="Snapshot folder (default: $SNAPSHOT_DIR)")
+    directory.set_defaults(func=cmd_directory)
+
+    for name, func, help_text in (
+        ("nephrocare", cmd_nephrocare, "Build the Nephrocare SFTP export"),
+        ("dice", cmd_dice, "Build the Dice SFTP export"),
+    ):
+        export = subparsers.add_parser(name, help=help_text)
+        source = export.add_mutually_exclusive_group()
+        source.add_argument("--snapshot", help="Export from this directory snapshot instead of calling Keka")
+        source.add_argument("--latest-snapshot", action="store_true",
+                            help="Export from the newest directory snapshot instead of calling Keka")
+        export.set_defaults(func=func)
+
+    attendance = subparsers.add_parser("attendance", help="Export attendance and upload it to Google Drive")
+    attendance.add_argument("--start", help="First attendance date (YYYY-MM-DD)")
+    attendance.add_argument("--end", help="Last attendance date (YYYY-MM-DD)")
+    attendance.set_defaults(func=cmd_attendance)
+
+    export = subparsers.add_parser("attendance-export",
+                                   help="Write stored attendance for a date window to the CSV template")
+    export.add_argument("--start", required=True, help="First attendance date (YYYY-MM-DD)")
+    export.add_argument("--end", required=True, help="Last attendance date (YYYY-MM-DD)")
+    export.add_argument("--employee", help="Only this employee number")
+    export.add_argument("--center", help="Only this center")
+    export.add_argument("--output", help="CSV path (default: $TARGET_FILE_PATH/att_<start>_<end>_<timestamp>.csv)")
+    export.set_defaults(func=cmd_attendance_export)
+
+    backfill = subparsers.add_parser("attendance-import", help="Load earlier attendance CSVs into the attendance store")
+    backfill.add_argument("files", nargs="+")
+    backfill.set_defaults(func=cmd_attendance_import)
+
+    queue = subparsers.add_parser("attendance-queue",
+                                  help="Split a large attendance pull into leased tasks for several workers",
+                                  description="work also retries the merge of finished jobs whose merge failed; "
+                                              "merge --job JOB runs it by hand")
+    queue.add_argument("action", choices=["enqueue", "work", "status", "merge", "requeue"])
+    queue.add_argument("--job", help="Job id (work: only this job; merge/requeue: required)")
+    queue.add_argument("--start", help="enqueue: first attendance date (YYYY-MM-DD)")
+    queue.add_argument("--end", help="enqueue: last attendance date (YYYY-MM-DD)")
+    queue.add_argument("--batch-size", type=int, help="enqueue: employees per task (default 50)")
+    queue.add_argument("--window-days", type=int, help="enqueue: days per task (default 7)")
+    queue.add_argument("--processes", type=int, default=1, help="work: worker processes to start here")
+    queue.set_defaults(func=cmd_attendance_queue)
+
+    tenant_runner = subparsers.add_parser("tenants", help="Run every configured tenant's jobs on one shared worker pool")
+    tenant_runner.add_argument("--config", help="Tenants file (default: $KEKA_TENANTS_FILE or tenants.json)")
+    tenant_runner.add_argument("--only", help="Comma-separated tenant names to run")
+    tenant_runner.add_argument("--workers", type=int, help="Concurrent jobs (default: $KEKA_TENANT_WORKERS or 4)")
+    tenant_runner.add_argument("--start", help="First attendance date (YYYY-MM-DD)")
+    tenant_runner.add_argument("--end", help="Last attendance date (YYYY-MM-DD)")
+    tenant_runner.set_defaults(func=cmd_tenants)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    load_env()
+    if args.profile:
+        os.environ["KEKA_PROFILE"] = "1"
+    if args.record or args.replay:
+        os.environ["KEKA_CASSETTE"] = args.record or args.replay
+        os.environ["KEKA_CASSETTE_MODE"] = "record" if args.record else "replay"
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+
+import tenants
+
+# === Google Drive settings ===
+# GDRIVE_FOLDER_ID, SERVICE_ACCOUNT_FILE (default gcp_key.json) and the DRIVE_* settings below
+# are read per call through tenants.getenv, so .env and tenant overrides apply
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+DEFAULT_DRIVE_ROOT_URL = "https://www.googleapis.com/"
+# Trimmed copy of the Drive v3 discovery document, so building the client never hits the network
+DEFAULT_DISCOVERY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery", "drive.v3.json")
+
+# One client per (service account, root URL, discovery document), built once
+_services = {}
+_service_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def gdrive_folder_id():
+    return tenants.getenv("GDRIVE_FOLDER_ID")
+
+
+def service_account_file():
+    return tenants.getenv("SERVICE_ACCOUNT_FILE", "gcp_key.json")
+
+
+def drive_root_url():
+    # Point at a local stand-in (e.g. http://127.0.0.1:8765/) to exercise uploads without Google
+    return tenants.getenv("DRIVE_ROOT_URL", DEFAULT_DRIVE_ROOT_URL)
+
+
+def discovery_file():
+    return tenants.getenv("DRIVE_DISCOVERY_FILE", DEFAULT_DISCOVERY_FILE)
+
+
+def resumable_threshold():
+    return int(tenants.getenv("DRIVE_RESUMABLE_THRESHOLD", 5 * 1024 * 1024))
+
+
+def upload_chunk_size():
+    # Drive requires resumable chunks to be a multiple of 256 KiB
+    return int(tenants.getenv("DRIVE_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+
+
+def upload_retries():
+    return int(tenants.getenv("DRIVE_UPLOAD_RETRIES", "3"))
+
+
+class DriveUploadError(Exception):
+    pass
+
+
+def _load_credentials(account_file, root_url):
+    if os.path.exists(account_file):
+        from google.oauth2 import service_account
+        return service_account.Credentials.from_service_account_file(account_file, scopes=DRIVE_SCOPES)
+    if root_url != DEFAULT_DRIVE_ROOT_URL:
+        # Local stand-in: nothing to authenticate against
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
+    raise DriveUploadError(f"Service account file not found: {account_file}")
+
+
+def _service_key():
+    return service_account_file(), drive_root_url(), discovery_file()
+
+
+def get_drive_service():
+    """Build the Drive client once per settings from the bundled discovery document."""
+    return _client(_service_key())[0]
+
+
+def _client(key):
+    """(service, credentials) for `key`, built on first use."""
+    client = _services.get(key)
+    if client is None:
+        with _service_lock:
+            client = _services.get(key)
+            if client is None:
+                from googleapiclient.discovery import build_from_document
+
+                account_file, root_url, discovery_path = key
+                with open(discovery_path) as f:
+                    discovery_doc = json.load(f)
+                discovery_doc["rootUrl"] = root_url
+                discovery_doc["baseUrl"] = root_url + discovery_doc["servicePath"]
+                credentials = _load_credentials(account_file, root_url)
+                client = _services[key] = (
+                    build_from_document(discovery_doc, http=_authorized_http(credentials)), credentials)
+    return client
+
+
+def _authorized_http(credentials):
+    import google_auth_httplib2
+    from googleapiclient.http import build_http
+
+    # build_http keeps 308 out of the redirect codes, which resumable uploads rely on
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+
+
+def _thread_http():
+    """httplib2 connections are not thread-safe, so each upload thread gets its own."""
+    key = _service_key()
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+    http = connections.get(key)
+    if http is None:
+        http = connections[key] = _authorized_http(_client(key)[1])
+    return http
+
+
+def file_md5(file_path):
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_existing_file(file_name, md5_checksum, folder_id=None):
+    """Return the id of a non-trashed file with the same name and MD5 in the folder, if any."""
+    folder_id = folder_id or gdrive_folder_id()
+    escaped_name = file_name.replace("\\", "\\\\").replace("'", "\\'")
+    query = f"name = '{escaped_name}' and trashed = false"
+    if folder_id:
+        query += f" and '{folder_id}' in parents"
+
+    response = get_drive_service().files().list(
+        q=query,
+        fields="files(id, name, md5Checksum)",
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True,
+        pageSize=100,
+    ).execute(http=_thread_http(), num_retries=upload_retries())
+    for existing in response.get("files", []):
+        if existing.get("md5Checksum") == md5_checksum:
+            return existing["id"]
+    return None
+
+
+def upload_file(file_path, file_name=None, folder_id=None, mimetype="text/csv"):
+    """Upload one file to Drive unless an identical copy is already there; returns the file id.
+
+    `folder_id` defaults to GDRIVE_FOLDER_ID. Safe to call from several threads
+    at once (tenant jobs do): each thread uploads over its own connection.
+    """
+    import httplib2
+    from google.auth.exceptions import GoogleAuthError
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload
+
+    file_name = file_name or os.path.basename(file_path)
+    folder_id = folder_id or gdrive_folder_id()
+    try:
+        md5_checksum = file_md5(file_path)
+        existing_id = find_existing_file(file_name, md5_checksum, folder_id)
+        if existing_id:
+            print(f"⏭️ {file_name} already on Drive with the same checksum (ID: {existing_id}), skipping upload")
+            return existing_id
+
+        file_metadata = {"name": file_name}
+        if folder_id:
+            file_metadata["parents"] = [folder_id]
+
+        resumable = os.path.getsize(file_path) > resumable_threshold()
+        media = MediaFileUpload(file_path, mimetype=mimetype, resumable=resumable,
+                                chunksize=upload_chunk_size() if resumable else -1)
+        request = get_drive_service().files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id, md5Checksum",
+            supportsAllDrives=True  # 🔹 Required for Shared Drives
+        )
+
+        http = _thread_http()
+        if resumable:
+            uploaded_file = None
+            while uploaded_file is None:
+                status, uploaded_file = request.next_chunk(http=http, num_retries=upload_retries())
+                if status:
+                    print(f"⬆️ {file_name}: {int(status.progress() * 100)}%")
+        else:
+            uploaded_file = request.execute(http=http, num_retries=upload_retries())
+    except HttpError as e:
+        raise DriveUploadError(f"Google Drive upload of {file_name} failed with HTTP {e.resp.status}: {e}") from e
+    except (OSError, httplib2.HttpLib2Error, GoogleAuthError) as e:
+        # Token refresh (RefreshError, TransportError) and httplib2 transport failures
+        raise DriveUploadError(f"Google Drive upload of {file_name} failed: {e}") from e
+
+    if uploaded_file.get("md5Checksum") and uploaded_file["md5Checksum"] != md5_checksum:
+        raise DriveUploadError(f"Checksum mismatch after uploading {file_name}")
+    print(f"✅ File uploaded to Shared Drive with ID: {uploaded_file.get('id')}")
+    return uploaded_file.get("id")
+
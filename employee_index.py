@@ -0,0 +1,225 @@
+"""In-memory employee lookups for the web app, served from the last directory snapshot.
+
+The app loads the newest snapshot at startup and swaps in a new index after
+each /keka_sync or POST /employees/reload. Requests only read the current
+index, so they never call Keka. A swap replaces one module-level reference,
+so readers see either the old index or the new one, never a half-built one.
+
+Each employee is reduced once, at build time, to the fields support staff
+ask about: NPID (employeeNumber), name, email, center, titles and the L1/L2
+managers. Lookups by NPID and email are dict hits. Center listings use a
+per-center list. Other filters scan the (small) records list.
+
+Webhook events (see webhooks.py) change a few employees at a time.
+`apply_changes` builds the next index from the current one, re-deriving only
+the records of the changed employees and of their direct and L2 reports,
+then swaps it in the same way.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+import snapshot
+from org_graph import OrgGraph, _ref_email, takes_precedence
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_current = None
+_reload_lock = threading.Lock()
+
+
+def _center(employee):
+    return next((g.get('title') for g in employee.get('groups', []) if g.get('groupType') == 3), None)
+
+
+def _person(employee):
+    if employee is None:
+        return None
+    return {
+        "employeeNumber": employee.get("employeeNumber"),
+        "displayName": employee.get("displayName"),
+        "email": employee.get("email"),
+    }
+
+
+def _manager_keys(record):
+    l1 = record["l1Manager"] or {}
+    return ((l1.get("employeeNumber") or "").lower(), (l1.get("email") or "").lower())
+
+
+def employee_record(employee, by_email):
+    """The looked-up fields of `employee`; `by_email` maps emails to employees (OrgGraph.by_email)."""
+    return {
+        "employeeNumber": employee.get("employeeNumber"),
+        "displayName": employee.get("displayName"),
+        "email": employee.get("email"),
+        "center": _center(employee),
+        "jobTitle": (employee.get("jobTitle") or {}).get("title"),
+        "secondaryJobTitle": employee.get("secondaryJobTitle"),
+        "employmentStatus": employee.get("employmentStatus"),
+        "l1Manager": _person(by_email.get(_ref_email(employee, "reportsTo"))),
+        "l2Manager": _person(by_email.get(_ref_email(employee, "l2Manager"))),
+    }
+
+
+def _row(record):
+    """(record, lower-cased "NPID name email") as the search scans it."""
+    return record, " ".join(str(record[key] or "") for key in ("employeeNumber", "displayName", "email")).lower()
+
+
+def employee_key(employee):
+    """Keka's employee id, which survives NPID and email changes."""
+    return employee.get("id") or employee.get("employeeNumber")
+
+
+class EmployeeSnapshot:
+    def __init__(self, employees, source=None, fetched_at=None, rows_by_key=None, by_email=None):
+        # The raw directory, for exports run from the snapshot
+        self.employees = employees
+        self.source = source
+        self.fetched_at = fetched_at or time.time()
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+        # Raw employees by email, as OrgGraph resolves them
+        self._employee_by_email = OrgGraph(employees).by_email if by_email is None else by_email
+        if rows_by_key is None:
+            rows_by_key = {employee_key(employee): _row(employee_record(employee, self._employee_by_email))
+                           for employee in employees}
+        self._rows_by_key = rows_by_key
+        # (record, search text) pairs, all and per center, in NPID order
+        self._rows = sorted(rows_by_key.values(), key=lambda row: row[0]["employeeNumber"] or "")
+        self.records = [row[0] for row in self._rows]
+        self.by_number = {}
+        self.by_email = {}
+        self._rows_by_center = {}
+        for row in self._rows:
+            record = row[0]
+            self.by_number.setdefault((record["employeeNumber"] or "").upper(), record)
+            self.by_email.setdefault((record["email"] or "").lower(), record)
+            self._rows_by_center.setdefault((record["center"] or "").lower(), []).append(row)
+
+    def age_seconds(self):
+        return time.time() - self.fetched_at
+
+    def __len__(self):
+        return len(self.records)
+
+    def by_npid(self, employee_number):
+        return self.by_number.get(employee_number.strip().upper())
+
+    def by_mail(self, email):
+        return self.by_email.get(email.strip().lower())
+
+    def centers(self):
+        return sorted(
+            ({"center": rows[0][0]["center"], "employees": len(rows)}
+             for key, rows in self._rows_by_center.items() if key),
+            key=lambda center: center["center"],
+        )
+
+    def search(self, center=None, job_title=None, manager=None, status=None, q=None,
+               offset=0, limit=DEFAULT_PAGE_SIZE):
+        """Records matching every given filter, in NPID order, as (total, page)."""
+        rows = self._rows if center is None else self._rows_by_center.get(center.strip().lower(), [])
+        # A comprehension per filter is several times faster than one loop of ifs
+        if q:
+            q = q.strip().lower()
+            rows = [row for row in rows if q in row[1]]
+        if status is not None:
+            rows = [row for row in rows if row[0]["employmentStatus"] == status]
+        if job_title:
+            job_title = job_title.lower()
+            rows = [row for row in rows if job_title in (row[0]["jobTitle"] or "").lower()]
+        if manager:
+            manager = manager.strip().lower()
+            rows = [row for row in rows if manager in _manager_keys(row[0])]
+        offset = max(offset, 0)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        return len(rows), [row[0] for row in rows[offset:offset + limit]]
+
+    def apply(self, upserts, deleted_keys, source="webhook"):
+        """The next index after upserting `upserts` ({key: employee}) and removing `deleted_keys`.
+
+        Returns (index, employee numbers whose records or export rows may have
+        changed). Updated employees keep their place in directory order, new
+        ones go at the end. Only the changed employees and their direct and L2
+        reports get new records; every other row is carried over.
+        """
+        employees = []
+        changed = []
+        for employee in self.employees:
+            key = employee_key(employee)
+            if key in deleted_keys or key in upserts:
+                changed.append(employee)
+            if key not in deleted_keys:
+                employees.append(upserts.get(key, employee))
+        known = self._rows_by_key.keys() | {employee_key(employee) for employee in changed}
+        employees.extend(employee for key, employee in upserts.items() if key not in known)
+        changed.extend(upserts.values())
+
+        # One pass re-resolves the changed emails (as OrgGraph does) and finds whose manager fields show them
+        emails = {employee.get("email") for employee in changed}
+        by_email = dict(self._employee_by_email)
+        for email in emails:
+            by_email.pop(email, None)
+        affected = dict(upserts)
+        for employee in employees:
+            email = employee.get("email")
+            if email in emails:
+                current = by_email.get(email)
+                if current is None or takes_precedence(employee, current):
+                    by_email[email] = employee
+            if _ref_email(employee, "reportsTo") in emails or _ref_email(employee, "l2Manager") in emails:
+                affected[employee_key(employee)] = employee
+
+        rows_by_key = dict(self._rows_by_key)
+        for key in deleted_keys:
+            rows_by_key.pop(key, None)
+        for key, employee in affected.items():
+            rows_by_key[key] = _row(employee_record(employee, by_email))
+        index = EmployeeSnapshot(employees, source, self.fetched_at, rows_by_key, by_email)
+        numbers = {employee.get("employeeNumber") for employee in changed}
+        numbers.update(employee.get("employeeNumber") for employee in affected.values())
+        return index, sorted(number for number in numbers if number)
+
+
+def current():
+    """The live EmployeeSnapshot, or None before any directory has been loaded."""
+    return _current
+
+
+def swap(index):
+    global _current
+    _current = index
+    print(f"📇 Employee index now serves {len(index)} employees from {index.source}")
+    return index
+
+
+def refresh(employees, source="sync"):
+    index = EmployeeSnapshot(employees, source)
+    with _reload_lock:
+        return swap(index)
+
+
+def apply_changes(upserts, deleted_keys, source="webhook"):
+    """Upsert and delete employees in the live index; returns the affected employee numbers.
+
+    Raises LookupError when no directory has been loaded yet.
+    """
+    with _reload_lock:
+        if _current is None:
+            raise LookupError("No employee directory loaded yet")
+        index, numbers = _current.apply(upserts, deleted_keys, source)
+        swap(index)
+    return numbers
+
+
+def load_latest():
+    """Index the newest directory snapshot on disk; returns the index, or None when there is no snapshot."""
+    with _reload_lock:
+        path = snapshot.latest_snapshot_path()
+        if path is None:
+            print(f"📇 No directory snapshot in {snapshot.snapshot_dir()}, employee lookups stay empty")
+            return None
+        return swap(EmployeeSnapshot(snapshot.load_snapshot(path), path, os.path.getmtime(path)))
@@ -0,0 +1,286 @@
+"""Serve generated export CSVs over HTTP without running a sync.
+
+    GET /exports                      every export on disk, newest first
+    GET /exports/{kind}/latest        newest nephrocare, dice or attendance file
+    GET /exports/files/{name}         any earlier export by file name
+
+Files stream from disk in chunks. Each response carries a content-hash ETag,
+so `If-None-Match` revalidation gets a 304 without a body. Clients that send
+`Accept-Encoding` get a gzip (or br, when the brotli package is installed)
+copy, compressed once per file and cached under EXPORT_CACHE_DIR. When a new
+copy is made, copies of anything but the current exports this process has
+hashed are removed once unused for CACHE_GRACE_SECONDS, so in-flight
+responses finish; nothing is rehashed to decide.
+`Range: bytes=...` requests (single range, optionally with `If-Range`) are
+served from the uncompressed file with 206.
+
+Only names matching an export pattern in the export folders are served, so
+templates, snapshots and anything outside output/ stay private.
+"""
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import tenants
+
+CHUNK_SIZE = 64 * 1024
+CACHE_GRACE_SECONDS = 3600
+
+# kind -> (folder setting, file name pattern)
+EXPORT_KINDS = {
+    "nephrocare": ("TARTGET_FILE_PATH", re.compile(r"^\d{8}_\d{6}\.csv$")),
+    "dice": ("TARTGET_FILE_PATH", re.compile(r"^Dice_\d{8}_\d{6}\.csv$")),
+    "attendance": ("TARGET_FILE_PATH", re.compile(r"^att_\d{4}-\d{2}-\d{2}_\d{4}-\d{2}-\d{2}_\d{8}_\d{6}\.csv$")),
+}
+
+# absolute path -> (size, mtime_ns, digest), one entry per export file
+_etags = {}
+_etag_lock = threading.Lock()
+
+
+def export_folder(kind):
+    return tenants.getenv(EXPORT_KINDS[kind][0], "output")
+
+
+def cache_dir():
+    return tenants.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "keka_export_cache"))
+
+
+def export_kind(name):
+    for kind, (_, pattern) in EXPORT_KINDS.items():
+        if pattern.match(name):
+            return kind
+    return None
+
+
+def list_exports(kind=None):
+    """[{name, kind, size, modified}] for every export on disk, newest first."""
+    exports = []
+    for folder in sorted({export_folder(k) for k in ([kind] if kind else EXPORT_KINDS)}):
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            name_kind = export_kind(name)
+            if name_kind is None or (kind and name_kind != kind) or export_folder(name_kind) != folder:
+                continue
+            stat = os.stat(os.path.join(folder, name))
+            exports.append({
+                "name": name,
+                "kind": name_kind,
+                "size": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+            })
+    exports.sort(key=lambda export: (export["modified"], export["name"]), reverse=True)
+    return exports
+
+
+def latest_export(kind):
+    exports = list_exports(kind)
+    return os.path.join(export_folder(kind), exports[0]["name"]) if exports else None
+
+
+def resolve_export(name):
+    """Path of the export called `name`, or None when it is not an export or does not exist."""
+    kind = export_kind(name)
+    if kind is None:
+        return None
+    path = os.path.join(export_folder(kind), name)
+    return path if os.path.isfile(path) else None
+
+
+def content_hash(path):
+    """sha256 of the file, cached until its size or mtime changes."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _etag_lock:
+        cached = _etags.get(path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()[:32]
+    with _etag_lock:
+        _etags[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header, by q-value with br preferred on ties."""
+    offered = {"gzip": 0.0, "br": 0.0}
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        if coding == "*":
+            offered = {k: v or q for k, v in offered.items()}
+        elif coding in offered:
+            offered[coding] = q
+    if _brotli() is None:
+        offered["br"] = 0.0
+    best = max(offered, key=lambda coding: (offered[coding], coding == "br"))
+    return best if offered[best] > 0 else None
+
+
+def compressed_copy(path, digest, encoding):
+    """Path of a cached `encoding` copy of `path`, compressing it on first use."""
+    folder = cache_dir()
+    os.makedirs(folder, exist_ok=True)
+    cached = os.path.join(folder, f"{digest}.{'gz' if encoding == 'gzip' else 'br'}")
+    if os.path.exists(cached):
+        # Mark it used, so prune_cache leaves it alone while it is being served
+        os.utime(cached)
+        return cached
+    tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if encoding == "gzip":
+        with open(path, "rb") as src, gzip.GzipFile(tmp_path, "wb", mtime=0) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        compressor = _brotli().Compressor()
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+    os.replace(tmp_path, cached)
+    prune_cache(known_digests())
+    return cached
+
+
+def known_digests():
+    """Cached content hashes of exports still on disk unchanged; entries for deleted or changed files are dropped."""
+    with _etag_lock:
+        entries = list(_etags.items())
+    digests = set()
+    for path, entry in entries:
+        try:
+            stat = os.stat(path)
+            current = (stat.st_size, stat.st_mtime_ns) == entry[:2]
+        except FileNotFoundError:
+            current = False
+        if current:
+            digests.add(entry[2])
+            continue
+        with _etag_lock:
+            if _etags.get(path) == entry:
+                del _etags[path]
+    return digests
+
+
+def prune_cache(keep_digests, folder=None, grace_seconds=CACHE_GRACE_SECONDS):
+    """Delete cached copies (and leftover temp files) not in `keep_digests` and unused for `grace_seconds`."""
+    folder = folder or cache_dir()
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.split(".")[0] in keep_digests and not name.endswith(".tmp"):
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def parse_range(range_header, size):
+    """(start, end) inclusive for a single `bytes=` range, "unsatisfiable", or None to serve the whole file."""
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header or "")
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def read_chunks(path, start=0, length=None):
+    remaining = os.path.getsize(path) - start if length is None else length
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, cache_control="no-cache"):
+    """StreamingResponse for an export, honouring If-None-Match, Accept-Encoding, Range and If-Range."""
+    from fastapi.responses import Response, StreamingResponse
+
+    digest = content_hash(path)
+    size = os.path.getsize(path)
+    headers = {
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"',
+    }
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if range_header and (not if_range or if_range.strip() == f'"{digest}"'):
+        byte_range = parse_range(range_header, size)
+    encoding = None if byte_range else choose_encoding(request.headers.get("accept-encoding"))
+
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers["ETag"] = etag
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if byte_range == "unsatisfiable":
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(read_chunks(path, start, end - start + 1), status_code=206,
+                                 media_type="text/csv", headers=headers)
+
+    if encoding:
+        path = compressed_copy(path, digest, encoding)
+        headers["Content-Encoding"] = encoding
+    headers["Content-Length"] = str(os.path.getsize(path))
+    return StreamingResponse(read_chunks(path), media_type="text/csv", headers=headers)
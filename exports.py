@@ -0,0 +1,450 @@
+"""Row building and template filling shared by the Nephrocare and Dice exports.
+
+app.upload_to_ftp and keka-fcm-bridge.py both build the same 27-column
+Nephrocare rows, and the bridge builds the 16-column Dice rows. Each stage
+lives here as its own function so the pipelines (and the benchmarks) can run
+them one at a time.
+"""
+
+import tenants
+from org_graph import MANAGER_FIELDS, ManagerIndex, OrgGraph
+
+NEPHROCARE_COLUMNS = 27
+DICE_COLUMNS = 16
+TEST_EMPLOYEE_NUMBERS = {'TEST001', 'TEST002', 'TEST003', 'TEST004', 'TEST005'}
+SUPPORT_GROUPS = ["Support Office", "Support Zones"]
+
+IMPORT_ACTION_DEFAULTS = {"add": "Add", "update": "Update", "delete": "Delete"}
+
+
+# Settings below are read at call time: app.py and the bridge load .env after importing this module
+def import_action(change):
+    """ImportAction value for an "add", "update" or "delete" row (IMPORT_ACTION_ADD / _UPDATE / _DELETE)."""
+    return tenants.getenv(f"IMPORT_ACTION_{change.upper()}", IMPORT_ACTION_DEFAULTS[change])
+
+
+def nephrocare_export_mode():
+    """NEPHROCARE_EXPORT_MODE: "full" uploads every row with its ImportAction, "delta" only the changed ones."""
+    return tenants.getenv("NEPHROCARE_EXPORT_MODE", "full").lower()
+
+
+def row_workers():
+    """EXPORT_ROW_WORKERS: process pool size for row building (0 or 1 builds in-process)."""
+    return int(tenants.getenv("EXPORT_ROW_WORKERS", "0"))
+
+
+def shard_min_rows():
+    """EXPORT_SHARD_MIN_ROWS: the smallest employee list worth the pool's start-up and pickling cost."""
+    return int(tenants.getenv("EXPORT_SHARD_MIN_ROWS", "20000"))
+
+
+# Employee fields the row builders read; everything else stays out of the worker payload
+ROW_FIELDS = (
+    "employmentStatus", "employeeNumber", "email", "firstName", "middleName", "lastName", "gender",
+    "jobTitle", "secondaryJobTitle", "bandInfo", "reportsTo", "l2Manager", "groups", "customFields",
+    "mobilePhone",
+)
+# Top-level values build_dice_rows reads besides its nested fields, plus the ids the row cache and lookups use
+DICE_ROW_SCALARS = (
+    "id", "employeeNumber", "firstName", "middleName", "lastName", "displayName", "gender", "employmentStatus",
+    "mobilePhone", "email", "secondaryJobTitle",
+)
+
+_dice_extra_numbers = ("", frozenset())
+
+
+def dice_extra_employee_numbers():
+    """Dice recipients outside the center manager -> cluster manager hierarchy (DICE_EXTRA_EMPLOYEE_NUMBERS,
+    comma separated), lowercased."""
+    global _dice_extra_numbers
+    raw = tenants.getenv("DICE_EXTRA_EMPLOYEE_NUMBERS", "")
+    # Parsed once per value; this runs for every record of a Dice pull
+    if raw != _dice_extra_numbers[0]:
+        _dice_extra_numbers = (raw, frozenset(n.strip().lower() for n in raw.split(",") if n.strip()))
+    return _dice_extra_numbers[1]
+
+
+def extract_band_value(band_info):
+    # Split the band_info string by space and return the second part (the value after "band")
+    parts = band_info.split()
+    if len(parts) > 1:
+        return parts[1]  # Return the second part (value after "band")
+    return None  # Return None if the string doesn't contain a valid value after "band"
+
+
+def sort_employees(all_employees):
+    return sorted(all_employees, key=lambda x: x.get("employeeNumber", ""))
+
+
+def is_support_employee(record):
+    """nephroplus.com employees in the Support Office / Support Zones groups."""
+    return (bool(record.get('email')) and "nephroplus.com" in record['email'].lower()
+            and any(group.get("title") in SUPPORT_GROUPS for group in record.get("groups", [])))
+
+
+def filter_support_employees(all_employees):
+    return [record for record in all_employees if is_support_employee(record)]
+
+
+def page_filter(predicate, reduce_record=None):
+    """Reduce each decoded directory page to what one export needs, as the pages arrive.
+
+    Records matching `predicate` are kept whole. The rest are cut down by
+    `reduce_record` to what the export still reads from them (as someone's
+    manager), or dropped when it is None. So a pull for an export holds the
+    exported population, not the tenant.
+    """
+    def reduce_page(employees):
+        kept = []
+        for employee in employees:
+            if predicate(employee):
+                kept.append(employee)
+            elif reduce_record is not None:
+                kept.append(reduce_record(employee))
+        return kept
+    return reduce_page
+
+
+def manager_record(employee):
+    """The fields the approver and L2 lookups read from a manager's record."""
+    return {key: employee[key] for key in MANAGER_FIELDS if key in employee}
+
+
+def _first_match(items, keep):
+    # Stops where the builders' next(...) stops, so a malformed later item is not touched either
+    for item in items:
+        if keep(item):
+            return [item]
+    return []
+
+
+def dice_row_record(employee):
+    """Just the values build_dice_rows and the OrgGraph read from `employee`.
+
+    Nested fields keep only what is read: the first zone custom field, the
+    first center group (groupType 3), the job title and the managers' emails.
+    Missing keys and None values stay as they are, so the row comes out the same.
+    """
+    record = {key: employee[key] for key in DICE_ROW_SCALARS if key in employee}
+    record.update((key, None) for key in ("customFields", "groups") if key in employee)
+    for key in ("jobTitle", "reportsTo", "l2Manager"):
+        if key in employee:
+            value = employee[key]
+            field = "title" if key == "jobTitle" else "email"
+            record[key] = {field: value[field]} if isinstance(value, dict) and field in value else value
+    # Every employee passes through here, not just Dice recipients, so a null list
+    # or an untitled field on someone else's record must not stop the page
+    if employee.get("customFields") is not None:
+        record["customFields"] = _first_match(
+            employee["customFields"], lambda f: 'zone' in (f.get('title') or '').lower())
+    if employee.get("groups") is not None:
+        record["groups"] = _first_match(employee["groups"], lambda group: group.get('groupType') == 3)
+    return record
+
+
+def gender_and_prefix(employee):
+    gender = None  # Default value
+    prefix = None
+    if employee.get('gender') == 1:
+        gender = 'M'
+    elif employee.get('gender') == 2:
+        gender = 'F'
+
+    if gender == "M":
+        prefix = "Mr"
+    elif gender == "F":
+        prefix = "Ms"
+    return gender, prefix
+
+
+def nephrocare_includes(employee):
+    """Whether `employee` gets a Nephrocare row: active, banded and not a test account."""
+    return (employee.get("employmentStatus") == 0 and employee.get("employeeNumber") not in TEST_EMPLOYEE_NUMBERS
+            and bool(employee.get('bandInfo')))
+
+
+def is_nephrocare_employee(employee):
+    """Support employees who get a Nephrocare row."""
+    return is_support_employee(employee) and nephrocare_includes(employee)
+
+
+def dice_includes(employee):
+    return employee.get("employeeNumber") not in TEST_EMPLOYEE_NUMBERS
+
+
+def build_nephrocare_rows(employee_data, all_employees, graph=None):
+    """27-column Nephrocare rows for the active, banded, non-test employees in `employee_data`."""
+    graph = graph or OrgGraph(all_employees)
+    data_to_write = []
+    for employee in employee_data:
+        if nephrocare_includes(employee):
+            approver_employee_info = graph.manager(employee)
+
+            group_title = next(
+                (group['title'] for group in employee['groups'] if group['groupType'] == 3), None)
+
+            l2Manager_info = graph.l2_manager(employee)
+            band_value = None
+            if employee.get('bandInfo'):
+                band_info = employee.get('bandInfo', {}).get(
+                    'title', 'NP Band')  # Default value is 'NP Band'
+                band_value = extract_band_value(band_info)
+
+            gender, prefix = gender_and_prefix(employee)
+
+            data_to_write.append([
+                '',
+                employee.get('email', ''),                     # Email
+                employee.get('employeeNumber', ''),            # EmployeeID
+                # Prefix (No info in given data)
+                prefix,
+                employee.get('firstName', ''),                  # FirstName
+                employee.get('middleName', ''),                 # MiddleName
+                employee.get('lastName', ''),                   # LastName
+                # Suffix (No info in given data)
+                '',
+                # Gender (No info in given data)
+                gender,
+                employee.get('jobTitle', {}).get(
+                    'title', ''),  # Title (Job Title)
+                employee.get(
+                    'reportsTo', {}).get('email', ''),
+                approver_employee_info.get(
+                    'employeeNumber', '') if approver_employee_info else '',  # ApproverEmail
+                # Reporting1Data (No info in given data)
+                employee.get('employeeNumber', ''),
+                # Reporting2Data (No info in given data)
+                employee.get('jobTitle', {}).get('title', ''),
+                # Reporting3Data (No info in given data)
+                'Ops',
+                # Reporting4Data (No info in given data)
+                group_title,
+                # Reporting5Data (No info in given data)
+                '',
+                # Reporting6Data (No info in given data)
+                band_value,
+                # GroupIdentifier (No info in given data)
+                '8A5FA38D-592E-4EE5-9DC2-1A984EFF6E68',
+                # Email2Type (No info in given data)
+                'P',
+                # Email2 (No info in given data)
+                employee.get('email', 'Test@nephroplus.com'),
+                approver_employee_info.get(
+                    'displayName', '') if approver_employee_info else 'Test ',  # ApproverEmail
+                # DefaultApprover1Email
+                l2Manager_info.get(
+                    'email', '') if l2Manager_info else approver_employee_info.get('email', '') if approver_employee_info else 'Test@nephroplus.com',
+                # DefaultApprover1Name
+                l2Manager_info.get('displayName', '') if l2Manager_info else approver_employee_info.get(
+                    'displayName', '') if approver_employee_info else 'Test',
+                # DefaultApprover1Name
+                l2Manager_info.get(
+                    'employeeNumber', '') if l2Manager_info else approver_employee_info.get('displayName', '') if approver_employee_info else '',
+                employee.get('mobilePhone', ''),                 # CellPhone
+                # OnlineEnabled (No info in given data)
+                'TRUE'
+            ])
+    return data_to_write
+
+
+def apply_import_actions(rows, previous_rows, delta_only=False):
+    """Fill the ImportAction column of Nephrocare `rows` against the last uploaded `previous_rows`.
+
+    Rows are matched on EmployeeID. New rows get import_action("add"), changed
+    rows "update", and employees missing from `rows` are appended as
+    "delete". Unchanged rows keep a blank action, or are dropped when
+    `delta_only`. Returns (rows, {"add": n, "update": n, "delete": n}).
+    """
+    previous_by_id = {row[2]: row[1:] for row in previous_rows}
+    changes = {"add": 0, "update": 0, "delete": 0}
+    result = []
+    current_ids = set()
+    for row in rows:
+        employee_id = row[2]
+        current_ids.add(employee_id)
+        previous = previous_by_id.get(employee_id)
+        if previous is None:
+            action, change = import_action("add"), "add"
+        elif previous != row[1:]:
+            action, change = import_action("update"), "update"
+        else:
+            if not delta_only:
+                result.append(row)
+            continue
+        changes[change] += 1
+        result.append([action] + row[1:])
+
+    for employee_id, previous in previous_by_id.items():
+        if employee_id not in current_ids:
+            changes["delete"] += 1
+            result.append([import_action("delete")] + previous)
+    return result, changes
+
+
+def is_dice_titled(record):
+    """Center and cluster managers by title, and DICE_EXTRA_EMPLOYEE_NUMBERS."""
+    return ((record.get("secondaryJobTitle") or "").lower() in {"center manager", "cluster manager"}
+            or (record.get("employeeNumber") or "").lower() in dice_extra_employee_numbers())
+
+
+def select_dice_employees(all_employees, graph=None):
+    """Center and cluster managers who receive the Dice file.
+
+    Cluster managers are whoever a center manager reports to in the live
+    hierarchy, plus anyone titled "Cluster Manager" and DICE_EXTRA_EMPLOYEE_NUMBERS.
+    """
+    graph = graph or OrgGraph(all_employees)
+    recipients = {id(record) for record in graph.managers_of_center_managers()}
+    return [record for record in all_employees if is_dice_titled(record) or id(record) in recipients]
+
+
+def build_dice_rows(employee_data, all_employees, graph=None):
+    """16-column Dice rows for the non-test employees in `employee_data`."""
+    graph = graph or OrgGraph(all_employees)
+    data_to_write_dice = []
+    for employee in employee_data:
+        employmentStatus = employee.get("employmentStatus")
+        if dice_includes(employee):
+            secondaryJobTitle = employee.get("secondaryJobTitle", "")
+            approver_employee_info = graph.manager(employee)
+
+            zone_info = next(
+                (field['value'] for field in employee["customFields"] if 'zone' in field['title'].lower()), None)
+
+            group_title = next(
+                (group['title'] for group in employee['groups'] if group['groupType'] == 3), None)
+
+            l2Manager_info = graph.l2_manager(employee)
+            gender, prefix = gender_and_prefix(employee)
+
+            data_to_write_dice.append([
+                employee.get('employeeNumber', ''),            # EmployeeID
+                employee.get('firstName', ''),                  # FirstName
+                employee.get('middleName', ''),                 # MiddleName
+                employee.get('lastName', ''),                   # LastName
+                gender,
+                True if employmentStatus == 0 else False,
+                employee.get('mobilePhone', ''),
+                zone_info,  # zone
+                group_title,  # Center/Location
+                employee.get('email', ''),
+                employee.get('jobTitle', {}).get('title', ''),   # Designation
+                secondaryJobTitle,
+                employee.get('reportsTo', {}).get('email', ''),
+                approver_employee_info.get(
+                    'employeeNumber', '') if approver_employee_info else '',  # ApproverEmail
+                l2Manager_info.get('email', '') if l2Manager_info else approver_employee_info.get(
+                    'email', '') if approver_employee_info else '',
+                # DefaultApprover1Name
+                l2Manager_info.get(
+                    'employeeNumber', '') if l2Manager_info else approver_employee_info.get('employeeNumber', '') if approver_employee_info else '',
+            ])
+    return data_to_write_dice
+
+
+_worker_state = None
+
+
+def _init_row_worker(builder, employee_data, index):
+    global _worker_state
+    _worker_state = (builder, employee_data, index)
+
+
+def _build_shard(bounds):
+    builder, employee_data, index = _worker_state
+    start, end = bounds
+    return builder(employee_data[start:end], None, index)
+
+
+def build_rows(builder, employee_data, all_employees, graph=None, workers=None, min_rows=None, cache=None):
+    """Run a row builder, sharded across a process pool when the list is large enough.
+
+    `employee_data` must already be in employeeNumber order; shards are
+    contiguous slices and are merged back in order, so the rows match a
+    single-process run. Workers get the employees and a ManagerIndex once, at
+    start-up: inherited for free under fork, or pickled once per worker (with
+    only ROW_FIELDS kept) under forkserver/spawn. Fork is only used while the
+    caller is the process's only thread, so the app and tenant runs never fork
+    beside other threads. Tasks carry only slice bounds.
+
+    With a row_cache.RowCache, rows whose inputs are unchanged since the
+    cache's last build are reused and only the rest go through the builder.
+    """
+    import multiprocessing
+    import threading
+    from concurrent.futures import ProcessPoolExecutor
+
+    if cache is not None:
+        graph = graph or OrgGraph(all_employees)
+        included = [employee for employee in employee_data if ROW_FILTERS[builder](employee)]
+        return cache.rows(included, graph,
+                          lambda missing: build_rows(builder, missing, all_employees, graph, workers, min_rows))
+
+    workers = row_workers() if workers is None else workers
+    min_rows = shard_min_rows() if min_rows is None else min_rows
+    if workers <= 1 or len(employee_data) < min_rows:
+        return builder(employee_data, all_employees, graph)
+
+    graph = graph or OrgGraph(all_employees)
+    index = ManagerIndex.from_graph(graph, employee_data)
+    start_methods = multiprocessing.get_all_start_methods()
+    if "fork" in start_methods and threading.active_count() == 1:
+        context = multiprocessing.get_context("fork")
+    else:
+        # A lock another thread holds at fork time stays held in the child, so threaded callers start clean
+        context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+        employee_data = [{key: emp[key] for key in ROW_FIELDS if key in emp} for emp in employee_data]
+
+    # A few shards per worker evens out uneven shards without paying much per-task overhead
+    shard_size = -(-len(employee_data) // (workers * 4))
+    bounds = [(start, start + shard_size) for start in range(0, len(employee_data), shard_size)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_row_worker,
+                             initargs=(builder, employee_data, index)) as pool:
+        for shard_rows in pool.map(_build_shard, bounds):
+            rows.extend(shard_rows)
+    return rows
+
+
+# Which employees each builder makes a row for; a builder's rows map one to one onto the employees it keeps
+ROW_FILTERS = {
+    build_nephrocare_rows: nephrocare_includes,
+    build_dice_rows: dice_includes,
+}
+
+
+# Directory pulls made for one export. Everyone else is kept only as a possible manager. Dice
+# recipients include whoever a center manager reports to, which is only known once every page
+# is in, so other Dice records keep the values a Dice row reads rather than just MANAGER_FIELDS.
+NEPHROCARE_PAGE_FILTER = page_filter(is_nephrocare_employee, manager_record)
+DICE_PAGE_FILTER = page_filter(is_dice_titled, dice_row_record)
+
+
+def fill_template(template_csv_path, data_to_write, columns_count):
+    """Load the CSV template and write `data_to_write` into it from the first row and column."""
+    import pandas as pd
+
+    df_template = pd.read_csv(template_csv_path)
+
+    rows_needed = len(data_to_write)
+    if len(df_template) < rows_needed:
+        # Ensure the DataFrame has exactly `columns_count` columns
+        if df_template.shape[1] < columns_count:
+            # Create a list of new column names to match the column count
+            required_columns = [f"Column_{i+1}" for i in range(columns_count)]
+            current_columns = list(df_template.columns)
+            new_columns = [
+                col for col in required_columns if col not in current_columns]
+
+            for col in new_columns[:columns_count - df_template.shape[1]]:
+                df_template[col] = ''
+        elif df_template.shape[1] > columns_count:
+            # Truncate extra columns
+            df_template = df_template.iloc[:, :columns_count]
+
+    # Build the filled block in one go rather than assigning cell by cell
+    df_rows = pd.DataFrame(data_to_write, columns=df_template.columns[:columns_count], dtype=object)
+    for col in df_template.columns[columns_count:]:
+        df_rows[col] = ''
+    return pd.concat([df_rows, df_template.iloc[rows_needed:]], ignore_index=True)
+
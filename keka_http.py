@@ -0,0 +1,413 @@
+"""Keka API GETs that wait for the shared rate limit and back off on 429.
+
+Every directory page and attendance request goes through `get` (requests) or
+`get_async` (httpx) with the API key its token was issued for. That replaces
+the per-module sleeps: the pacing comes from rate_limit, and a 429 pushes the
+whole host's bucket back by its Retry-After.
+
+Token requests go through `post` / `post_async`, so a whole run can be
+recorded to a gzipped cassette and replayed without network or quota:
+
+    KEKA_CASSETTE=runs/2025-09-22.json.gz KEKA_CASSETTE_MODE=record python cli.py attendance
+    KEKA_CASSETTE=runs/2025-09-22.json.gz KEKA_CASSETTE_MODE=replay python cli.py attendance
+
+(or `cli.py --record PATH` / `--replay PATH`). Cassettes are keyed by method
+and URL; token requests by a hash of their body, which is never stored.
+Replay skips the rate limit and raises CassetteMiss for anything not recorded,
+so attendance replays need the same --start/--end as the recording. Recorded
+token responses hold short-lived access tokens; keep cassettes with the run's
+other outputs.
+
+Slow pages and attendance calls can be hedged (off by default):
+
+    KEKA_HEDGE=1                  enable hedged GETs
+    KEKA_HEDGE_PERCENTILE=95      hedge a GET still running after this rolling latency percentile
+    KEKA_HEDGE_MAX_RATIO=0.05     at most this share of GETs get a hedge
+
+When a GET has run longer than the endpoint's rolling percentile (of its
+last HEDGE_WINDOW latencies), a duplicate is sent and the first response
+wins; the other is dropped. Hedges only take a rate limit slot that is free
+right away (rate_limit.try_reserve), so they never delay the paced requests
+or exceed the budget. Only the idempotent GETs are hedged. Each run report
+counts hedges and hedge wins per endpoint; `hedge_stats` has the process's.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import rate_limit
+import run_report
+import tenants
+
+DEFAULT_RETRY_AFTER_SECONDS = 5
+CASSETTE_HEADERS = ("Content-Type", "Retry-After")
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+# Hedges that may be sent back to back before the ratio cap applies
+HEDGE_BURST = 5
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class CassetteResponse:
+    """The slice of a requests/httpx response the Keka callers use."""
+
+    def __init__(self, status_code, headers, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Cassette:
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.interactions = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                self.interactions = json.load(f)["interactions"]
+        else:
+            atexit.register(self.save)
+
+    def replay(self, key):
+        recorded = self.interactions.get(key)
+        if recorded is None:
+            raise CassetteMiss(f"{key} is not in cassette {self.path}")
+        return CassetteResponse(recorded["status_code"], recorded["headers"], recorded["text"])
+
+    def record(self, key, response):
+        headers = {name: response.headers[name] for name in CASSETTE_HEADERS if name in response.headers}
+        with self._lock:
+            self.interactions[key] = {"status_code": response.status_code, "headers": headers, "text": response.text}
+
+    def save(self):
+        with self._lock:
+            interactions = dict(self.interactions)
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"recorded_at": datetime.now().isoformat(), "interactions": interactions}, f)
+        os.replace(tmp_path, self.path)
+        print(f"📼 Recorded {len(interactions)} Keka responses to {self.path}")
+
+
+_cassettes = {}
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def cassette():
+    """The run's cassette from KEKA_CASSETTE / KEKA_CASSETTE_MODE, or None when neither is set."""
+    path = tenants.getenv("KEKA_CASSETTE")
+    mode = tenants.getenv("KEKA_CASSETTE_MODE", "").lower()
+    if not path or mode not in ("record", "replay"):
+        return None
+    with _lock:
+        if (path, mode) not in _cassettes:
+            _cassettes[(path, mode)] = Cassette(path, mode)
+        return _cassettes[(path, mode)]
+
+
+def session():
+    """One keep-alive connection pool for every thread and tenant in the process."""
+    global _session, _session_pid
+    import requests
+    from http.cookiejar import DefaultCookiePolicy
+
+    with _lock:
+        # A forked worker must not reuse the parent's pooled sockets
+        if _session is None or _session_pid != os.getpid():
+            _session_pid = os.getpid()
+            pool_size = int(os.getenv("KEKA_HTTP_POOL_SIZE", "16"))
+            _session = requests.Session()
+            # Tenants share the pool, so no cookies may carry over between them
+            _session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _key(method, url, body=None):
+    if body is None:
+        return f"{method} {url}"
+    return f"{method} {url} {hashlib.sha256(body.encode()).hexdigest()[:16]}"
+
+
+def max_retries():
+    return int(tenants.getenv("KEKA_MAX_RETRIES", "5"))
+
+
+def retry_after_seconds(response):
+    try:
+        return max(float(response.headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+
+def hedging_enabled():
+    return tenants.getenv("KEKA_HEDGE", "0") == "1"
+
+
+def hedge_percentile():
+    return float(tenants.getenv("KEKA_HEDGE_PERCENTILE", "95"))
+
+
+def hedge_max_ratio():
+    return float(tenants.getenv("KEKA_HEDGE_MAX_RATIO", "0.05"))
+
+
+class Hedger:
+    """Rolling GET latencies per endpoint and the hedge budget.
+
+    Every GET made with hedging on adds KEKA_HEDGE_MAX_RATIO of a hedge credit (up
+    to HEDGE_BURST) and each hedge spends one, so hedges stay under that share
+    of requests however slow the API gets.
+    """
+
+    def __init__(self):
+        self._latencies = {}
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def _key(self, url):
+        return urlsplit(url).netloc, run_report.endpoint_of("GET", url)
+
+    def observe(self, url, seconds):
+        with self._lock:
+            key = self._key(url)
+            if key not in self._latencies:
+                self._latencies[key] = deque(maxlen=HEDGE_WINDOW)
+            self._latencies[key].append(seconds)
+
+    def delay(self, url):
+        """Seconds to wait before hedging a GET to `url`, or None while there are too few samples."""
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self._credit + hedge_max_ratio(), HEDGE_BURST)
+            latencies = sorted(self._latencies.get(self._key(url), ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(hedge_percentile() / 100 * len(latencies)))]
+
+    def allow(self, api_key):
+        """Spend a hedge credit and a free rate limit slot, if both are available."""
+        with self._lock:
+            if self._credit < 1:
+                self.denied += 1
+                return False
+            self._credit -= 1
+        if not rate_limit.try_reserve(api_key):
+            with self._lock:
+                self._credit += 1
+                self.denied += 1
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "denied": self.denied,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            }
+
+
+_hedger = Hedger()
+_hedge_pool = None
+_hedge_pool_pid = None
+
+
+def hedge_stats():
+    """Process-wide hedging counters: GETs, hedges sent, hedges that answered first, hedges over budget."""
+    return _hedger.stats()
+
+
+def _pool():
+    global _hedge_pool, _hedge_pool_pid
+    with _lock:
+        if _hedge_pool is None or _hedge_pool_pid != os.getpid():
+            _hedge_pool_pid = os.getpid()
+            _hedge_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv("KEKA_HTTP_POOL_SIZE", "16")) * 2, thread_name_prefix="keka-hedge")
+        return _hedge_pool
+
+
+def _timed_get(url, headers):
+    started = time.perf_counter()
+    response = session().get(url, headers=headers)
+    seconds = time.perf_counter() - started
+    run_report.add_request("GET", url, response.status_code, seconds)
+    _hedger.observe(url, seconds)
+    return response
+
+
+async def _timed_get_async(client, url, headers):
+    started = time.perf_counter()
+    try:
+        response = await client.get(url, headers=headers)
+    except asyncio.CancelledError:
+        # The losing primary of a hedge: it took at least this long
+        _hedger.observe(url, time.perf_counter() - started)
+        raise
+    seconds = time.perf_counter() - started
+    run_report.add_request("GET", url, response.status_code, seconds)
+    _hedger.observe(url, seconds)
+    return response
+
+
+def _first_response(url, primary, hedge):
+    """The first of two finished futures that did not raise; re-raises the primary's error if both did."""
+    for future in concurrent.futures.as_completed([primary, hedge]):
+        if future.exception() is None:
+            if future is hedge:
+                _hedger.won()
+                run_report.add_hedge("GET", url, won=True)
+            return future.result()
+    return primary.result()
+
+
+def _hedged_get(url, headers, api_key):
+    delay = _hedger.delay(url) if hedging_enabled() else None
+    if delay is None:
+        return _timed_get(url, headers)
+    primary = _pool().submit(contextvars.copy_context().run, _timed_get, url, headers)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    if not _hedger.allow(api_key):
+        return primary.result()
+    run_report.add_hedge("GET", url)
+    hedge = _pool().submit(contextvars.copy_context().run, _timed_get, url, headers)
+    # requests cannot cancel the slower one; it finishes in the pool and is dropped
+    return _first_response(url, primary, hedge)
+
+
+async def _hedged_get_async(client, url, headers, api_key):
+    delay = _hedger.delay(url) if hedging_enabled() else None
+    if delay is None:
+        return await _timed_get_async(client, url, headers)
+    primary = asyncio.ensure_future(_timed_get_async(client, url, headers))
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    # allow() may take a rate limit slot, a SQLite transaction; keep it off the event loop
+    if done or not await asyncio.to_thread(_hedger.allow, api_key):
+        return await primary
+    run_report.add_hedge("GET", url)
+    hedge = asyncio.ensure_future(_timed_get_async(client, url, headers))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _hedger.won()
+                        run_report.add_hedge("GET", url, won=True)
+                    return task.result()
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _rate_limited(response, url, api_key, attempt):
+    if response.status_code != 429 or attempt >= max_retries():
+        return False
+    seconds = retry_after_seconds(response)
+    print(f"⏳ Keka rate limit hit, backing off {seconds:.1f}s")
+    rate_limit.penalize(api_key, seconds)
+    run_report.add_retry("GET", url)
+    return True
+
+
+def get(url, headers, api_key):
+    tape = cassette()
+    if tape and tape.mode == "replay":
+        return tape.replay(_key("GET", url))
+    attempt = 0
+    while True:
+        run_report.add_rate_limit_wait("GET", url, rate_limit.wait(api_key))
+        response = _hedged_get(url, headers, api_key)
+        if not _rate_limited(response, url, api_key, attempt):
+            break
+        attempt += 1
+    if tape:
+        tape.record(_key("GET", url), response)
+    return response
+
+
+async def get_async(client, url, headers, api_key):
+    tape = cassette()
+    if tape and tape.mode == "replay":
+        return tape.replay(_key("GET", url))
+    attempt = 0
+    while True:
+        run_report.add_rate_limit_wait("GET", url, await rate_limit.wait_async(api_key))
+        response = await _hedged_get_async(client, url, headers, api_key)
+        if not _rate_limited(response, url, api_key, attempt):
+            break
+        attempt += 1
+    if tape:
+        tape.record(_key("GET", url), response)
+    return response
+
+
+def post(url, headers, data):
+    """Token request; only recorded/replayed, token calls are not counted against the rate limit."""
+    tape = cassette()
+    if tape and tape.mode == "replay":
+        return tape.replay(_key("POST", url, data))
+    started = time.perf_counter()
+    response = session().post(url, headers=headers, data=data)
+    run_report.add_request("POST", url, response.status_code, time.perf_counter() - started)
+    if tape:
+        tape.record(_key("POST", url, data), response)
+    return response
+
+
+async def post_async(client, url, headers, data):
+    tape = cassette()
+    if tape and tape.mode == "replay":
+        return tape.replay(_key("POST", url, data))
+    started = time.perf_counter()
+    response = await client.post(url, headers=headers, data=data)
+    run_report.add_request("POST", url, response.status_code, time.perf_counter() - started)
+    if tape:
+        tape.record(_key("POST", url, data), response)
+    return response
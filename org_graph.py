@@ -0,0 +1,120 @@
+"""Reporting-graph index over the Keka employee directory.
+
+Built once per directory pull from each employee's `reportsTo` / `l2Manager`
+links, so the export row builders and the Dice recipient selection get O(1)
+manager lookups instead of scanning `all_employees` per employee.
+
+Employees are keyed by email, the same key the Keka `reportsTo` and
+`l2Manager` references carry. When two records share an email, the one
+with the lowest employeeNumber wins (the first, on a tie). That is the one
+the old `next(...)` scans found over the NPID-sorted directory, so the graph
+gives the same answers over an unsorted one.
+"""
+from collections import deque
+
+CENTER_MANAGER_TITLE = "center manager"
+CLUSTER_MANAGER_TITLE = "cluster manager"
+
+
+def _ref_email(employee, field):
+    return (employee.get(field) or {}).get('email', '')
+
+
+def takes_precedence(employee, current):
+    """Whether `employee` replaces `current` as the record for their shared email."""
+    return (employee.get('employeeNumber') or '') < (current.get('employeeNumber') or '')
+
+
+class OrgGraph:
+    def __init__(self, all_employees):
+        self.employees = all_employees
+        self.by_email = {}
+        self.children = {}
+        for employee in all_employees:
+            email = employee.get('email')
+            current = self.by_email.get(email)
+            if current is None or takes_precedence(employee, current):
+                self.by_email[email] = employee
+        for employee in all_employees:
+            manager_email = _ref_email(employee, 'reportsTo')
+            # The CEO reports to themselves in Keka; keep that out of the tree
+            if manager_email and manager_email != employee.get('email'):
+                self.children.setdefault(manager_email, []).append(employee)
+
+    def get(self, email):
+        return self.by_email.get(email)
+
+    def manager(self, employee):
+        """The employee's `reportsTo` record, or None when it is not in the directory."""
+        return self.by_email.get(_ref_email(employee, 'reportsTo'))
+
+    def l2_manager(self, employee):
+        return self.by_email.get(_ref_email(employee, 'l2Manager'))
+
+    def direct_reports(self, email):
+        return self.children.get(email, [])
+
+    def all_reports(self, email):
+        """Direct and transitive reports of `email`, breadth first."""
+        reports = []
+        seen = {email}
+        queue = deque([email])
+        while queue:
+            for employee in self.children.get(queue.popleft(), []):
+                report_email = employee.get('email')
+                if report_email in seen:
+                    continue
+                seen.add(report_email)
+                reports.append(employee)
+                queue.append(report_email)
+        return reports
+
+    def with_secondary_title(self, *titles):
+        titles = {title.lower() for title in titles}
+        return [
+            employee for employee in self.employees
+            if (employee.get("secondaryJobTitle") or "").lower() in titles
+        ]
+
+    def center_managers(self):
+        return self.with_secondary_title(CENTER_MANAGER_TITLE)
+
+    def managers_of_center_managers(self):
+        """Everyone a center manager reports to, i.e. the cluster managers."""
+        managers = {}
+        for employee in self.center_managers():
+            manager = self.manager(employee)
+            if manager is not None:
+                managers.setdefault(id(manager), manager)
+        return list(managers.values())
+
+
+MANAGER_FIELDS = ("email", "employeeNumber", "displayName")
+
+
+class ManagerIndex:
+    """Compact, picklable slice of an OrgGraph for shipping to row-building worker processes.
+
+    Holds only the managers and L2 managers referenced by the given employees,
+    and only the fields the row builders read from them.
+    """
+
+    def __init__(self, by_email):
+        self.by_email = by_email
+
+    @classmethod
+    def from_graph(cls, graph, employees):
+        by_email = {}
+        for employee in employees:
+            for field in ('reportsTo', 'l2Manager'):
+                email = _ref_email(employee, field)
+                manager = graph.get(email)
+                if manager is not None and email not in by_email:
+                    by_email[email] = {key: manager[key] for key in MANAGER_FIELDS if key in manager}
+        return cls(by_email)
+
+    def manager(self, employee):
+        return self.by_email.get(_ref_email(employee, 'reportsTo'))
+
+    def l2_manager(self, employee):
+        return self.by_email.get(_ref_email(employee, 'l2Manager'))
@@ -0,0 +1,101 @@
+"""Opt-in per-stage profiling for the export pipelines.
+
+Set KEKA_PROFILE=1 (or pass `--profile` to cli.py) and every stage wrapped in
+`Profiler.stage()` runs under cProfile and tracemalloc. Each stage writes two
+files next to the pipeline's output:
+
+    <pipeline>_<run>_<stage>.prof       cProfile stats (pstats, snakeviz, ...)
+    <pipeline>_<run>_<stage>.mem.txt    wall time, peak traced allocation and the
+                                        largest allocation sites live at stage end
+
+cProfile and tracemalloc are process-wide, so when two stages overlap (e.g.
+concurrent syncs in the web app) only the first one is profiled. The other
+only has its wall time logged.
+"""
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import run_report
+import tenants
+
+_profiling_lock = threading.Lock()
+
+
+def profiling_enabled():
+    return tenants.getenv("KEKA_PROFILE", "").lower() in ("1", "true", "yes", "on")
+
+
+def top_allocations():
+    return int(tenants.getenv("KEKA_PROFILE_TOP", "25"))
+
+
+class Profiler:
+    def __init__(self, pipeline, folder, enabled=None):
+        self.pipeline = pipeline
+        self.folder = folder or "."
+        self.enabled = profiling_enabled() if enabled is None else enabled
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    def _path(self, stage_name, suffix):
+        return os.path.join(self.folder, f"{self.pipeline}_{self.run_id}_{stage_name}{suffix}")
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Profile the enclosed block when enabled; its wall time always goes to the run report."""
+        started = time.perf_counter()
+        try:
+            with self._profiled(stage_name):
+                yield
+        finally:
+            run_report.add_stage(stage_name, time.perf_counter() - started)
+
+    @contextmanager
+    def _profiled(self, stage_name):
+        if not self.enabled:
+            yield
+            return
+        if not _profiling_lock.acquire(blocking=False):
+            started = time.perf_counter()
+            yield
+            print(f"🔬 {self.pipeline}.{stage_name}: {time.perf_counter() - started:.3f}s "
+                  f"(not profiled, another stage holds the profiler)")
+            return
+
+        profile = cProfile.Profile()
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                elapsed = time.perf_counter() - started
+                current, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self._write(stage_name, profile, elapsed, current, peak, snapshot)
+        finally:
+            _profiling_lock.release()
+
+    def _write(self, stage_name, profile, elapsed, current, peak, snapshot):
+        os.makedirs(self.folder, exist_ok=True)
+        prof_path = self._path(stage_name, ".prof")
+        profile.dump_stats(prof_path)
+
+        mem_path = self._path(stage_name, ".mem.txt")
+        with open(mem_path, "w") as f:
+            f.write(f"pipeline: {self.pipeline}\nstage: {stage_name}\n")
+            f.write(f"wall_seconds: {elapsed:.4f}\n")
+            f.write(f"peak_traced_mb: {peak / 2 ** 20:.2f}\n")
+            f.write(f"live_at_end_mb: {current / 2 ** 20:.2f}\n\n")
+            top = top_allocations()
+            f.write(f"Top {top} allocation sites live at stage end:\n")
+            for stat in snapshot.statistics("lineno")[:top]:
+                f.write(f"{stat}\n")
+        print(f"🔬 {self.pipeline}.{stage_name}: {elapsed:.3f}s, peak {peak / 2 ** 20:.1f} MB -> {prof_path}")
@@ -0,0 +1,135 @@
+"""Host-wide rate limit for Keka API calls, shared by every process through SQLite.
+
+The app, the attendance cron and ad-hoc bridge runs all draw from the same
+bucket per API key, so running them together divides the quota instead of
+tripping 429s. Each bucket is a GCRA token bucket: one "theoretical arrival
+time" row per key. Callers reserve the next free slot and sleep until it, so
+concurrent processes are served in reservation order.
+
+    KEKA_RATE_LIMIT=0.67          requests per second per API key (0 disables limiting)
+    KEKA_RATE_BURST=1             requests allowed back to back before pacing starts
+    KEKA_RATE_LIMITS=<key>=2:5,<other key>=0.5
+                                  per-key overrides as rate[:burst]
+    KEKA_RATE_LIMIT_DB=/tmp/keka_rate_limit.sqlite3
+
+Settings are read at call time so modules that load .env after importing this
+one still pick them up. Only a hash of each API key is stored.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import tenants
+
+_local = threading.local()
+
+
+def db_path():
+    return tenants.getenv("KEKA_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "keka_rate_limit.sqlite3"))
+
+
+def budget_for(api_key):
+    """(requests per second, burst) for `api_key`."""
+    rate = float(tenants.getenv("KEKA_RATE_LIMIT", "0.67"))
+    burst = int(tenants.getenv("KEKA_RATE_BURST", "1"))
+    for entry in tenants.getenv("KEKA_RATE_LIMITS", "").split(","):
+        key, _, budget = entry.strip().rpartition("=")
+        if key and key == api_key:
+            rate_text, _, burst_text = budget.partition(":")
+            rate = float(rate_text)
+            burst = int(burst_text or burst)
+    return rate, max(burst, 1)
+
+
+def bucket_name(api_key):
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+def _connection():
+    path = db_path()
+    conn = getattr(_local, "conn", None)
+    # SQLite connections must not cross a fork, so a forked worker opens its own
+    if conn is None or _local.path != path or _local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        _local.conn, _local.path, _local.pid = conn, path, os.getpid()
+    return conn
+
+
+def _update_tat(api_key, update):
+    """Run `update(tat, now) -> (new_tat, result)` on the key's bucket inside one write transaction."""
+    conn = _connection()
+    name = bucket_name(api_key)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT tat FROM buckets WHERE name = ?", (name,)).fetchone()
+        now = time.time()
+        new_tat, result = update(row[0] if row else now, now)
+        conn.execute("INSERT OR REPLACE INTO buckets (name, tat) VALUES (?, ?)", (name, new_tat))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return result
+
+
+def reserve(api_key):
+    """Claim the next request slot for `api_key`; returns how many seconds to wait before using it."""
+    rate, burst = budget_for(api_key)
+    if rate <= 0:
+        return 0.0
+    interval = 1 / rate
+
+    def take_slot(tat, now):
+        tat = max(tat, now)
+        allowed_at = tat - (burst - 1) * interval
+        return tat + interval, max(0.0, allowed_at - now)
+
+    return _update_tat(api_key, take_slot)
+
+
+def try_reserve(api_key):
+    """Claim `api_key`'s next slot only if it is free now; True when claimed.
+
+    For optional requests (hedges) that must not wait for, or push back, the
+    requests the budget is paced for.
+    """
+    rate, burst = budget_for(api_key)
+    if rate <= 0:
+        return True
+    interval = 1 / rate
+
+    def take_free_slot(tat, now):
+        tat = max(tat, now)
+        if tat - (burst - 1) * interval > now:
+            return tat, False
+        return tat + interval, True
+
+    return _update_tat(api_key, take_free_slot)
+
+
+def penalize(api_key, seconds):
+    """Hold every process's requests for `api_key` back for `seconds`, e.g. after a 429 Retry-After."""
+    _update_tat(api_key, lambda tat, now: (max(tat, now + seconds), None))
+
+
+def wait(api_key):
+    """Sleep until `api_key`'s next slot; returns the seconds waited."""
+    delay = reserve(api_key)
+    if delay:
+        time.sleep(delay)
+    return delay
+
+
+async def wait_async(api_key):
+    # The reservation is a SQLite write transaction that can wait up to 30s on
+    # other processes' locks; keep it off the event loop
+    delay = await asyncio.to_thread(reserve, api_key)
+    if delay:
+        await asyncio.sleep(delay)
+    return delay
@@ -0,0 +1,91 @@
+"""Export rows reused across builds over the same in-memory records.
+
+A Nephrocare or Dice row reads exactly three records: the employee, their
+approver (`reportsTo`) and their L2 manager. The cache keeps, per export
+and per Keka employee id, those three records and the row built from them.
+Directory records are never modified in place: a webhook change brings a
+new dict. So if all three inputs are the same objects as in the last build,
+the row is still right. This only pays off inside one app process, between
+warm /keka_sync runs over the in-memory directory: after webhook changes,
+only the changed employees and the reports of a changed manager are
+rebuilt.
+
+A full directory pull (the app's refresh, every CLI or cron run) brings
+new dicts for everyone, so the first build after it reuses nothing. The
+cache is not persisted, and rows are not matched by content. At 20k
+employees, comparing a row's three input dicts with `==` costs ~11 us, and
+hashing their fields ~13-20 us. Building the row costs ~6-8 us. A content
+check would make every build slower than rebuilding everything.
+
+Each build evicts the employees it no longer has a row for (they left or
+were filtered out). It prints the hit rate and records it in the run report
+as `<export>_row_cache` (in: rows, out: rows reused).
+"""
+import threading
+
+import run_report
+import snapshot
+import tenants
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _key(employee):
+    return employee.get("id") or employee.get("employeeNumber")
+
+
+class RowCache:
+    def __init__(self, name):
+        self.name = name
+        # key -> (employee, approver, l2 manager, row)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.last_stats = None
+
+    def rows(self, employees, graph, build):
+        """One row per employee, in order; `build(missing)` must return one row per missing employee."""
+        with self._lock:
+            rows = []
+            missing = []
+            entries = {}
+            for employee in employees:
+                key = _key(employee)
+                approver = graph.manager(employee)
+                l2_manager = graph.l2_manager(employee)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is employee and entry[1] is approver and entry[2] is l2_manager:
+                    rows.append(entry[3])
+                    entries[key] = entry
+                else:
+                    missing.append((len(rows), key, employee, approver, l2_manager))
+                    rows.append(None)
+
+            built = build([employee for _, _, employee, _, _ in missing]) if missing else []
+            if len(built) != len(missing):
+                raise ValueError(f"{self.name} builder made {len(built)} rows for {len(missing)} employees")
+            for (position, key, employee, approver, l2_manager), row in zip(missing, built):
+                rows[position] = row
+                entries[key] = (employee, approver, l2_manager, row)
+
+            evicted = len(self._entries.keys() - entries.keys())
+            self._entries = entries
+        reused = len(rows) - len(missing)
+        self.last_stats = {"rows": len(rows), "reused": reused, "rebuilt": len(missing), "evicted": evicted}
+        hit_rate = reused / len(rows) if rows else 0.0
+        print(f"🗃️ {self.name} row cache: {reused}/{len(rows)} rows reused ({hit_rate:.1%}), "
+              f"{len(missing)} rebuilt, {evicted} evicted")
+        run_report.add_records(f"{self.name}_row_cache", len(rows), reused)
+        return rows
+
+
+def get(name):
+    """The process's row cache for export `name` (per tenant output folder), or None when EXPORT_ROW_CACHE=0."""
+    # Read at call time: app.py loads .env after importing this module
+    if tenants.getenv("EXPORT_ROW_CACHE", "1") == "0":
+        return None
+    key = (name, snapshot.snapshot_dir())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = RowCache(name)
+        return _caches[key]
@@ -0,0 +1,341 @@
+"""Machine-readable report for each batch run, and a command to compare them.
+
+attendance.main, the bridge's main and cli commands, and the app's
+/keka_sync each run inside `RunReport(...).activate()`. That writes
+`<pipeline>_<run>_report.json` next to the run's output (keeping the newest
+RUN_REPORT_KEEP, default 200, per pipeline) with:
+
+    stages      wall seconds per Profiler stage (profiling need not be enabled)
+    requests    Keka calls per endpoint: count, status codes, p50/p95/max latency,
+                429 retries, time spent waiting for the shared rate limit, and
+                hedged GETs sent / answered first (see keka_http)
+    records     records in and out of each filter / build step
+    bytes       bytes written to disk and uploaded
+    peak_rss_mb peak resident memory of the process (and of pool workers)
+
+The active report lives in a context variable, so keka_http, Profiler and the
+pipelines add to whichever run they are part of, including tenant threads
+and asyncio tasks. Outside a run the helpers do nothing.
+
+    python run_report.py compare output/attendance_*_report.json [--threshold 1.25]
+
+prints the reports oldest first and flags metrics in the newest that exceed
+`threshold` times the median of the earlier ones. It exits 1 when it flags
+anything, so a scheduled job can fail on a regression.
+"""
+import argparse
+import contextvars
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_current = contextvars.ContextVar("run_report", default=None)
+
+
+def _peak_rss_mb(who):
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 2 ** 20, 1)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def endpoint_of(method, url):
+    """'GET /hris/employees' for a Keka URL: the path after the API version, without the query."""
+    path = urlsplit(url).path
+    _, marker, rest = path.partition("/api/v1")
+    return f"{method} {rest if marker else path}"
+
+
+class RunReport:
+    def __init__(self, pipeline, folder, run_id=None):
+        self.pipeline = pipeline
+        self.folder = folder or "."
+        self.run_id = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.status = "running"
+        self.error = None
+        self.stages = {}
+        self.requests = {}
+        self.records = {}
+        self.bytes = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+            stage["seconds"] += seconds
+            stage["count"] += 1
+
+    def _endpoint(self, method, url):
+        return self.requests.setdefault(endpoint_of(method, url), {
+            "count": 0, "status": {}, "latencies": [], "retries": 0, "rate_limit_wait_seconds": 0.0,
+            "hedges": 0, "hedge_wins": 0,
+        })
+
+    def add_request(self, method, url, status_code, seconds):
+        with self._lock:
+            endpoint = self._endpoint(method, url)
+            endpoint["count"] += 1
+            status = str(status_code)
+            endpoint["status"][status] = endpoint["status"].get(status, 0) + 1
+            endpoint["latencies"].append(seconds)
+
+    def add_retry(self, method, url):
+        with self._lock:
+            self._endpoint(method, url)["retries"] += 1
+
+    def add_hedge(self, method, url, won=False):
+        """A hedged duplicate was sent, or (won) it answered before the original."""
+        with self._lock:
+            self._endpoint(method, url)["hedge_wins" if won else "hedges"] += 1
+
+    def add_rate_limit_wait(self, method, url, seconds):
+        with self._lock:
+            self._endpoint(method, url)["rate_limit_wait_seconds"] += seconds
+
+    def add_records(self, name, records_in, records_out=None):
+        with self._lock:
+            self.records[name] = {"in": records_in, "out": records_in if records_out is None else records_out}
+
+    def add_bytes(self, kind, count):
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + count
+
+    def to_dict(self):
+        with self._lock:
+            requests = {}
+            for name, endpoint in sorted(self.requests.items()):
+                latencies = endpoint["latencies"]
+                requests[name] = {
+                    "count": endpoint["count"],
+                    "status": endpoint["status"],
+                    "retries": endpoint["retries"],
+                    "rate_limit_wait_seconds": round(endpoint["rate_limit_wait_seconds"], 3),
+                    "hedges": endpoint["hedges"],
+                    "hedge_wins": endpoint["hedge_wins"],
+                    "latency_ms": {
+                        "p50": round(_percentile(latencies, 0.50) * 1000, 1),
+                        "p95": round(_percentile(latencies, 0.95) * 1000, 1),
+                        "max": round(max(latencies) * 1000, 1),
+                        "total": round(sum(latencies) * 1000, 1),
+                    } if latencies else None,
+                }
+            return {
+                "pipeline": self.pipeline,
+                "run_id": self.run_id,
+                "started_at": self.started_at,
+                "status": self.status,
+                "error": self.error,
+                "duration_seconds": round(time.perf_counter() - self._started, 3),
+                "stages": {name: {"seconds": round(stage["seconds"], 4), "count": stage["count"]}
+                           for name, stage in self.stages.items()},
+                "requests": requests,
+                "records": dict(self.records),
+                "bytes": dict(self.bytes),
+                "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+                "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            }
+
+    def path(self):
+        return os.path.join(self.folder, f"{self.pipeline}_{self.run_id}_report.json")
+
+    def write(self):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path()
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"🧾 Run report saved at {path}")
+        prune_reports(self.folder, self.pipeline)
+        return path
+
+    @contextmanager
+    def activate(self):
+        """Collect metrics for the enclosed run, then write the report, even if the run fails."""
+        token = _current.set(self)
+        try:
+            yield self
+            self.status = "failed" if self.error else "ok"
+        except BaseException as e:
+            self.status = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            try:
+                self.write()
+            except OSError as e:
+                print(f"❌ Failed to write the run report: {e}")
+
+    def finish(self, exit_code):
+        """Mark the run failed when its entry point returns a non-zero exit code."""
+        if exit_code:
+            self.error = f"exit code {exit_code}"
+        return exit_code
+
+
+def keep_reports():
+    """How many reports of each pipeline to keep (RUN_REPORT_KEEP, 0 keeps all)."""
+    return int(os.getenv("RUN_REPORT_KEEP", "200"))
+
+
+def prune_reports(folder, pipeline, keep=None):
+    """Delete all but the newest `keep` `pipeline` reports in `folder`; returns how many were removed."""
+    keep = keep_reports() if keep is None else keep
+    if keep <= 0:
+        return 0
+    # Only this pipeline's timestamped reports, not e.g. attendance_queue_* for attendance
+    pattern = re.compile(rf"{re.escape(pipeline)}_\d{{8}}_\d{{6}}_report\.json")
+    names = sorted(name for name in os.listdir(folder) if pattern.fullmatch(name))
+    removed = 0
+    for name in names[:-keep]:
+        try:
+            os.remove(os.path.join(folder, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def current():
+    return _current.get()
+
+
+def add_stage(name, seconds):
+    report = _current.get()
+    if report is not None:
+        report.add_stage(name, seconds)
+
+
+def add_request(method, url, status_code, seconds):
+    report = _current.get()
+    if report is not None:
+        report.add_request(method, url, status_code, seconds)
+
+
+def add_retry(method, url):
+    report = _current.get()
+    if report is not None:
+        report.add_retry(method, url)
+
+
+def add_hedge(method, url, won=False):
+    report = _current.get()
+    if report is not None:
+        report.add_hedge(method, url, won)
+
+
+def add_rate_limit_wait(method, url, seconds):
+    report = _current.get()
+    if report is not None and seconds:
+        report.add_rate_limit_wait(method, url, seconds)
+
+
+def add_records(name, records_in, records_out=None):
+    report = _current.get()
+    if report is not None:
+        report.add_records(name, records_in, records_out)
+
+
+def add_file_bytes(kind, path):
+    report = _current.get()
+    if report is not None:
+        report.add_bytes(kind, os.path.getsize(path))
+
+
+# ---- compare ----
+
+def report_metrics(report):
+    """Flat {metric: value} view of a report for comparison; larger is worse for all of them."""
+    metrics = {"duration_seconds": report["duration_seconds"]}
+    for name, stage in report["stages"].items():
+        metrics[f"stage.{name}"] = stage["seconds"]
+    for name, endpoint in report["requests"].items():
+        metrics[f"requests.{name}"] = endpoint["count"]
+        metrics[f"retries.{name}"] = endpoint["retries"]
+        if endpoint["latency_ms"]:
+            metrics[f"p95_ms.{name}"] = endpoint["latency_ms"]["p95"]
+    if report.get("peak_rss_mb") is not None:
+        metrics["peak_rss_mb"] = report["peak_rss_mb"]
+    largest_input = max((records["in"] for records in report["records"].values()), default=0)
+    if largest_input:
+        metrics["seconds_per_1k_records"] = round(report["duration_seconds"] * 1000 / largest_input, 4)
+    return metrics
+
+
+def compare(paths, threshold=1.25, min_seconds=0.05):
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    reports.sort(key=lambda report: (report["started_at"], report["run_id"]))
+    if not reports:
+        print("No reports to compare")
+        return 0
+
+    series = [report_metrics(report) for report in reports]
+    print(f"{'run':17s} {'status':7s} {'seconds':>9s} {'records in':>10s} {'requests':>9s} {'retries':>8s} {'rss MB':>8s}")
+    for report, metrics in zip(reports, series):
+        largest_input = max((records["in"] for records in report["records"].values()), default=0)
+        requests = sum(endpoint["count"] for endpoint in report["requests"].values())
+        retries = sum(endpoint["retries"] for endpoint in report["requests"].values())
+        print(f"{report['run_id']:17s} {report['status']:7s} {report['duration_seconds']:9.2f} {largest_input:10d} "
+              f"{requests:9d} {retries:8d} {metrics.get('peak_rss_mb') or 0:8.1f}")
+
+    if len(reports) < 2:
+        return 0
+    latest, earlier = series[-1], series[:-1]
+    flagged = []
+    for metric, value in sorted(latest.items()):
+        history = [metrics[metric] for metrics in earlier if metric in metrics]
+        if not history:
+            continue
+        baseline = statistics.median(history)
+        # Ignore sub-threshold noise on tiny stages
+        if metric.startswith(("stage.", "duration")) and value < min_seconds:
+            continue
+        if value > baseline * threshold and value > baseline:
+            flagged.append((metric, baseline, value))
+
+    print()
+    if not flagged:
+        print(f"✅ {reports[-1]['run_id']}: no metric above {threshold}x the median of {len(earlier)} earlier runs")
+        return 0
+    print(f"⚠️ {reports[-1]['run_id']}: {len(flagged)} metrics above {threshold}x the median of {len(earlier)} earlier runs")
+    for metric, baseline, value in flagged:
+        ratio = value / baseline if baseline else float("inf")
+        print(f"  {metric:50s} {baseline:>10.3f} -> {value:<10.3f} x{ratio:.2f}")
+    return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare run reports written by the Keka sync pipelines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions in the newest report")
+    compare_parser.add_argument("reports", nargs="+", help="Report JSON files, in any order")
+    compare_parser.add_argument("--threshold", type=float, default=1.25,
+                                help="Flag metrics above this multiple of the earlier runs' median")
+    args = parser.parse_args(argv)
+    return compare(args.reports, args.threshold)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
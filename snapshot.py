@@ -0,0 +1,95 @@
+import glob
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+
+import tenants
+
+
+def snapshot_dir():
+    """Folder for directory and export-row snapshots, newest last by name.
+
+    Read at call time so app.py and the bridge, which load .env after their
+    imports, still pick up SNAPSHOT_DIR / TARGET_FILE_PATH.
+    """
+    return tenants.getenv("SNAPSHOT_DIR", os.path.join(tenants.getenv("TARGET_FILE_PATH", "output"), "snapshots"))
+
+
+def _write_snapshot(folder, prefix, payload):
+    folder = folder or snapshot_dir()
+    os.makedirs(folder, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(folder, f"{prefix}_{timestamp}.json.gz")
+    # Unique per writer: syncs finishing in the same second would otherwise share one temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f)
+    # Readers only ever see complete snapshots
+    os.replace(tmp_path, path)
+    prune_snapshots(folder, prefix)
+    return path
+
+
+def keep_snapshots():
+    """How many snapshots of each kind to keep (SNAPSHOT_KEEP, 0 keeps all)."""
+    return int(tenants.getenv("SNAPSHOT_KEEP", "24"))
+
+
+def prune_snapshots(folder=None, prefix="directory", keep=None):
+    """Delete all but the newest `keep` `prefix` snapshots; returns how many were removed."""
+    keep = keep_snapshots() if keep is None else keep
+    if keep <= 0:
+        return 0
+    paths = sorted(glob.glob(os.path.join(folder or snapshot_dir(), f"{prefix}_*.json.gz")))
+    removed = 0
+    for path in paths[:-keep]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def save_snapshot(employees, folder=None, fetched_at=None):
+    """Write the employee directory to a gzipped JSON snapshot; returns its path.
+
+    `fetched_at` (a time.time()) is when the directory was last pulled in full,
+    for snapshots that carry later webhook changes. It becomes the file's mtime,
+    which is what the app reads back as the snapshot's age.
+    """
+    fetched = datetime.fromtimestamp(fetched_at) if fetched_at else datetime.now()
+    path = _write_snapshot(folder, "directory", {"fetched_at": fetched.isoformat(), "employees": employees})
+    if fetched_at:
+        os.utime(path, (fetched_at, fetched_at))
+    return path
+
+
+def latest_snapshot_path(folder=None, prefix="directory"):
+    paths = sorted(glob.glob(os.path.join(folder or snapshot_dir(), f"{prefix}_*.json.gz")))
+    return paths[-1] if paths else None
+
+
+def load_snapshot(path=None, folder=None):
+    """Return the employees in `path`, or in the newest snapshot in `folder`; None if there is none."""
+    path = path or latest_snapshot_path(folder)
+    if not path:
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)["employees"]
+
+
+def save_export_rows(export_name, rows, folder=None):
+    """Record the rows of an export that was just uploaded, for the next run to diff against."""
+    return _write_snapshot(folder, f"{export_name}_rows", {"uploaded_at": datetime.now().isoformat(), "rows": rows})
+
+
+def load_export_rows(export_name, folder=None):
+    """Rows of the last uploaded `export_name` file, or None before the first upload."""
+    path = latest_snapshot_path(folder, f"{export_name}_rows")
+    if not path:
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)["rows"]
@@ -0,0 +1,146 @@
+"""Minimal local stand-in for the Google Drive v3 upload API.
+
+Serves just what drive_uploader uses: files.list with a name/parent query,
+multipart uploads and resumable (chunked) uploads. Run it and point the
+uploader at it:
+
+    python -m standins.fake_drive --port 8765
+    DRIVE_ROOT_URL=http://127.0.0.1:8765/ python attendance.py
+"""
+import argparse
+import email
+import hashlib
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDrive:
+    def __init__(self):
+        self.files = {}      # file id -> {"id", "name", "parents", "md5Checksum", "content"}
+        self.sessions = {}   # resumable upload id -> {"metadata", "content"}
+        self.requests = []   # (method, path, uploadType) for assertions in benchmarks
+        self.lock = threading.Lock()
+
+    def add_file(self, metadata, content):
+        file_id = uuid.uuid4().hex
+        record = {
+            "id": file_id,
+            "name": metadata.get("name"),
+            "parents": metadata.get("parents", []),
+            "md5Checksum": hashlib.md5(content).hexdigest(),
+            "content": content,
+        }
+        with self.lock:
+            self.files[file_id] = record
+        return {"id": file_id, "md5Checksum": record["md5Checksum"]}
+
+    def list_files(self, query):
+        name = re.search(r"name = '((?:[^'\\]|\\.)*)'", query or "")
+        parent = re.search(r"'([^']+)' in parents", query or "")
+        with self.lock:
+            files = list(self.files.values())
+        if name:
+            files = [f for f in files if f["name"] == name.group(1).replace("\\'", "'").replace("\\\\", "\\")]
+        if parent:
+            files = [f for f in files if parent.group(1) in f["parents"]]
+        return {"files": [{k: f[k] for k in ("id", "name", "md5Checksum")} for f in files]}
+
+
+def _handler(drive):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this keep-alive clients hit delayed-ACK stalls
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, extra_headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (extra_headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            drive.requests.append(("GET", url.path, None))
+            if url.path.rstrip("/") == "/drive/v3/files":
+                query = parse_qs(url.query).get("q", [""])[0]
+                return self._send_json(200, drive.list_files(query))
+            self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            upload_type = params.get("uploadType", [None])[0]
+            drive.requests.append(("POST", url.path, upload_type))
+            body = self._body()
+            if url.path.rstrip("/") != "/upload/drive/v3/files":
+                return self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+            if upload_type == "multipart":
+                message = email.message_from_bytes(
+                    b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+                parts = [part.get_payload(decode=True) for part in message.walk() if not part.is_multipart()]
+                return self._send_json(200, drive.add_file(json.loads(parts[0]), parts[1]))
+            if upload_type == "resumable":
+                upload_id = uuid.uuid4().hex
+                drive.sessions[upload_id] = {"metadata": json.loads(body or b"{}"), "content": b""}
+                location = f"http://{self.headers['Host']}{url.path}?uploadType=resumable&upload_id={upload_id}"
+                return self._send_json(200, {}, {"Location": location})
+            if upload_type == "media":
+                return self._send_json(200, drive.add_file({}, body))
+            self._send_json(400, {"error": {"code": 400, "message": "unsupported uploadType"}})
+
+        def do_PUT(self):
+            url = urlparse(self.path)
+            drive.requests.append(("PUT", url.path, "resumable"))
+            upload_id = parse_qs(url.query).get("upload_id", [None])[0]
+            session = drive.sessions.get(upload_id)
+            body = self._body()
+            if session is None:
+                return self._send_json(404, {"error": {"code": 404, "message": "unknown upload session"}})
+
+            session["content"] += body
+            content_range = self.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            if total != "*" and len(session["content"]) >= int(total):
+                del drive.sessions[upload_id]
+                return self._send_json(200, drive.add_file(session["metadata"], session["content"]))
+
+            self.send_response(308)
+            self.send_header("Range", f"bytes=0-{len(session['content']) - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler
+
+
+def start_fake_drive(host="127.0.0.1", port=0):
+    """Start the stand-in on a background thread; returns (server, drive, root_url)."""
+    drive = FakeDrive()
+    server = ThreadingHTTPServer((host, port), _handler(drive))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, drive, f"http://{host}:{server.server_address[1]}/"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Google Drive stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server, _, root_url = start_fake_drive(args.host, args.port)
+    print(f"Fake Drive listening on {root_url}")
+    threading.Event().wait()
@@ -0,0 +1,352 @@
+"""Local stand-in for the Keka token, directory and attendance APIs.
+
+Generates N synthetic employees with a realistic shape: Support Office staff,
+zone heads, cluster managers, center managers and center staff. Each has
+`groups` (center groups are groupType 3), a Zone custom field, bandInfo and
+`reportsTo`/`l2Manager` links that form a proper reporting tree. Serves:
+
+    POST /connect/token
+    GET  /api/v1/hris/employees?pageNumber=&pageSize=
+    GET  /api/v1/time/attendance?employeeIds=&from=&to=
+
+with optional latency, slow-tail latency and injected 429s.
+
+    python -m standins.fake_keka --employees 10000 --port 8700 --latency-ms 20 --rate-429 0.02
+
+then point the jobs at it (see `env_for`):
+
+    KEKA_URL=http://127.0.0.1:8700/connect/token
+    KEKA_API_BASE=http://127.0.0.1:8700/api/v1
+    KEKA_ATTENDANCE_API_BASE=http://127.0.0.1:8700/api/v1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ZONES = ["North", "South", "East", "West", "Central"]
+STATES = ["AP", "TS", "KA", "TN", "MH", "DL", "UP", "WB"]
+FIRST_NAMES = ["Aarav", "Priya", "Rahul", "Sneha", "Vikram", "Anjali", "Karthik", "Divya", "Arjun", "Meera",
+               "Rohan", "Kavya", "Suresh", "Lakshmi", "Imran", "Fatima", "Joseph", "Mary", "Harpreet", "Neha"]
+LAST_NAMES = ["Sharma", "Reddy", "Iyer", "Khan", "Singh", "Patel", "Nair", "Gupta", "Das", "Rao"]
+STAFF_TITLES = ["Dialysis Technician", "Staff Nurse", "Patient Care Assistant", "Senior Dialysis Technician"]
+SUPPORT_TITLES = ["Executive - HR", "Analyst", "Accountant", "Manager - Operations", "Software Engineer"]
+
+CENTERS_PER_CLUSTER = 5
+STAFF_PER_CENTER = 38
+SUPPORT_SHARE = 0.08
+
+
+def _person(rng, index, employee_number, email_domain="nephroplus.com"):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    employee_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    return {
+        "id": employee_id,
+        "employeeNumber": employee_number,
+        "firstName": first,
+        "middleName": rng.choice(["", "", "", "K", "S"]),
+        "lastName": last,
+        "displayName": f"{first} {last}",
+        "email": f"{first.lower()}.{last.lower()}{index}@{email_domain}",
+        "gender": rng.choice([1, 2]),
+        "mobilePhone": f"9{rng.randrange(10 ** 9):09d}",
+        "employmentStatus": 0 if rng.random() < 0.93 else 1,
+        "bandInfo": {"id": str(rng.randrange(1, 9)), "title": f"Band {rng.randrange(1, 9)}"} if rng.random() < 0.97 else None,
+        "secondaryJobTitle": None,
+        "customFields": [
+            {"id": "cf-blood-group", "title": "Blood Group", "value": rng.choice(["A+", "B+", "O+", "AB+"])},
+        ],
+    }
+
+
+def _ref(manager):
+    return {key: manager[key] for key in ("id", "firstName", "lastName", "email")}
+
+
+def generate_employees(count, seed=42):
+    """Deterministic synthetic directory of `count` employees, in no particular order."""
+    rng = random.Random(seed)
+    employees = []
+    numbers = rng.sample(range(100, max(count * 4, 1000)), count)
+
+    def new(title, group_title, group_type_3, zone, secondary=None, domain="nephroplus.com"):
+        index = len(employees)
+        employee_number = f"NP{numbers[index]:05d}"
+        if index in (7, 11):
+            employee_number = f"TEST00{index % 5 + 1}"
+        emp = _person(rng, index, employee_number, domain)
+        emp["jobTitle"] = {"id": str(sum(map(ord, title))), "title": title}
+        emp["secondaryJobTitle"] = secondary
+        emp["groups"] = [
+            {"id": f"g-{group_title}", "title": group_title, "groupType": 1},
+            {"id": f"g3-{group_type_3}", "title": group_type_3, "groupType": 3},
+        ]
+        emp["customFields"].append({"id": "cf-zone", "title": "Zone", "value": zone})
+        employees.append(emp)
+        return emp
+
+    def link(emp, manager):
+        # The top of the tree reports to itself, as in the HRMS export
+        emp["reportsTo"] = _ref(manager)
+        emp["l2Manager"] = _ref(manager.get("_manager") or manager)
+        emp["_manager"] = manager
+
+    ceo = new("Chief Executive Officer", "Support Office", "Support Office", "Central")
+    link(ceo, ceo)
+    zone_heads = []
+    for zone in ZONES:
+        head = new("Zonal Head", "Support Zones", f"{zone} Zone Office", zone, "Zonal Head")
+        link(head, ceo)
+        zone_heads.append(head)
+
+    support_count = max(1, int(count * SUPPORT_SHARE))
+    support_managers = []
+    while len(employees) < count and len(employees) < 6 + support_count:
+        manager = rng.choice(support_managers) if support_managers and rng.random() < 0.85 else ceo
+        domain = "gmail.com" if rng.random() < 0.02 else "nephroplus.com"
+        emp = new(rng.choice(SUPPORT_TITLES), "Support Office", "Support Office", "Central", domain=domain)
+        link(emp, manager)
+        if len(support_managers) < support_count // 10 + 1:
+            support_managers.append(emp)
+
+    center_index = 0
+    while len(employees) < count:
+        zone_head = zone_heads[center_index // CENTERS_PER_CLUSTER % len(zone_heads)]
+        zone = ZONES[zone_heads.index(zone_head)]
+        cluster = new("Cluster Manager", "Support Zones", f"{zone} Zone Office", zone, "Cluster Manager")
+        link(cluster, zone_head)
+        for _ in range(CENTERS_PER_CLUSTER):
+            if len(employees) >= count:
+                break
+            center_index += 1
+            center = f"{100 + center_index}-{rng.choice(STATES)}-C{center_index:04d}-C"
+            center_manager = new("Center Manager", "Centers", center, zone, "Center Manager")
+            link(center_manager, cluster)
+            for _ in range(STAFF_PER_CENTER):
+                if len(employees) >= count:
+                    break
+                staff = new(rng.choice(STAFF_TITLES), "Centers", center, zone)
+                link(staff, center_manager)
+
+    for emp in employees:
+        emp.pop("_manager", None)
+    rng.shuffle(employees)
+    return employees
+
+
+def generate_attendance(employee, day):
+    """One attendance record for `employee` on `day` (a date), deterministic per pair."""
+    rng = random.Random(f"{employee['id']}:{day.isoformat()}")
+    shift_start = rng.choice([4, 7, 10])
+    in_minute = rng.randrange(0, 60)
+    out_hour = shift_start + rng.choice([8, 9])
+
+    def punch(hour, minute):
+        roll = rng.random()
+        if roll < 0.9:
+            return {"timestamp": f"{day.isoformat()}T{hour:02d}:{minute:02d}:00Z", "attendanceLogSource": 1}
+        if roll < 0.95:
+            return None
+        return {"timestamp": "0001-01-01T00:00:00"}
+
+    gross = round(rng.uniform(7.5, 9.5), 2)
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "employeeIdentifier": employee["id"],
+        "employeeNumber": employee["employeeNumber"],
+        "attendanceDate": f"{day.isoformat()}T00:00:00Z",
+        "shiftStartTime": f"{day.isoformat()}T{shift_start:02d}:00:00Z",
+        "shiftEndTime": f"{day.isoformat()}T{shift_start + 9:02d}:00:00Z",
+        "firstInOfTheDay": punch(shift_start, in_minute),
+        "lastOutOfTheDay": punch(out_hour, rng.randrange(0, 60)),
+        "dayType": rng.choice([0, 0, 0, 1, 2]),
+        "shiftDuration": 9,
+        "shiftEffectiveDuration": rng.choice([8.5, 9]),
+        "totalGrossHours": gross,
+        "totalEffectiveHours": round(gross - 0.05, 2),
+        "totalBreakDuration": 0.05,
+        "totalEffectiveOvertimeDuration": round(max(gross - 9, 0), 2),
+        "totalGrossOvertimeDuration": round(max(gross - 9, 0), 2),
+    }
+
+
+class FakeKeka:
+    def __init__(self, employees, latency_ms=0.0, jitter_ms=0.0, tail_ratio=0.0, tail_latency_ms=0.0,
+                 rate_429=0.0, retry_after=1, seed=7):
+        self.employees = employees
+        self.by_id = {emp["id"]: emp for emp in employees}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tail_ratio = tail_ratio
+        self.tail_latency_ms = tail_latency_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.tokens = set()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"token": 0, "employees": 0, "attendance": 0, "429": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def delay(self):
+        with self.lock:
+            tail = self.rng.random() < self.tail_ratio
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            throttled = self.rng.random() < self.rate_429
+        seconds = max(self.tail_latency_ms if tail else self.latency_ms + jitter, 0) / 1000
+        if seconds:
+            time.sleep(seconds)
+        return throttled
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return token
+
+    def employees_page(self, page_number, page_size):
+        total = len(self.employees)
+        total_pages = max((total + page_size - 1) // page_size, 1)
+        start = (page_number - 1) * page_size
+        return {
+            "succeeded": True,
+            "data": self.employees[start:start + page_size],
+            "pageNumber": page_number,
+            "pageSize": page_size,
+            "totalPages": total_pages,
+            "totalRecords": total,
+        }
+
+    def attendance(self, employee_ids, start, end):
+        records = []
+        for employee_id in employee_ids:
+            employee = self.by_id.get(employee_id)
+            if employee is None:
+                continue
+            day = start
+            while day <= end:
+                records.append(generate_attendance(employee, day))
+                day += timedelta(days=1)
+        return {"succeeded": True, "data": records}
+
+
+def _handler(keka):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this keep-alive clients hit delayed-ACK stalls
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, extra_headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (extra_headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _throttled(self):
+            if keka.delay():
+                keka.count("429")
+                self._send_json(429, {"message": "Too many requests"}, {"Retry-After": str(keka.retry_after)})
+                return True
+            return False
+
+        def _authorized(self):
+            token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+            if token not in keka.tokens:
+                self._send_json(401, {"message": "Unauthorized"})
+                return False
+            return True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+            if urlparse(self.path).path != "/connect/token":
+                return self._send_json(404, {"message": "Not found"})
+            keka.count("token")
+            if self._throttled():
+                return
+            form = parse_qs(body)
+            if not form.get("client_id") or not form.get("api_key"):
+                return self._send_json(400, {"error": "invalid_client"})
+            self._send_json(200, {"access_token": keka.issue_token(), "expires_in": 86400, "token_type": "Bearer"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == "/api/v1/hris/employees":
+                keka.count("employees")
+                if self._throttled() or not self._authorized():
+                    return
+                page = keka.employees_page(int(params.get("pageNumber", 1)), int(params.get("pageSize", 100)))
+                return self._send_json(200, page)
+            if url.path == "/api/v1/time/attendance":
+                keka.count("attendance")
+                if self._throttled() or not self._authorized():
+                    return
+                employee_ids = [i for i in params.get("employeeIds", "").split(",") if i]
+                start = date.fromisoformat(params["from"])
+                end = date.fromisoformat(params.get("to", params["from"]))
+                return self._send_json(200, keka.attendance(employee_ids, start, end))
+            self._send_json(404, {"message": "Not found"})
+
+    return Handler
+
+
+def start_fake_keka(employees=None, count=1000, host="127.0.0.1", port=0, **options):
+    """Start the stand-in on a background thread; returns (server, keka, base_url)."""
+    keka = FakeKeka(employees if employees is not None else generate_employees(count), **options)
+    server = ThreadingHTTPServer((host, port), _handler(keka))
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, keka, f"http://{host}:{server.server_address[1]}"
+
+
+def env_for(base_url):
+    """Environment variables that point the app, bridge and attendance job at the stand-in."""
+    return {
+        "KEKA_URL": f"{base_url}/connect/token",
+        "KEKA_API_BASE": f"{base_url}/api/v1",
+        "KEKA_ATTENDANCE_API_BASE": f"{base_url}/api/v1",
+        "CLIENT_ID": "fake-client",
+        "CLIENT_SECRET": "fake-secret",
+        "GRANT_TYPE": "kekaapi",
+        "SCOPE": "kekaapi",
+        "API_KEY": "fake-api-key",
+        "API_KEY_ATTENDANCE": "fake-attendance-key",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Keka API stand-in")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="Share of requests that take --tail-latency-ms")
+    parser.add_argument("--tail-latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args()
+
+    server, keka, base_url = start_fake_keka(
+        generate_employees(args.employees, args.seed), host=args.host, port=args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, tail_ratio=args.tail_ratio,
+        tail_latency_ms=args.tail_latency_ms, rate_429=args.rate_429)
+    print(f"Fake Keka serving {len(keka.employees)} employees on {base_url}")
+    for key, value in env_for(base_url).items():
+        print(f"{key}={value}")
+    threading.Event().wait()
@@ -0,0 +1,128 @@
+"""Local generator of signed Keka employee change webhooks.
+
+Makes realistic changes to a directory (title changes, transfers to another
+manager, exits, email changes, new joiners and the odd deletion) and POSTs
+them to the app's /webhooks/keka, signed like webhooks.verify expects:
+
+    python -m standins.fake_keka_events --url http://127.0.0.1:8000/webhooks/keka \\
+        --secret dev-secret --employees 1000 --count 50 --batch 5
+
+With --employees it changes the same synthetic directory fake_keka serves
+(same --seed), so run the app against fake_keka first. --snapshot changes a
+directory snapshot instead. --bad-signature sends every batch with a wrong
+signature, to check that the app rejects it. `signed_request` returns the
+body and headers for TestClient.
+"""
+import argparse
+import copy
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import webhooks
+from standins.fake_keka import STAFF_TITLES, _ref, generate_employees
+
+KINDS = ["title", "transfer", "exit", "email", "join", "delete"]
+WEIGHTS = [30, 25, 15, 10, 15, 5]
+
+
+def signed_request(events, secret, timestamp=None):
+    """(body bytes, headers) for POSTing `events` signed with `secret`."""
+    body = json.dumps(events).encode()
+    timestamp = str(int(timestamp or time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        webhooks.TIMESTAMP_HEADER: timestamp,
+        webhooks.SIGNATURE_HEADER: webhooks.sign(body, secret, timestamp),
+    }
+    return body, headers
+
+
+def _event(event_type, employee):
+    return {"eventId": str(uuid.uuid4()), "eventType": event_type, "data": employee}
+
+
+def generate_events(employees, count, seed=7):
+    """`count` change events against `employees`, which is updated in place as they are made."""
+    rng = random.Random(seed)
+    by_key = {employee["id"]: employee for employee in employees}
+    managers = [employee for employee in employees if employee.get("secondaryJobTitle")]
+    events = []
+    while len(events) < count:
+        kind = rng.choices(KINDS, WEIGHTS)[0]
+        employee = copy.deepcopy(rng.choice(list(by_key.values())))
+        if kind == "title":
+            employee["jobTitle"] = {"id": str(rng.randrange(10 ** 6)), "title": rng.choice(STAFF_TITLES)}
+        elif kind == "transfer" and managers:
+            manager = rng.choice(managers)
+            employee["reportsTo"] = _ref(manager)
+            employee["l2Manager"] = manager.get("reportsTo") or _ref(manager)
+        elif kind == "exit":
+            employee["employmentStatus"] = 1
+        elif kind == "email":
+            local, _, domain = (employee.get("email") or "x@nephroplus.com").partition("@")
+            employee["email"] = f"{local}.{rng.randrange(100)}@{domain}"
+        elif kind == "join":
+            employee["id"] = str(uuid.UUID(int=rng.getrandbits(128)))
+            employee["employeeNumber"] = f"NP9{rng.randrange(10 ** 4):04d}"
+            employee["email"] = f"joiner{len(events)}.{rng.randrange(10 ** 4)}@nephroplus.com"
+            employee["employmentStatus"] = 0
+            events.append(_event("employee.created", employee))
+            by_key[employee["id"]] = employee
+            continue
+        elif kind == "delete":
+            events.append(_event("employee.deleted", {"id": employee["id"]}))
+            del by_key[employee["id"]]
+            continue
+        events.append(_event("employee.updated", employee))
+        by_key[employee["id"]] = employee
+    employees[:] = list(by_key.values())
+    return events
+
+
+def post(url, events, secret, bad_signature=False):
+    body, headers = signed_request(events, secret)
+    if bad_signature:
+        headers[webhooks.SIGNATURE_HEADER] = "sha256=" + "0" * 64
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send signed Keka employee change webhooks")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhooks/keka")
+    parser.add_argument("--secret", default=webhooks.secret())
+    parser.add_argument("--employees", type=int, default=1000, help="Size of fake_keka's synthetic directory")
+    parser.add_argument("--seed", type=int, default=42, help="fake_keka's directory seed")
+    parser.add_argument("--snapshot", help="Change this directory snapshot instead of the synthetic one")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1, help="Events per request")
+    parser.add_argument("--interval", type=float, default=0.0, help="Seconds between requests")
+    parser.add_argument("--bad-signature", action="store_true")
+    args = parser.parse_args()
+    if not args.secret:
+        parser.error("--secret or KEKA_WEBHOOK_SECRET is required")
+
+    if args.snapshot:
+        import snapshot
+        employees = snapshot.load_snapshot(args.snapshot)
+    else:
+        employees = generate_employees(args.employees, args.seed)
+    events = generate_events(employees, args.count)
+    for start in range(0, len(events), args.batch):
+        started = time.perf_counter()
+        status, result = post(args.url, events[start:start + args.batch], args.secret, args.bad_signature)
+        print(f"{status} in {(time.perf_counter() - started) * 1000:.1f} ms: {result}")
+        if args.interval:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Local SFTP stand-in for the Nephrocare and Dice uploads.
+
+Accepts any password or public key and stores uploads under a local folder,
+so app.sftp_put and the benchmarks can run a real paramiko upload end to end.
+
+    python -m standins.fake_sftp --port 2222 --root /tmp/sftp-root
+"""
+import argparse
+import os
+import socket
+import threading
+
+import paramiko
+
+
+class _Server(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _Handle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+def _sftp_interface(root):
+    class FolderSFTP(paramiko.SFTPServerInterface):
+        def _local(self, path):
+            return os.path.join(root, os.path.normpath("/" + path).lstrip("/"))
+
+        def open(self, path, flags, attr):
+            local = self._local(path)
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            try:
+                binary = getattr(os, "O_BINARY", 0)
+                fd = os.open(local, flags | binary, 0o644)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = _Handle(flags)
+            handle.filename = local
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def stat(self, path):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def list_folder(self, path):
+            local = self._local(path)
+            try:
+                return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)), name)
+                        for name in os.listdir(local)]
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def remove(self, path):
+            try:
+                os.remove(self._local(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def mkdir(self, path, attr):
+            try:
+                os.makedirs(self._local(path), exist_ok=True)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def chattr(self, path, attr):
+            return paramiko.SFTP_OK
+
+    return FolderSFTP
+
+
+class FakeSFTP:
+    def __init__(self, root, host="127.0.0.1", port=0):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(32)
+        self.host, self.port = self.sock.getsockname()
+        self.sessions = 0
+        self._stopped = threading.Event()
+
+    def _serve_client(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _sftp_interface(self.root))
+        transport.start_server(server=_Server())
+        channel = transport.accept(30)
+        if channel is not None:
+            self.sessions += 1
+        while transport.is_active() and not self._stopped.is_set():
+            self._stopped.wait(0.1)
+
+    def serve_forever(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(client,), daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self.sock.close()
+
+
+def start_fake_sftp(root, host="127.0.0.1", port=0):
+    """Start the stand-in on a background thread; returns the FakeSFTP (see .host/.port)."""
+    os.makedirs(root, exist_ok=True)
+    server = FakeSFTP(root, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SFTP stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--root", default="sftp-root")
+    args = parser.parse_args()
+    server = start_fake_sftp(os.path.abspath(args.root), args.host, args.port)
+    print(f"Fake SFTP listening on {server.host}:{server.port}, storing uploads in {server.root}")
+    threading.Event().wait()
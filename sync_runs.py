@@ -0,0 +1,134 @@
+"""Streaming syncs that notice when their client goes away.
+
+Each /keka_sync request runs its pipeline as a SyncRun task. The SSE
+response only relays the task's progress messages. While the stream is
+idle, the response polls for the client's disconnect every
+SYNC_DISCONNECT_POLL_SECONDS. When the tab is closed, the request's
+`on_disconnect` policy decides what happens:
+
+    cancel   the task is cancelled at its next await: Keka paging stops and
+             the httpx clients and pooled connections are closed on the way out
+    detach   the task runs to the end in the background with nobody listening
+
+An SFTP upload that has started always completes, along with its export-row
+snapshot (see app.upload_to_ftp). Either way, the run's outcome is kept for
+GET /keka_sync/runs.
+"""
+import asyncio
+import itertools
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+POLICIES = ("cancel", "detach")
+KEEP_RUNS = 50
+
+_ids = itertools.count(1)
+_runs = OrderedDict()
+
+
+# Read at call time: app.py loads .env after importing this module
+def default_policy():
+    return os.getenv("SYNC_ON_DISCONNECT", "cancel")
+
+
+def disconnect_poll_seconds():
+    return float(os.getenv("SYNC_DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class SyncRun:
+    def __init__(self, events, policy=None):
+        self.id = next(_ids)
+        self.policy = policy or default_policy()
+        if self.policy not in POLICIES:
+            raise ValueError(f"on_disconnect must be one of {POLICIES}, not {self.policy}")
+        self.status = "running"
+        self.started_at = _now()
+        self.finished_at = None
+        self.disconnected_at = None
+        self.events = 0
+        self.last_event = None
+        self.error = None
+        self._attached = True
+        self._queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run(events))
+        _runs[self.id] = self
+        while len(_runs) > KEEP_RUNS:
+            _runs.popitem(last=False)
+
+    async def _run(self, events):
+        try:
+            async for message in events:
+                self.events += 1
+                self.last_event = message.strip()
+                if self._attached:
+                    self._queue.put_nowait(message)
+            self.status = "finished"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"❌ Sync {self.id} failed: {e}")
+        finally:
+            # Runs the pipeline's own cleanup (httpx clients, transports) even when cancelled
+            await events.aclose()
+            self.finished_at = _now()
+            self._queue.put_nowait(None)
+            print(f"🔁 Sync {self.id} {self.status} after {self.events} events")
+
+    def disconnect(self):
+        """The client went away; apply the run's policy."""
+        if self.task.done() or not self._attached:
+            return
+        self._attached = False
+        self.disconnected_at = _now()
+        if self.policy == "cancel":
+            print(f"🔌 Sync {self.id}: client disconnected, cancelling")
+            self.task.cancel()
+        else:
+            print(f"🔌 Sync {self.id}: client disconnected, finishing in the background")
+
+    async def stream(self, request):
+        """SSE body: the run's messages until it ends or the client disconnects."""
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self._queue.get(), disconnect_poll_seconds())
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            # Also reached when the server cancels the response or a send fails
+            self.disconnect()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "policy": self.policy,
+            "status": self.status,
+            "detached": self.disconnected_at is not None and self.policy == "detach",
+            "started_at": self.started_at,
+            "disconnected_at": self.disconnected_at,
+            "finished_at": self.finished_at,
+            "events": self.events,
+            "last_event": self.last_event,
+            "error": self.error,
+        }
+
+
+def get_run(run_id):
+    return _runs.get(run_id)
+
+
+def recent_runs():
+    return [run.to_dict() for run in reversed(_runs.values())]
@@ -0,0 +1,139 @@
+"""Run several Keka tenants' syncs from one process.
+
+Each group entity has its own Keka tenant, credentials, SFTP destination and
+output folder. They are listed in a JSON file (KEKA_TENANTS_FILE, default
+tenants.json):
+
+    {
+      "tenants": [
+        {
+          "name": "nephroplus",
+          "jobs": ["nephrocare", "attendance"],
+          "env": {
+            "KEKA_URL": "https://login.keka.com/connect/token",
+            "KEKA_API_BASE": "https://nephroplus.keka.com/api/v1",
+            "KEKA_ATTENDANCE_API_BASE": "https://nephroplus.keka.com/api/v1",
+            "API_KEY": "${NEPHROPLUS_API_KEY}",
+            "KEKA_RATE_LIMIT": "0.67",
+            "FTP_HOST_NAME": "sftp.example.com"
+          }
+        }
+      ]
+    }
+
+`env` values may reference the process environment as ${VAR}, so secrets
+stay out of the file. A tenant that references a variable which is not set
+fails at load, naming it, instead of sending the literal "${VAR}" to Keka or
+SFTP; the other tenants still run. Anything a tenant leaves out falls back to the process
+environment. TARGET_FILE_PATH / TARTGET_FILE_PATH default to output/<name>.
+
+The nephrocare job uploads to FTP_HOST_NAME (FTP_USER_NAME / FTP_PASSWORD,
+FTP_FOLDER) and the dice job to DICE_FTP_HOST_NAME (DICE_FTP_USER_NAME,
+PEM_PATH, FTP_FOLDER_DICE), both on FTP_PORT. A tenant without the host keeps
+its files in its output folder only.
+
+`python cli.py tenants` runs every (tenant, job) pair on one bounded thread
+pool (KEKA_TENANT_WORKERS). Each job sees its tenant's settings through
+`getenv`, which overlays the tenant env on os.environ for the current thread or
+asyncio task. keka_http's connection pool is shared by every job, including the
+pipelined attendance run, and rate_limit keeps a bucket per API key with the
+tenant's own budget.
+"""
+import contextvars
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+JOBS = ("directory", "nephrocare", "dice", "attendance")
+
+_tenant_env = contextvars.ContextVar("tenant_env", default=None)
+# $VAR and ${VAR}, as os.path.expandvars reads them
+_ENV_REFERENCE = re.compile(r"\$(\w+)|\$\{([^}]*)\}")
+
+
+def getenv(name, default=None):
+    """os.getenv, seen through the current tenant's settings when a tenant job is running."""
+    overlay = _tenant_env.get()
+    if overlay is not None and name in overlay:
+        return overlay[name]
+    return os.getenv(name, default)
+
+
+def tenants_file():
+    return os.getenv("KEKA_TENANTS_FILE", "tenants.json")
+
+
+def load_tenants(path=None):
+    with open(path or tenants_file()) as f:
+        config = json.load(f)
+
+    tenants = []
+    for tenant in config["tenants"]:
+        name = tenant["name"]
+        raw_env = {key: str(value) for key, value in tenant.get("env", {}).items()}
+        env = {key: os.path.expandvars(value) for key, value in raw_env.items()}
+        output = env.get("TARGET_FILE_PATH") or env.get("TARTGET_FILE_PATH") or os.path.join("output", name)
+        env.setdefault("TARGET_FILE_PATH", output)
+        env.setdefault("TARTGET_FILE_PATH", output)
+        jobs = tenant.get("jobs", ["attendance"])
+        unknown = set(jobs) - set(JOBS)
+        if unknown:
+            raise ValueError(f"Tenant {name}: unknown jobs {sorted(unknown)}")
+        error = None
+        missing = unset_references(raw_env)
+        if missing:
+            error = "; ".join(f"{key} references unset {', '.join(names)}" for key, names in missing.items())
+            print(f"❌ Tenant {name}: {error}")
+        tenants.append({"name": name, "jobs": jobs, "env": env, "error": error})
+    return tenants
+
+
+def unset_references(env):
+    """{key: [variable names]} for the ${VAR} / $VAR references in `env` values that are not set."""
+    missing = {}
+    for key, value in env.items():
+        names = [name for match in _ENV_REFERENCE.finditer(value) for name in match.groups() if name]
+        unset = [name for name in names if name not in os.environ]
+        if unset:
+            missing[key] = unset
+    return missing
+
+
+def run_job(tenant, job, job_args):
+    """Run one cli subcommand with `tenant`'s settings; returns its exit code."""
+    import cli
+
+    token = _tenant_env.set(tenant["env"])
+    try:
+        os.makedirs(tenant["env"]["TARGET_FILE_PATH"], exist_ok=True)
+        print(f"🏢 {tenant['name']}: starting {job}")
+        return cli.COMMANDS[job](job_args) or 0
+    finally:
+        _tenant_env.reset(token)
+
+
+def run_tenants(tenants, job_args, max_workers=None):
+    """Run every tenant's jobs concurrently on one bounded pool; returns {(tenant, job): exit code}."""
+    max_workers = max_workers or int(os.getenv("KEKA_TENANT_WORKERS", "4"))
+    results = {}
+    for tenant in tenants:
+        if tenant.get("error"):
+            for job in tenant["jobs"]:
+                print(f"❌ {tenant['name']}: {job} not run: {tenant['error']}")
+                results[(tenant["name"], job)] = 1
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tenant") as pool:
+        futures = {
+            pool.submit(run_job, tenant, job, job_args): (tenant["name"], job)
+            for tenant in tenants if not tenant.get("error")
+            for job in tenant["jobs"]
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                print(f"❌ {key[0]}: {key[1]} failed: {e}")
+                results[key] = 1
+            print(f"🏢 {key[0]}: {key[1]} finished with exit code {results[key]}")
+    return results
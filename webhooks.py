@@ -0,0 +1,159 @@
+"""Keka employee change webhooks, applied to the live employee index.
+
+Keka (or standins/fake_keka_events.py locally) POSTs employee change events
+to /webhooks/keka, signed with the shared KEKA_WEBHOOK_SECRET:
+
+    X-Keka-Timestamp: 1760870400
+    X-Keka-Signature: sha256=<hex HMAC-SHA256 of "<timestamp>.<raw body>">
+
+    {"eventId": "...", "eventType": "employee.updated", "data": {<employee as in /hris/employees>}}
+
+The body may also be a JSON list of events. employee.created and
+employee.updated upsert `data` by its Keka id, and must carry the whole
+employee: at least UPSERT_REQUIRED_FIELDS, or the body is rejected with 400.
+employee.deleted removes the employee with `data.id`. Exits arrive as
+updates with a new employmentStatus.
+
+Requests with a missing or wrong signature, or a timestamp more than
+KEKA_WEBHOOK_TOLERANCE_SECONDS away, are rejected. Redelivered event ids are
+acknowledged but not applied twice. Accepted events are applied to the live
+index (employee_index.apply_changes). The next export rebuilds the rows of
+the employees they touch (see row_cache). The app rewrites the directory
+snapshot shortly after, so a restart keeps them.
+
+With webhooks on, the directory pull is only a reconciliation for missed
+events: set DIRECTORY_REFRESH_SECONDS to e.g. 86400. Events that arrive
+while a pull is running are replayed on top of its result (`replay_since`).
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+import employee_index
+import tenants
+
+SIGNATURE_HEADER = "X-Keka-Signature"
+TIMESTAMP_HEADER = "X-Keka-Timestamp"
+UPSERT_EVENTS = ("employee.created", "employee.updated")
+DELETE_EVENTS = ("employee.deleted",)
+# An upsert replaces the whole record, so a partial `data` would leave a skeleton employee in the exports
+UPSERT_REQUIRED_FIELDS = ("employeeNumber", "email")
+KEEP_EVENT_IDS = 10000
+KEEP_RECENT_EVENTS = 5000
+
+_lock = threading.Lock()
+_seen_ids = OrderedDict()
+# (received_at, event) for replaying on top of a directory pull that was running meanwhile
+_recent = deque(maxlen=KEEP_RECENT_EVENTS)
+
+
+def secret():
+    return tenants.getenv("KEKA_WEBHOOK_SECRET")
+
+
+def tolerance_seconds():
+    return int(tenants.getenv("KEKA_WEBHOOK_TOLERANCE_SECONDS", "300"))
+
+
+def sign(body, key, timestamp):
+    """Signature header value for `body` (bytes) sent at `timestamp`."""
+    message = str(timestamp).encode() + b"." + body
+    return "sha256=" + hmac.new(key.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify(body, timestamp, signature, key=None, now=None):
+    """Raise PermissionError unless `signature` is `body`'s signature and `timestamp` is recent."""
+    key = key or secret()
+    if not key:
+        raise PermissionError("KEKA_WEBHOOK_SECRET is not set")
+    if not timestamp or not signature:
+        raise PermissionError(f"Missing {TIMESTAMP_HEADER} or {SIGNATURE_HEADER} header")
+    try:
+        age = abs((now or time.time()) - int(timestamp))
+    except ValueError:
+        raise PermissionError(f"Bad {TIMESTAMP_HEADER} header: {timestamp}")
+    if age > tolerance_seconds():
+        raise PermissionError(f"Timestamp is {int(age)}s away from now, replay rejected")
+    if not hmac.compare_digest(sign(body, key, timestamp), signature):
+        raise PermissionError("Signature does not match")
+
+
+def parse_events(body):
+    """The events in a webhook body; raises ValueError when it is not a list of well-formed events."""
+    try:
+        payload = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Body is not JSON: {e}")
+    events = payload if isinstance(payload, list) else [payload]
+    for event in events:
+        if not isinstance(event, dict) or not isinstance(event.get("data"), dict):
+            raise ValueError("Each event needs an object `data`")
+        if event.get("eventType") not in UPSERT_EVENTS + DELETE_EVENTS:
+            raise ValueError(f"Unsupported eventType {event.get('eventType')}")
+        if not employee_index.employee_key(event["data"]):
+            raise ValueError(f"Event {event.get('eventId')} has no employee id")
+        if event["eventType"] in UPSERT_EVENTS:
+            missing = [field for field in UPSERT_REQUIRED_FIELDS if not event["data"].get(field)]
+            if missing:
+                raise ValueError(f"Event {event.get('eventId')} is missing {', '.join(missing)}")
+    return events
+
+
+def changes_from(events):
+    """({key: employee} to upsert, {keys} to delete); a later event for the same employee wins."""
+    upserts = {}
+    deleted = set()
+    for event in events:
+        key = employee_index.employee_key(event["data"])
+        if event["eventType"] in DELETE_EVENTS:
+            upserts.pop(key, None)
+            deleted.add(key)
+        else:
+            deleted.discard(key)
+            upserts[key] = event["data"]
+    return upserts, deleted
+
+
+def _apply(events, source):
+    upserts, deleted = changes_from(events)
+    numbers = employee_index.apply_changes(upserts, deleted, source)
+    return {"upserted": len(upserts), "deleted": len(deleted), "affected_rows": len(numbers)}
+
+
+def apply_events(events):
+    """Apply the events not seen before to the live index.
+
+    Raises LookupError, before recording anything, when no directory has been
+    loaded yet, so the sender's retry is applied once there is one.
+    """
+    if employee_index.current() is None:
+        raise LookupError("No employee directory loaded yet")
+    with _lock:
+        fresh = [event for event in events if event.get("eventId") is None or event["eventId"] not in _seen_ids]
+        result = {"received": len(events), "duplicates": len(events) - len(fresh), "applied": len(fresh)}
+        if not fresh:
+            return result
+        result.update(_apply(fresh, "webhook"))
+        received_at = time.time()
+        for event in fresh:
+            _recent.append((received_at, event))
+            if event.get("eventId") is not None:
+                _seen_ids[event["eventId"]] = received_at
+        while len(_seen_ids) > KEEP_EVENT_IDS:
+            _seen_ids.popitem(last=False)
+    print(f"🪝 Applied {len(fresh)} webhook events: {result['upserted']} upserted, {result['deleted']} deleted")
+    return result
+
+
+def replay_since(started_at):
+    """Re-apply the events received since `started_at` (a time.time()); returns how many."""
+    with _lock:
+        events = [event for received_at, event in _recent if received_at >= started_at]
+        if events:
+            _apply(events, "sync + webhook")
+    if events:
+        print(f"🪝 Replayed {len(events)} webhook events received during the directory pull")
+    return len(events)